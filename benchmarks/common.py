@@ -0,0 +1,67 @@
+"""Shared helpers for the Django-backed benchmarks (micro.py, load.py)."""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+def setup_django():
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "greenroute.settings")
+    import django
+    django.setup()
+
+
+def use_stand_ins(latency=0.0, jitter=0.0):
+    """Point every provider kind at the synthetic backend, with injected latency."""
+    from routeplanner import providers
+    providers.PROVIDER_BACKENDS = {kind: {"synthetic": 0} for kind in providers.KINDS}
+    providers.PROVIDER_LATENCY = {"synthetic": (latency, jitter)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{p}": None for p in points}
+    return {f"p{p}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+
+
+def best_of(fn, repeat):
+    """Fastest of `repeat` runs in ms (the least noisy estimate for micro-benchmarks)."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return round(best * 1000, 3)
+
+
+def write_results(suite, results, path=None):
+    """Write results with commit/machine metadata; defaults to results/<suite>-<commit>.json."""
+    commit = git_commit()
+    path = path or os.path.join(RESULTS_DIR, f"{suite}-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({
+            "suite": suite,
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results,
+        }, f, indent=2)
+    print(f"Results written to {path}")
+    return path
@@ -0,0 +1,62 @@
+"""
+Compare two benchmark result files (micro or load) and flag regressions.
+
+    python benchmarks/compare.py results/micro-abc123.json results/micro-def456.json --threshold 0.1
+
+Timings (keys with _ms / _us) are lower-is-better, throughput (_rps) is
+higher-is-better; other numbers are shown for context only. Exits with
+status 1 when any metric got worse by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def flatten(data, prefix=""):
+    out = {}
+    for key, value in data.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            out.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[path] = value
+    return out
+
+
+def direction(path):
+    if "_rps" in path:
+        return 1
+    if any(unit in path for unit in ("_ms", "_us")):
+        return -1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change that counts as a regression.")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    old, new = flatten(baseline["results"]), flatten(candidate["results"])
+
+    print(f"{baseline['suite']}: {baseline['commit']} -> {candidate['commit']}")
+    regressions = 0
+    for path in sorted(old.keys() & new.keys()):
+        sign = direction(path)
+        if not sign or not old[path]:
+            continue
+        change = (new[path] - old[path]) / old[path]
+        worse = change * sign < -args.threshold
+        regressions += worse
+        flag = "REGRESSION" if worse else ("improved" if change * sign > args.threshold else "")
+        print(f"{path:<55}{old[path]:>12}{new[path]:>12}{change:>+9.1%}  {flag}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
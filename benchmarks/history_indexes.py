@@ -0,0 +1,133 @@
+"""
+Query times for the route-history dashboards on a seeded SQLite table,
+before and after the history indexes and the Place normalization.
+
+    python benchmarks/history_indexes.py --rows 1000000
+
+Runs on plain sqlite3 (no Django settings needed); the schema mirrors
+routeplanner_routehistory as of migration 0006, names and place ids side by
+side. Migration 0009 then drops the name columns and history_pair, so the
+text bytes reported at the end are what each row no longer carries.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+CITIES = [f"City {i:03d}, Tamil Nadu" for i in range(400)]
+
+SCHEMA = """
+CREATE TABLE place (id INTEGER PRIMARY KEY, key TEXT UNIQUE, name TEXT);
+CREATE TABLE history (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    source TEXT, destination TEXT,
+    source_place_id INTEGER, destination_place_id INTEGER,
+    green_cover REAL, pollution_index REAL, distance REAL, eco_cost REAL,
+    created_at TEXT
+);
+"""
+
+INDEXES = [
+    "CREATE INDEX history_created ON history (created_at)",
+    "CREATE INDEX history_user_created ON history (user_id, created_at)",
+    "CREATE INDEX history_pair ON history (source, destination)",
+    "CREATE INDEX history_place_pair ON history (source_place_id, destination_place_id)",
+]
+
+QUERIES = {
+    "latest_10": "SELECT pollution_index FROM history ORDER BY created_at DESC LIMIT 10",
+    "user_page": "SELECT id, source, destination FROM history WHERE user_id = :user ORDER BY created_at DESC LIMIT 50",
+    "last_day": "SELECT COUNT(*) FROM history WHERE created_at >= :since",
+    "pair_count": "SELECT COUNT(*) FROM history WHERE source = :src AND destination = :dst",
+    "place_pair_count": "SELECT COUNT(*) FROM history WHERE source_place_id = :src_id AND destination_place_id = :dst_id",
+}
+
+
+def seed(conn, rows, users):
+    rng = random.Random(42)
+    conn.executemany("INSERT INTO place (id, key, name) VALUES (?, ?, ?)",
+                     [(i + 1, c.lower(), c) for i, c in enumerate(CITIES)])
+    start = datetime(2025, 1, 1)
+    batch = []
+    for i in range(rows):
+        s, d = rng.randrange(len(CITIES)), rng.randrange(len(CITIES))
+        when = start + timedelta(seconds=i * 30)
+        batch.append((rng.randrange(1, users + 1), CITIES[s], CITIES[d], s + 1, d + 1,
+                      rng.uniform(0, 100), rng.uniform(0, 100), rng.uniform(1, 500), rng.uniform(0, 100),
+                      when.isoformat(sep=" ")))
+        if len(batch) == 50000:
+            conn.executemany("INSERT INTO history (user_id, source, destination, source_place_id, "
+                             "destination_place_id, green_cover, pollution_index, distance, eco_cost, created_at) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO history (user_id, source, destination, source_place_id, "
+                         "destination_place_id, green_cover, pollution_index, distance, eco_cost, created_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+    conn.commit()
+    return (start + timedelta(seconds=(rows - 2880) * 30)).isoformat(sep=" ")
+
+
+def time_queries(conn, params, repeat):
+    results = {}
+    for name, sql in QUERIES.items():
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            best = min(best, time.perf_counter() - started)
+        results[name] = round(best * 1000, 3)
+    return results
+
+
+def string_bytes(conn):
+    """Bytes spent on the free-text source/destination columns vs. two integer ids."""
+    text = conn.execute("SELECT SUM(LENGTH(source) + LENGTH(destination)) FROM history").fetchone()[0]
+    return {"text_columns": text, "place_ids": conn.execute("SELECT COUNT(*) FROM history").fetchone()[0] * 2 * 8}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.sqlite3"))
+        conn.executescript(SCHEMA)
+        started = time.perf_counter()
+        since = seed(conn, args.rows, args.users)
+        seeded = time.perf_counter() - started
+        params = {"user": 7, "since": since, "src": CITIES[3], "dst": CITIES[9], "src_id": 4, "dst_id": 10}
+
+        before = time_queries(conn, params, args.repeat)
+        started = time.perf_counter()
+        for sql in INDEXES:
+            conn.execute(sql)
+        conn.execute("ANALYZE")
+        indexed = time.perf_counter() - started
+        after = time_queries(conn, params, args.repeat)
+        sizes = string_bytes(conn)
+        conn.close()
+
+    print(f"{args.rows} rows seeded in {seeded:.1f}s, indexes built in {indexed:.1f}s")
+    print(f"{'query':<18}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for name in QUERIES:
+        speedup = before[name] / after[name] if after[name] else float("inf")
+        print(f"{name:<18}{before[name]:>12.3f}{after[name]:>12.3f}{speedup:>9.0f}x")
+    print(f"source/destination text: {sizes['text_columns'] / 1e6:.1f} MB vs place ids: at most {sizes['place_ids'] / 1e6:.1f} MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"rows": args.rows, "before_ms": before, "after_ms": after, "bytes": sizes}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Load harness for /api/route/ against the synthetic provider stand-ins.
+
+    python benchmarks/load.py --concurrency 16 --requests 2000 --latency 0.05 --jitter 0.02
+
+Runs the real request pipeline (views, caches, scoring, history write-behind)
+in-process through Django's test client on a throwaway SQLite database, with
+deterministic injected provider latency instead of the network. Reports
+p50/p95/p99 latency, throughput and database time; on SQLite the time spent in
+write statements is almost entirely waiting for the database write lock.
+Results go to benchmarks/results/load-<commit>.json unless --json is given.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common  # noqa: E402
+
+WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class QueryTimer:
+    """execute_wrapper that records (is_write, seconds, locked) for every statement."""
+
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        locked = False
+        try:
+            return execute(sql, params, many, context)
+        except Exception as e:
+            locked = "locked" in str(e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.samples.append((sql.lstrip().upper().startswith(WRITE_PREFIXES), elapsed, locked))
+
+    def summary(self):
+        with self._lock:
+            samples = list(self.samples)
+        writes = [s for w, s, _ in samples if w]
+        reads = [s for w, s, _ in samples if not w]
+        ms = lambda values: [v * 1000 for v in values]  # noqa: E731
+        return {
+            "statements": len(samples),
+            "read_ms_total": round(sum(ms(reads)), 1),
+            "write_statements": len(writes),
+            "write_ms_total": round(sum(ms(writes)), 1),
+            "write_ms": {k: None if v is None else round(v, 3) for k, v in common.percentiles(ms(writes)).items()},
+            "write_ms_max": round(max(ms(writes), default=0.0), 3),
+            "locked_errors": sum(1 for _, _, locked in samples if locked),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--places", type=int, default=200, help="Distinct place names to draw pairs from.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean injected provider latency (s).")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Uniform +/- jitter on that latency (s).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Results file (default: benchmarks/results/load-<commit>.json).")
+    args = parser.parse_args()
+
+    common.setup_django()
+    common.use_stand_ins(args.latency, args.jitter)
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.db.backends.signals import connection_created
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    from routeplanner import history
+
+    timer = QueryTimer()
+    connection_created.connect(lambda sender, connection, **kw: connection.execute_wrappers.append(timer), weak=False)
+
+    setup_test_environment()
+    tmp = tempfile.mkdtemp()
+    connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(tmp, "load.sqlite3")
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    user = User.objects.create_user("loadtest", password="loadtest")
+
+    rng = random.Random(args.seed)
+    places = [f"Town {i:04d}" for i in range(args.places)]
+    pairs = [tuple(rng.sample(places, 2)) for _ in range(args.requests)]
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, "client"):
+            local.client = Client()
+            local.client.force_login(user)
+        return local.client
+
+    def hit(pair):
+        c = client()
+        started = time.perf_counter()
+        resp = c.get("/api/route/", {"source": pair[0], "destination": pair[1], "encoding": "polyline"})
+        return time.perf_counter() - started, resp.status_code
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda _: client(), range(args.concurrency * 4)))  # log every worker in up front
+        timer.samples.clear()
+        started = time.perf_counter()
+        outcomes = list(pool.map(hit, pairs))
+        wall = time.perf_counter() - started
+    history.recorder.stop()  # drain the write-behind queue while the database still exists
+
+    latencies = [s * 1000 for s, status in outcomes if status == 200]
+    results = {
+        "config": vars(args),
+        "requests": len(outcomes),
+        "errors": sum(1 for _, status in outcomes if status != 200),
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(outcomes) / wall, 1),
+        "latency_ms": {k: None if v is None else round(v, 2) for k, v in common.percentiles(latencies).items()},
+        "db": timer.summary(),
+        "history": history.recorder.snapshot(),
+    }
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    lat = results["latency_ms"]
+    print(f"{results['requests']} requests, {results['errors']} errors in {wall:.1f}s "
+          f"-> {results['throughput_rps']} req/s")
+    print(f"latency ms  p50 {lat['p50']}  p95 {lat['p95']}  p99 {lat['p99']}")
+    db = results["db"]
+    print(f"db: {db['statements']} statements, {db['write_statements']} writes, "
+          f"write time {db['write_ms_total']} ms (p99 {db['write_ms']['p99']} ms), {db['locked_errors']} lock errors")
+    common.write_results("load", results, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Micro-benchmarks for the routing engine, eco metrics and geometry handling.
+
+    python benchmarks/micro.py --sizes 1000 10000 100000 1000000 --ch-sizes 10000 50000 200000
+
+Needs the Django settings (DJANGO_SETTINGS_MODULE, default greenroute.settings);
+providers are pointed at the synthetic stand-ins, so nothing touches the network.
+Results go to benchmarks/results/micro-<commit>.json unless --json is given.
+"""
+import argparse
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common  # noqa: E402
+
+
+def grid_graph(n, seed=0):
+    """Roughly sqrt(n) x sqrt(n) two-way road grid with random pollution / green cover."""
+    from routeplanner import dijkstra, scoring
+
+    side = max(2, int(np.sqrt(n)))
+    n = side * side
+    rng = np.random.default_rng(seed)
+    lat = 9.0 + (np.arange(n) // side) * 0.01 + rng.uniform(-0.002, 0.002, n)
+    lon = 78.0 + (np.arange(n) % side) * 0.01 + rng.uniform(-0.002, 0.002, n)
+    right = np.arange(n)[np.arange(n) % side != side - 1]
+    down = np.arange(n - side)
+    src = np.concatenate([right, right + 1, down, down + side])
+    dst = np.concatenate([right + 1, right, down + side, down])
+    distance = scoring.haversine_km(lat[src], lon[src], lat[dst], lon[dst]) * rng.uniform(1.0, 1.3, len(src))
+    return dijkstra.Graph.from_edges(n, src, dst, distance, rng.uniform(0, 100, len(src)),
+                                     rng.uniform(0, 100, len(src)), lat=lat, lon=lon)
+
+
+def road_graph(n, shape_points=4, seed=0):
+    """
+    OSM-like graph of about n nodes: a junction grid whose two-way links run
+    through `shape_points` degree-2 nodes each, as ways do in an extract.
+    Pollution / green cover are per link, like build_road_graph's per-way values.
+    """
+    from routeplanner import dijkstra, scoring
+
+    side = max(2, int(np.sqrt(n / (1 + 2 * shape_points))))
+    junctions = side * side
+    rng = np.random.default_rng(seed)
+    jlat = 9.0 + (np.arange(junctions) // side) * 0.01 + rng.uniform(-0.002, 0.002, junctions)
+    jlon = 78.0 + (np.arange(junctions) % side) * 0.01 + rng.uniform(-0.002, 0.002, junctions)
+    right = np.arange(junctions)[np.arange(junctions) % side != side - 1]
+    down = np.arange(junctions - side)
+    a, b = np.concatenate([right, down]), np.concatenate([right + 1, down + side])
+    links = len(a)
+    t = np.arange(1, shape_points + 1) / (shape_points + 1)
+    jitter = (links, shape_points)
+    lat = np.concatenate([jlat, (np.outer(jlat[a], 1 - t) + np.outer(jlat[b], t)
+                                 + rng.uniform(-3e-4, 3e-4, jitter)).ravel()])
+    lon = np.concatenate([jlon, (np.outer(jlon[a], 1 - t) + np.outer(jlon[b], t)
+                                 + rng.uniform(-3e-4, 3e-4, jitter)).ravel()])
+    chain = np.column_stack([a, junctions + np.arange(links * shape_points).reshape(jitter), b])
+    u, v = chain[:, :-1].ravel(), chain[:, 1:].ravel()
+    src, dst = np.concatenate([u, v]), np.concatenate([v, u])
+    pollution = np.tile(np.repeat(rng.uniform(0, 100, links), shape_points + 1), 2)
+    green = np.tile(np.repeat(rng.uniform(0, 100, links), shape_points + 1), 2)
+    distance = scoring.haversine_km(lat[src], lon[src], lat[dst], lon[dst])
+    return dijkstra.Graph.from_edges(len(lat), src, dst, distance, pollution, green, lat=lat, lon=lon)
+
+
+def as_dict(graph):
+    """The legacy {name: {name: km}} shape that dijkstra.dijkstra() takes."""
+    out = {}
+    for u in range(graph.n):
+        lo, hi = graph.indptr[u], graph.indptr[u + 1]
+        out[u] = dict(zip(graph.indices[lo:hi].tolist(), graph.distance[lo:hi].tolist()))
+    return out
+
+
+def bench_graphs(sizes, queries, repeat, dict_limit):
+    from routeplanner import dijkstra, scoring, spatial
+
+    results = {}
+    for size in sizes:
+        graph = grid_graph(size)
+        rng = random.Random(size)
+        pairs = [(rng.randrange(graph.n), rng.randrange(graph.n)) for _ in range(queries)]
+        graph.adjacency()
+        graph.reverse().adjacency()
+        row = {"nodes": graph.n, "edges": len(graph.indices)}
+        for name, search in (("shortest_path", dijkstra.shortest_path),
+                             ("bidirectional_path", dijkstra.bidirectional_path),
+                             ("astar_path", dijkstra.astar_path)):
+            row[f"{name}_ms"] = round(common.best_of(
+                lambda: [search(graph, s, t) for s, t in pairs], repeat) / queries, 3)
+        if graph.n <= dict_limit:
+            legacy = as_dict(graph)
+            row["dijkstra_dict_ms"] = round(common.best_of(
+                lambda: [dijkstra.dijkstra(legacy, s, t, {}, {}) for s, t in pairs], repeat) / queries, 3)
+        clicks = [(rng.uniform(graph.lat.min(), graph.lat.max()), rng.uniform(graph.lon.min(), graph.lon.max()))
+                  for _ in range(queries)]
+        index = spatial.nodes_for(graph.lat, graph.lon)
+        row["snap_us"] = round(common.best_of(
+            lambda: [index.nearest(la, lo) for la, lo in clicks], repeat) * 1000 / queries, 2)
+        row["snap_brute_us"] = round(common.best_of(
+            lambda: [np.argmin(scoring.haversine_km(la, lo, graph.lat, graph.lon)) for la, lo in clicks],
+            repeat) * 1000 / queries, 2)
+        results[str(size)] = row
+        print(f"graph {graph.n:>8} nodes: " + ", ".join(f"{k}={v}" for k, v in row.items() if k.endswith(("_ms", "_us"))))
+    return results
+
+
+def bench_hierarchy(sizes, queries, repeat):
+    """Contraction hierarchy build and queries on road-like graphs, next to A* on the same pairs."""
+    from routeplanner import dijkstra, hierarchy
+
+    results = {}
+    for size in sizes:
+        graph = road_graph(size)
+        rng = random.Random(size)
+        pairs = [(rng.randrange(graph.n), rng.randrange(graph.n)) for _ in range(queries)]
+        built = []
+        build_ms = common.best_of(lambda: built.append(hierarchy.ContractionHierarchy.build(graph, max_nodes=None)), 1)
+        ch = built[0]
+        row = {
+            "nodes": graph.n,
+            "edges": len(graph.indices),
+            "ch_edges": len(ch.up[1]) + len(ch.down[1]),
+            "build_s": round(build_ms / 1000, 1),
+            "ch_cost_ms": round(common.best_of(
+                lambda: [ch.query(s, t, unpack=False) for s, t in pairs], repeat) / queries, 3),
+            "ch_path_ms": round(common.best_of(lambda: [ch.query(s, t) for s, t in pairs], repeat) / queries, 3),
+            "astar_path_ms": round(common.best_of(
+                lambda: [dijkstra.astar_path(graph, s, t) for s, t in pairs], repeat) / queries, 3),
+        }
+        results[str(size)] = row
+        print(f"hierarchy {graph.n:>8} nodes: " + ", ".join(f"{k}={v}" for k, v in row.items() if k.endswith(("_ms", "_s"))))
+    return results
+
+
+def bench_eco_metrics(calls, repeat):
+    from routeplanner import views
+
+    rng = np.random.default_rng(1)
+    points = rng.uniform([8, 76, 8, 76], [13, 80, 13, 80], (calls, 4)).tolist()
+    ms = common.best_of(lambda: [views.compute_eco_metrics(100.0, *p) for p in points], repeat)
+    result = {"calls": calls, "per_call_us": round(ms * 1000 / calls, 2)}
+    print(f"compute_eco_metrics: {result['per_call_us']} us/call")
+    return result
+
+
+def bench_geometry(lengths, repeat):
+    from routeplanner import geometry, scoring
+
+    results = {}
+    for n in lengths:
+        lons = np.linspace(77.0, 79.0, n)
+        coords = np.column_stack([9.9 + 0.05 * np.sin(lons * 30), lons]).round(6).tolist()
+        points, _ = geometry.simplify_for_zoom(coords)
+        row = {
+            "points": n,
+            "simplified_points": len(points),
+            "simplify_ms": common.best_of(lambda: geometry.simplify_for_zoom(coords), repeat),
+            "encode_ms": common.best_of(lambda: geometry.encode_polyline(points), repeat),
+            "encode_full_ms": common.best_of(lambda: geometry.encode_polyline(coords), repeat),
+            "route_profile_ms": common.best_of(
+                lambda: scoring.route_profile(coords, lambda la, lo: np.full(len(la), 60.0)), repeat),
+        }
+        results[str(n)] = row
+        print(f"geometry {n:>8} points: " + ", ".join(f"{k}={v}" for k, v in row.items() if k.endswith("_ms")))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--queries", type=int, default=20, help="Random source/target pairs per graph.")
+    parser.add_argument("--dict-limit", type=int, default=100000,
+                        help="Largest graph to also run through the dict-based dijkstra() wrapper.")
+    parser.add_argument("--ch-sizes", type=int, nargs="+", default=[10000, 50000, 200000],
+                        help="Road-like graph sizes to contract and query (the build is timed once).")
+    parser.add_argument("--geometry", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--eco-calls", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="Results file (default: benchmarks/results/micro-<commit>.json).")
+    args = parser.parse_args()
+
+    common.setup_django()
+    common.use_stand_ins()
+    results = {
+        "graphs": bench_graphs(args.sizes, args.queries, args.repeat, args.dict_limit),
+        "hierarchy": bench_hierarchy(args.ch_sizes, args.queries, args.repeat),
+        "compute_eco_metrics": bench_eco_metrics(args.eco_calls, args.repeat),
+        "geometry": bench_geometry(args.geometry, args.repeat),
+    }
+    common.write_results("micro", results, args.json)
+
+
+if __name__ == "__main__":
+    main()
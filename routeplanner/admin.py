@@ -3,8 +3,8 @@ from django.contrib import admin
 from django.urls import path
 from django.shortcuts import render
 from django.contrib.auth import get_user_model
-from .models import Route
-from django.db.models import Avg, Count
+from .models import DailyRouteStats, RoutePairStats, RouteHistory
+from . import rollups
 
 User = get_user_model()
 
@@ -22,33 +22,28 @@ class CustomAdminSite(admin.AdminSite):
 
     def dashboard_view(self, request):
         total_users = User.objects.count()
-        total_routes = Route.objects.count()
-        avg_eco_cost = Route.objects.aggregate(avg_cost=Avg('eco_cost'))['avg_cost'] or 0
-
-        # Pollution trends (group by date)
-        pollution_trends = (
-            Route.objects.values("created_at__date")
-            .annotate(total=Count("id"))
-            .order_by("created_at__date")
-        )
-
-        # Most used routes (group by source/destination)
-        popular_routes = (
-            Route.objects.values("source", "destination")
-            .annotate(total=Count("id"))
-            .order_by("-total")[:5]
-        )
+        stats = rollups.dashboard_stats(days=30, top=5)
+
+        # Pollution trends (routes per date over the last 30 days with traffic, from the daily rollup)
+        pollution_trends = [{"created_at__date": d.date, "total": d.routes} for d in stats["recent_days"]]
+
+        # Most used routes (per source/destination rollup)
+        popular_routes = [
+            {"source": p.source, "destination": p.destination, "total": p.routes} for p in stats["popular"]
+        ]
 
         context = {
             "total_users": total_users,
-            "total_routes": total_routes,
-            "avg_eco_cost": round(avg_eco_cost, 2),
-            "pollution_trends": list(pollution_trends),
-            "popular_routes": list(popular_routes),
+            "total_routes": stats["total_routes"],
+            "avg_eco_cost": round(stats["avg_eco_cost"], 2),
+            "pollution_trends": pollution_trends,
+            "popular_routes": popular_routes,
         }
         return render(request, "admin/dashboard.html", context)
 
 # replace default admin with our custom admin
 custom_admin_site = CustomAdminSite(name='custom_admin')
 custom_admin_site.register(User)
-custom_admin_site.register(Route)
+custom_admin_site.register(RouteHistory)
+custom_admin_site.register(DailyRouteStats)
+custom_admin_site.register(RoutePairStats)
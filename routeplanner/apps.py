@@ -3,3 +3,10 @@ from django.apps import AppConfig
 class RouteplannerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'routeplanner'
+
+    def ready(self):
+        from django.core.signals import request_started
+
+        from . import warmup
+
+        request_started.connect(warmup.start_on_first_request, dispatch_uid="greenroute-warmup")
@@ -0,0 +1,171 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Place, RouteHistory
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+HISTORY_RETENTION_DAYS = getattr(settings, "HISTORY_RETENTION_DAYS", 365)
+HISTORY_ARCHIVE_DIR = getattr(settings, "HISTORY_ARCHIVE_DIR", os.path.join(getattr(settings, "BASE_DIR", ""), "archive"))
+HISTORY_ARCHIVE_CHUNK = getattr(settings, "HISTORY_ARCHIVE_CHUNK", 2000)
+
+
+def _month_path(directory, month):
+    return os.path.join(directory, f"{RouteHistory._meta.db_table}-{month:%Y-%m}.ndjson.gz")
+
+
+def _users_path(directory, month):
+    # user ids with rows in the month's archive, one JSON list per archived chunk
+    return os.path.join(directory, f"{RouteHistory._meta.db_table}-{month:%Y-%m}.users")
+
+
+def _month_has_user(directory, month, user):
+    try:
+        with open(_users_path(directory, month), encoding="utf-8") as f:
+            return any(user in json.loads(line) for line in f)
+    except FileNotFoundError:
+        return True  # archived before the index existed
+
+
+def _serialize(value):
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+
+def archive_history(before=None, directory=HISTORY_ARCHIVE_DIR, chunk=HISTORY_ARCHIVE_CHUNK, pause=0.0):
+    """
+    Move rows older than `before` (default: HISTORY_RETENTION_DAYS ago) into
+    gzip NDJSON files, one per calendar month, then delete them.
+    Each chunk is appended to its archive and fsync'd before a short delete
+    transaction, so the write lock is held for one chunk at a time and a crash
+    can at worst leave a chunk in both places (readers skip duplicate ids).
+    Chunks are read by keyset from the last (time, pk) archived, so each one
+    is an index seek rather than a rescan from the oldest row. Rows keep their
+    place names next to the ids, so an archive reads without the Place table,
+    and each month lists its users so one user's export can skip the rest.
+    Returns the number of rows archived.
+    """
+    from . import exports
+
+    before = before or timezone.now() - timedelta(days=HISTORY_RETENTION_DAYS)
+    columns = [f.attname for f in RouteHistory._meta.concrete_fields]
+    os.makedirs(directory, exist_ok=True)
+    moved = 0
+    cursor = None
+
+    while True:
+        rows = list(
+            exports._after(RouteHistory.objects.filter(created_at__lt=before), "created_at", cursor, False)
+            .order_by("created_at", "pk").values(*columns)[:chunk]
+        )
+        if not rows:
+            return moved
+        cursor = (rows[-1]["created_at"], rows[-1]["id"])
+
+        names = Place.names(row[f"{p}_place_id"] for row in rows for p in ("source", "destination"))
+        by_month = {}
+        for row in rows:
+            row["source"] = names.get(row["source_place_id"])
+            row["destination"] = names.get(row["destination_place_id"])
+            by_month.setdefault(row["created_at"].replace(day=1).date(), []).append(row)
+        for month, month_rows in by_month.items():
+            # the index goes first: listing a user whose rows never landed costs a read, not a miss
+            with open(_users_path(directory, month), "a", encoding="utf-8") as f:
+                f.write(json.dumps(sorted({row["user_id"] for row in month_rows}, key=str)) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            # appending opens a new gzip member; readers see one continuous stream
+            with gzip.open(_month_path(directory, month), "at", encoding="utf-8") as f:
+                for row in month_rows:
+                    f.write(json.dumps({k: _serialize(v) for k, v in row.items()}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+        with transaction.atomic():
+            RouteHistory.objects.filter(pk__in=[row["id"] for row in rows]).delete()
+        moved += len(rows)
+        logger.info(f"Archived {moved} history rows so far")
+        if pause:
+            time.sleep(pause)
+
+
+def archived_months(directory=HISTORY_ARCHIVE_DIR):
+    paths = glob.glob(os.path.join(directory, f"{RouteHistory._meta.db_table}-*.ndjson.gz"))
+    return sorted(datetime.strptime(p[-len("YYYY-MM.ndjson.gz"):-len(".ndjson.gz")], "%Y-%m").date() for p in paths)
+
+
+def _place_ids(row, places):
+    # rows archived while history still stored only names: look their places up, never create them
+    for name in ("source", "destination"):
+        if row.get(f"{name}_place_id") is None:
+            if row[name] not in places:
+                places[row[name]] = Place.find([row[name]]).get(row[name])
+            place = places[row[name]]
+            row[f"{name}_place_id"] = place.pk if place else None
+            row[name] = place.name if place else row[name]
+
+
+def iter_archive(start=None, end=None, directory=HISTORY_ARCHIVE_DIR, user=None):
+    """
+    Yield archived rows (dicts, timestamps parsed, place names included) with
+    start <= created_at < end, oldest month first; `user` (an id) narrows it
+    to one user's rows and skips months they have none in. Reads only: rows
+    whose place is unknown keep their name and a None place id.
+    """
+    places = {}
+    for month in archived_months(directory):
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        if (start and next_month <= start.date()) or (end and month > end.date()):
+            continue
+        if user is not None and not _month_has_user(directory, month, user):
+            continue
+        seen = set()
+        with gzip.open(_month_path(directory, month), "rt", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                if row["id"] in seen or (user is not None and row.get("user_id") != user):
+                    continue
+                seen.add(row["id"])
+                row["created_at"] = parse_datetime(row["created_at"])
+                if (start and row["created_at"] < start) or (end and row["created_at"] >= end):
+                    continue
+                _place_ids(row, places)
+                yield row
+
+
+def iter_history(start=None, end=None, directory=HISTORY_ARCHIVE_DIR, chunk_size=2000, user=None):
+    """
+    Read-through over archived and live rows, as dicts, archives first;
+    `user` (an id) narrows it to one user's rows.
+    Each row is yielded once, even if an interrupted archive run left its
+    last chunk both in an archive and in the table.
+    """
+    live = RouteHistory.objects.order_by("created_at", "pk")
+    if user is not None:
+        live = live.filter(user_id=user)
+    if start:
+        live = live.filter(created_at__gte=start)
+    if end:
+        live = live.filter(created_at__lt=end)
+    oldest_live = live.values_list("created_at", flat=True).first()
+    # only archived rows at least as new as the oldest live one can be in both places
+    overlap = set()
+    for row in iter_archive(start, end, directory, user):
+        if oldest_live is not None and row["created_at"] >= oldest_live:
+            overlap.add(row["id"])
+        yield row
+    for row in live.values(*[f.attname for f in RouteHistory._meta.concrete_fields]).iterator(chunk_size=chunk_size):
+        if row["id"] not in overlap:
+            yield row
@@ -0,0 +1,227 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.conf import settings
+
+from . import metrics, scheduler
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+HTTP_POOL_SIZE = getattr(settings, "HTTP_POOL_SIZE", 32)
+HTTP_RETRIES = getattr(settings, "HTTP_RETRIES", 2)
+HTTP_BACKOFF = getattr(settings, "HTTP_BACKOFF", 0.3)  # seconds, doubled per retry
+HTTP_BACKOFF_JITTER = getattr(settings, "HTTP_BACKOFF_JITTER", 0.2)
+CIRCUIT_FAILURE_THRESHOLD = getattr(settings, "CIRCUIT_FAILURE_THRESHOLD", 5)
+CIRCUIT_RESET_TIMEOUT = getattr(settings, "CIRCUIT_RESET_TIMEOUT", 30)  # seconds
+CIRCUIT_FORBIDDEN_TIMEOUT = getattr(settings, "CIRCUIT_FORBIDDEN_TIMEOUT", 10 * 60)
+
+# provider -> HTTP methods that are safe to retry
+PROVIDERS = {
+    "ors": ("GET", "POST"),
+    "nominatim": ("GET",),
+    "osrm": ("GET",),
+    "agro": ("GET",),  # polygon creation is not idempotent
+    "overpass": ("GET", "POST"),
+}
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `threshold` consecutive failures (or at once on 401/403);
+    open -> half-open after the cool-down, where a single trial call decides.
+    """
+
+    def __init__(self, name, threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_until = 0.0
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.failures < self.threshold:
+            return "closed"
+        return "open" if time.monotonic() < self.opened_until else "half-open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def release(self):
+        """Give back a half-open trial that never reached the provider."""
+        with self._lock:
+            self.trial_running = False
+
+    def available(self):
+        return self.state != "open"
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.trial_running = False
+
+    def record_failure(self, open_for=None):
+        with self._lock:
+            self.trial_running = False
+            self.failures = self.threshold if open_for else self.failures + 1
+            if self.failures >= self.threshold:
+                self.opened_until = time.monotonic() + (open_for or self.reset_timeout)
+                logger.warning(f"Circuit for {self.name} opened for {open_for or self.reset_timeout}s")
+
+
+class ProviderClient:
+    """Keep-alive session for one provider with retries and a circuit breaker."""
+
+    def __init__(self, name, retry_methods=("GET",)):
+        self.name = name
+        self.breaker = CircuitBreaker(name)
+        self.retry_methods = frozenset(retry_methods)
+        # urllib3 only retries connections that never reached the provider; a retry
+        # after a response goes back through request() and pays for its own token
+        retry = Retry(
+            total=HTTP_RETRIES,
+            connect=HTTP_RETRIES,
+            read=0,
+            status=0,
+            backoff_factor=HTTP_BACKOFF,
+            backoff_jitter=HTTP_BACKOFF_JITTER,
+            allowed_methods=self.retry_methods,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def available(self):
+        return self.breaker.available()
+
+    def request(self, method, url, key_param=None, key_header=None, endpoint=None, **kwargs):
+        """
+        Send through the circuit breaker and the rate-limit scheduler of the
+        provider's `endpoint` (may raise CircuitOpenError or
+        scheduler.RateLimitedError). Retry-safe
+        methods are retried on RETRY_STATUSES, each attempt taking its own token.
+        With API keys configured, the chosen key goes into the `key_param` query
+        parameter or the `key_header` header.
+        """
+        if not self.breaker.allow():
+            metrics.provider_errors.inc(self.name, "circuit_open")
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        limiter = scheduler.get_scheduler(self.name, endpoint)
+        attempts = 1 + (HTTP_RETRIES if method.upper() in self.retry_methods else 0)
+        resp = slot = None
+        try:
+            for attempt in range(attempts):
+                if attempt:
+                    time.sleep(self._retry_delay(attempt, resp))
+                try:
+                    slot = limiter.acquire() if limiter else None
+                except scheduler.RateLimitedError:
+                    if resp is None:
+                        raise
+                    break  # out of tokens for a retry; the last answer stands
+                resp = self._send(limiter, slot, method, url, key_param, key_header, kwargs)
+                if resp.status_code not in RETRY_STATUSES:
+                    break
+        except requests.RequestException:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            if resp is None:
+                self.breaker.release()
+            raise
+
+        if resp.status_code in (401, 403):
+            # with several keys only the rejected one is benched
+            if slot is not None and slot.key and limiter.block(slot, CIRCUIT_FORBIDDEN_TIMEOUT):
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure(open_for=CIRCUIT_FORBIDDEN_TIMEOUT)
+        elif resp.status_code in RETRY_STATUSES:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return resp
+
+    def _send(self, limiter, slot, method, url, key_param, key_header, kwargs):
+        if slot is not None and slot.key:
+            if key_param:
+                kwargs["params"] = dict(kwargs.get("params") or {}, **{key_param: slot.key})
+            if key_header:
+                kwargs["headers"] = dict(kwargs.get("headers") or {}, **{key_header: slot.key})
+        started = time.perf_counter()
+        try:
+            resp = self.session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            metrics.provider_seconds.observe(time.perf_counter() - started, self.name, "error")
+            metrics.provider_errors.inc(self.name, type(e).__name__)
+            raise
+        metrics.provider_seconds.observe(time.perf_counter() - started, self.name, str(resp.status_code))
+        if resp.status_code >= 400:
+            metrics.provider_errors.inc(self.name, f"http_{resp.status_code}")
+        if slot is not None:
+            limiter.observe(slot, resp)
+        return resp
+
+    def _retry_delay(self, attempt, resp):
+        delay = HTTP_BACKOFF * 2 ** (attempt - 1) + random.uniform(0, HTTP_BACKOFF_JITTER)
+        if resp.status_code != 429:  # a 429's Retry-After already benches the key in the scheduler
+            try:
+                delay = max(delay, float(resp.headers.get("Retry-After") or 0))
+            except (AttributeError, TypeError, ValueError):
+                pass
+        return delay
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(name):
+    with _lock:
+        if name not in _clients:
+            _clients[name] = ProviderClient(name, PROVIDERS.get(name, ("GET",)))
+        return _clients[name]
+
+
+def available(name):
+    """False while the provider's circuit is open, so callers can skip straight to a fallback."""
+    return get_client(name).available()
+
+
+def reset():
+    with _lock:
+        for client in _clients.values():
+            client.session.close()
+        _clients.clear()
@@ -1,48 +1,360 @@
 import heapq
 
-def dijkstra(graph, start, end, pollution, green_cover):
+import numpy as np
+
+INF = float("inf")
+NO_PATH_COST = float("-inf")  # eco_cost of the name-keyed wrappers when there is no path, as before the CSR engine
+
+
+class EcoWeights:
     """
-    graph        : dictionary -> { 'A': {'B': distance, 'C': distance}, ... }
-    start, end   : source & destination city names
-    pollution    : dictionary -> { 'A': 10, 'B': 20, ... }
-    green_cover  : dictionary -> { 'A': 5, 'B': 8, ... }
+    Coefficients of the composite edge weight
+
+        distance_km * (distance + pollution * p / 100 + green * (1 - g / 100))
+
+    where p and g are the edge's pollution index and green cover (0-100).
+    Every term is non-negative, so plain Dijkstra stays correct.
     """
 
-    # Priority Queue → (-eco_cost, current_node, path)
-    pq = [(0, start, [start])]
-    visited = set()
+    def __init__(self, distance=1.0, pollution=0.3, green=0.4):
+        if min(distance, pollution, green) < 0:
+            raise ValueError("Eco weight coefficients must be non-negative")
+        self.distance = distance
+        self.pollution = pollution
+        self.green = green
+
+    def key(self):
+        return (self.distance, self.pollution, self.green)
+
+    def min_factor(self):
+        """Smallest per-km multiplier any edge can have."""
+        return self.distance
+
+
+DEFAULT_WEIGHTS = EcoWeights()
+
+
+class Graph:
+    """
+    Directed road graph in CSR form: the edges leaving node u are
+    indices[indptr[u]:indptr[u + 1]], with per-edge distance (km), pollution
+    and green cover in parallel arrays. Nodes are 0..n-1; `names` maps them
+    back to caller ids, `lat`/`lon` are optional coordinates. `eco` is the
+    weight set the graph was built for, which routing on it should use.
+    """
 
+    def __init__(self, indptr, indices, distance, pollution, green, names=None, lat=None, lon=None, eco=None):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.distance = np.asarray(distance, dtype=np.float64)
+        self.pollution = np.asarray(pollution, dtype=np.float64)
+        self.green = np.asarray(green, dtype=np.float64)
+        self.n = len(self.indptr) - 1
+        self.names = list(names) if names is not None else list(range(self.n))
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.lat = None if lat is None else np.asarray(lat, dtype=np.float64)
+        self.lon = None if lon is None else np.asarray(lon, dtype=np.float64)
+        self.eco = eco or DEFAULT_WEIGHTS
+        self._weights = {}
+        self._reverse = None
+
+    @classmethod
+    def from_edges(cls, n, src, dst, distance, pollution=None, green=None, **kwargs):
+        """Build from parallel edge arrays (unsorted is fine)."""
+        src = np.asarray(src, dtype=np.int64)
+        order = np.argsort(src, kind="stable")
+        zeros = np.zeros(len(src))
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+        return cls(
+            indptr,
+            np.asarray(dst, dtype=np.int64)[order],
+            np.asarray(distance, dtype=np.float64)[order],
+            (zeros if pollution is None else np.asarray(pollution, dtype=np.float64))[order],
+            (zeros + 100 if green is None else np.asarray(green, dtype=np.float64))[order],
+            **kwargs
+        )
+
+    @classmethod
+    def from_dict(cls, graph, pollution=None, green_cover=None):
+        """
+        Build from the legacy { 'A': {'B': distance, ...}, ... } shape; node
+        pollution / green cover apply to the edges entering that node.
+        """
+        pollution = pollution or {}
+        green_cover = green_cover or {}
+        names = list(graph)
+        for nbrs in graph.values():
+            names.extend(v for v in nbrs if v not in graph)
+        names = list(dict.fromkeys(names))
+        ids = {name: i for i, name in enumerate(names)}
+        src, dst, dist = [], [], []
+        for u, nbrs in graph.items():
+            for v, d in nbrs.items():
+                src.append(ids[u])
+                dst.append(ids[v])
+                dist.append(d)
+        return cls.from_edges(
+            len(names), src, dst, dist,
+            [pollution.get(names[v], 0) for v in dst],
+            [green_cover.get(names[v], 0) for v in dst],
+            names=names,
+        )
+
+    def weights(self, eco=DEFAULT_WEIGHTS):
+        """Composite edge weights for `eco`, cached per coefficient set."""
+        key = eco.key()
+        if key not in self._weights:
+            factor = (eco.distance + eco.pollution * self.pollution / 100
+                      + eco.green * (1 - np.clip(self.green, 0, 100) / 100))
+            self._weights[key] = self.distance * factor
+        return self._weights[key]
+
+    def adjacency(self, eco=DEFAULT_WEIGHTS):
+        """Python lists of (indptr, indices, weights) for the hot search loops."""
+        key = ("lists",) + eco.key()
+        if key not in self._weights:
+            self._weights[key] = (self.indptr.tolist(), self.indices.tolist(), self.weights(eco).tolist())
+        return self._weights[key]
+
+    def reverse(self):
+        """The same graph with every edge flipped (shares no arrays)."""
+        if self._reverse is None:
+            src = np.repeat(np.arange(self.n), np.diff(self.indptr))
+            self._reverse = Graph.from_edges(
+                self.n, self.indices, src, self.distance, self.pollution, self.green,
+                names=self.names, lat=self.lat, lon=self.lon, eco=self.eco
+            )
+        return self._reverse
+
+
+def save_graph(graph, path):
+    np.savez_compressed(
+        path, indptr=graph.indptr, indices=graph.indices, distance=graph.distance,
+        pollution=graph.pollution, green=graph.green, names=np.asarray(graph.names),
+        lat=graph.lat if graph.lat is not None else np.empty(0),
+        lon=graph.lon if graph.lon is not None else np.empty(0),
+        eco=np.asarray(graph.eco.key()),
+    )
+
+
+def load_graph(path):
+    with np.load(path) as data:
+        return Graph(
+            data["indptr"], data["indices"], data["distance"], data["pollution"], data["green"],
+            names=data["names"].tolist(),
+            lat=data["lat"] if len(data["lat"]) else None,
+            lon=data["lon"] if len(data["lon"]) else None,
+            # graphs saved before the weights were stored used the defaults
+            eco=EcoWeights(*data["eco"].tolist()) if "eco" in data else None,
+        )
+
+
+def _unwind(pred, target):
+    path = []
+    node = target
+    while node != -1:
+        path.append(node)
+        node = pred[node]
+    return path[::-1]
+
+
+def shortest_path(graph, source, target, eco=DEFAULT_WEIGHTS):
+    """
+    Dijkstra over node ids with a predecessor array instead of copied paths.
+    Returns (cost, [node ids]); (inf, []) when target is unreachable.
+    """
+    indptr, indices, weights = graph.adjacency(eco)
+    dist = [INF] * graph.n
+    pred = [-1] * graph.n
+    dist[source] = 0.0
+    pq = [(0.0, source)]
     while pq:
-        neg_eco_cost, node, path = heapq.heappop(pq)
-        eco_cost = -neg_eco_cost  # convert back to positive
+        d, u = heapq.heappop(pq)
+        if d > dist[u]:
+            continue
+        if u == target:
+            return d, _unwind(pred, target)
+        for e in range(indptr[u], indptr[u + 1]):
+            v = indices[e]
+            nd = d + weights[e]
+            if nd < dist[v]:
+                dist[v] = nd
+                pred[v] = u
+                heapq.heappush(pq, (nd, v))
+    return INF, []
 
-        if node in visited:
+
+def bidirectional_path(graph, source, target, eco=DEFAULT_WEIGHTS):
+    """
+    Bidirectional Dijkstra: grows a forward search from source and a backward
+    search (on the reversed graph) from target, and stops as soon as the two
+    frontier minima can no longer improve the best meeting point.
+    """
+    if source == target:
+        return 0.0, [source]
+    fwd = graph.adjacency(eco)
+    bwd = graph.reverse().adjacency(eco)
+    dist = ([INF] * graph.n, [INF] * graph.n)
+    pred = ([-1] * graph.n, [-1] * graph.n)
+    done = (set(), set())
+    dist[0][source] = dist[1][target] = 0.0
+    pqs = ([(0.0, source)], [(0.0, target)])
+    best, meet = INF, -1
+
+    while pqs[0] and pqs[1]:
+        if pqs[0][0][0] + pqs[1][0][0] >= best:
+            break
+        side = 0 if pqs[0][0][0] <= pqs[1][0][0] else 1
+        indptr, indices, weights = fwd if side == 0 else bwd
+        d, u = heapq.heappop(pqs[side])
+        if u in done[side]:
+            continue
+        done[side].add(u)
+        for e in range(indptr[u], indptr[u + 1]):
+            v = indices[e]
+            nd = d + weights[e]
+            if nd < dist[side][v]:
+                dist[side][v] = nd
+                pred[side][v] = u
+                heapq.heappush(pqs[side], (nd, v))
+            total = nd + dist[1 - side][v]
+            if total < best:
+                best, meet = total, v
+
+    if meet == -1:
+        return INF, []
+    path = _unwind(pred[0], meet)
+    node = pred[1][meet]
+    while node != -1:
+        path.append(node)
+        node = pred[1][node]
+    return best, path
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0088 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def astar_path(graph, source, target, eco=DEFAULT_WEIGHTS):
+    """
+    A* with the straight-line distance to target times the smallest per-km eco
+    factor as heuristic. That never overestimates as long as edge distances are
+    at least the great-circle distance between their endpoints, which holds for
+    graphs built from road geometry. Needs graph.lat / graph.lon.
+    """
+    if graph.lat is None or graph.lon is None:
+        raise ValueError("A* needs node coordinates")
+    indptr, indices, weights = graph.adjacency(eco)
+    h = (_haversine_km(graph.lat, graph.lon, graph.lat[target], graph.lon[target])
+         * eco.min_factor() * (1 - 1e-9)).tolist()
+    dist = [INF] * graph.n
+    pred = [-1] * graph.n
+    dist[source] = 0.0
+    pq = [(h[source], source)]
+    while pq:
+        f, u = heapq.heappop(pq)
+        d = dist[u]
+        if f > d + h[u]:
+            continue
+        if u == target:
+            return d, _unwind(pred, target)
+        for e in range(indptr[u], indptr[u + 1]):
+            v = indices[e]
+            nd = d + weights[e]
+            if nd < dist[v]:
+                dist[v] = nd
+                pred[v] = u
+                heapq.heappush(pq, (nd + h[v], v))
+    return INF, []
+
+
+def _restricted_path(adjacency, n, source, target, banned_nodes, banned_edges):
+    """shortest_path that may not enter `banned_nodes` or use `banned_edges` ((u, v) pairs)."""
+    indptr, indices, weights = adjacency
+    dist = [INF] * n
+    pred = [-1] * n
+    dist[source] = 0.0
+    pq = [(0.0, source)]
+    while pq:
+        d, u = heapq.heappop(pq)
+        if d > dist[u]:
             continue
-        visited.add(node)
-
-        # ✅ If destination reached → return result
-        if node == end:
-            return {
-                "path": path,
-                "eco_cost": round(eco_cost, 2)
-            }
-
-        # Traverse neighbours
-        for neighbor in graph.get(node, {}):
-            if neighbor not in visited:
-                # ✅ Eco-cost formula
-                cost = (
-                    green_cover.get(neighbor, 0) * 0.4   # benefit
-                    - pollution.get(neighbor, 0) * 0.3   # penalty
-                )
-
-                # Push with negative cost for max-heap behavior
-                heapq.heappush(
-                    pq, (-(eco_cost + cost), neighbor, path + [neighbor])
-                )
-
-    # ❌ No path found
+        if u == target:
+            return d, _unwind(pred, target)
+        for e in range(indptr[u], indptr[u + 1]):
+            v = indices[e]
+            if v in banned_nodes or (u, v) in banned_edges:
+                continue
+            nd = d + weights[e]
+            if nd < dist[v]:
+                dist[v] = nd
+                pred[v] = u
+                heapq.heappush(pq, (nd, v))
+    return INF, []
+
+
+def k_shortest_paths(graph, source, target, k, eco=DEFAULT_WEIGHTS):
+    """
+    Yen's algorithm: up to k loopless paths in increasing eco cost, as
+    [(cost, [node ids]), ...]. Each new path deviates from an earlier one at
+    some spur node, with the edges already used from that prefix removed.
+    """
+    adjacency = graph.adjacency(eco)
+    indptr, indices, weights = adjacency
+
+    def edge_cost(u, v):
+        return min(weights[e] for e in range(indptr[u], indptr[u + 1]) if indices[e] == v)
+
+    first = shortest_path(graph, source, target, eco)
+    if not first[1]:
+        return []
+    paths = [first]
+    candidates = []
+    seen = {tuple(first[1])}
+    while len(paths) < k:
+        last = paths[-1][1]
+        for i in range(len(last) - 1):
+            spur, root = last[i], last[:i + 1]
+            banned_edges = {(p[1][i], p[1][i + 1]) for p in paths if p[1][:i + 1] == root}
+            spur_cost, spur_path = _restricted_path(adjacency, graph.n, spur, target, set(root[:-1]), banned_edges)
+            if not spur_path:
+                continue
+            path = root[:-1] + spur_path
+            if tuple(path) in seen:
+                continue
+            seen.add(tuple(path))
+            root_cost = sum(edge_cost(a, b) for a, b in zip(root, root[1:]))
+            heapq.heappush(candidates, (root_cost + spur_cost, path))
+        if not candidates:
+            break
+        paths.append(heapq.heappop(candidates))
+    return paths
+
+
+def dijkstra(graph, start, end, pollution, green_cover, eco=DEFAULT_WEIGHTS):
+    """
+    graph        : dictionary -> { 'A': {'B': distance, 'C': distance}, ... }
+    start, end   : source & destination city names
+    pollution    : dictionary -> { 'A': 10, 'B': 20, ... }
+    green_cover  : dictionary -> { 'A': 5, 'B': 8, ... }
+
+    Compatibility wrapper around the CSR engine: eco_cost is the composite,
+    non-negative cost of the cheapest path (see EcoWeights). As before, a trip
+    from a node to itself is [start] at cost 0 even when the node is not in the
+    graph, and no path is an empty path with eco_cost NO_PATH_COST (-inf).
+    """
+    if start == end:
+        return {"path": [start], "eco_cost": 0}
+    g = Graph.from_dict(graph, pollution, green_cover)
+    if start not in g.ids or end not in g.ids:
+        return {"path": [], "eco_cost": NO_PATH_COST}
+    cost, path = bidirectional_path(g, g.ids[start], g.ids[end], eco)
+    if not path:
+        return {"path": [], "eco_cost": NO_PATH_COST}
     return {
-        "path": [],
-        "eco_cost": float("-inf")
+        "path": [g.names[i] for i in path],
+        "eco_cost": round(cost, 2)
     }
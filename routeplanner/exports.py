@@ -0,0 +1,152 @@
+import base64
+import csv
+import itertools
+import json
+from datetime import date, datetime
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+from . import archive
+from .models import Place, RouteHistory
+
+# -------------------------
+# Config
+# -------------------------
+HISTORY_PAGE_SIZE = getattr(settings, "HISTORY_PAGE_SIZE", 50)
+HISTORY_PAGE_MAX = getattr(settings, "HISTORY_PAGE_MAX", 500)
+HISTORY_EXPORT_CHUNK = getattr(settings, "HISTORY_EXPORT_CHUNK", 2000)
+
+
+def _fields(model):
+    """values() arguments for the exported fields: every column except the user FK, places by name."""
+    plain, places = [], {}
+    for f in model._meta.concrete_fields:
+        if f.name == "user":
+            continue
+        if f.related_model is Place:
+            places[f.name.removesuffix("_place")] = F(f"{f.name}__name")
+        else:
+            plain.append(f.attname)
+    return plain, places
+
+
+def columns(model):
+    """Exported column names, in the order _values() returns them."""
+    plain, places = _fields(model)
+    return plain + list(places)
+
+
+def _values(queryset):
+    plain, places = _fields(queryset.model)
+    return queryset.values(*plain, **places)
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+
+def encode_cursor(when, pk):
+    """Opaque keyset cursor for the row (when, pk)."""
+    return base64.urlsafe_b64encode(json.dumps([when.isoformat(), pk]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """(when, pk) from encode_cursor; ValueError if the token is not one of ours."""
+    try:
+        when, pk = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        when = parse_datetime(when)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"bad cursor: {e}")
+    if when is None or not isinstance(pk, int):
+        raise ValueError("bad cursor")
+    return when, pk
+
+
+def _after(queryset, field, cursor, newest_first):
+    """
+    Rows strictly past `cursor` in (field, pk) order. On RouteHistory.created_at
+    the history_user_created and history_created indexes serve this seek (SQLite
+    keeps the pk at the end of every index entry, so the tie-break is covered too).
+    """
+    if cursor is None:
+        return queryset
+    when, pk = cursor
+    # the plain range term is what lets the planner seek; the OR alone forces a scan
+    if newest_first:
+        return queryset.filter(Q(**{f"{field}__lte": when}),
+                               Q(**{f"{field}__lt": when}) | Q(**{field: when, "pk__lt": pk}))
+    return queryset.filter(Q(**{f"{field}__gte": when}),
+                           Q(**{f"{field}__gt": when}) | Q(**{field: when, "pk__gt": pk}))
+
+
+def page(queryset, cursor=None, size=HISTORY_PAGE_SIZE):
+    """
+    One page of history, newest first: (rows as dicts, next cursor or None).
+    Keyset pagination, so page 1000 costs the same as page 1 and rows
+    inserted meanwhile don't shift later pages.
+    """
+    rows = list(_values(_after(queryset, "created_at", cursor, True).order_by("-created_at", "-pk"))[:size + 1])
+    more = len(rows) > size
+    rows = rows[:size]
+    next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"]) if more else None
+    return [{k: _value(v) for k, v in row.items()} for row in rows], next_cursor
+
+
+def iter_rows(queryset, chunk=HISTORY_EXPORT_CHUNK):
+    """
+    Every row of `queryset`, oldest first, as dicts. Each chunk is its own
+    short keyset query read through iterator(chunk_size=chunk), so memory stays
+    flat and no read transaction lasts longer than one chunk.
+    """
+    cursor = None
+    while True:
+        rows = _values(_after(queryset, "created_at", cursor, False).order_by("created_at", "pk"))[:chunk]
+        last = None
+        for row in rows.iterator(chunk_size=chunk):
+            last = row
+            yield row
+        if last is None:
+            return
+        cursor = (last["created_at"], last["id"])
+
+
+def iter_with_archive(user=None, start=None, end=None, chunk=HISTORY_EXPORT_CHUNK):
+    """
+    Like iter_rows, but through archive.iter_history, so rows archive_history
+    already moved out come first: one user's (or everyone's) rows with
+    start <= time < end, in the export's shape.
+    """
+    plain, places = _fields(RouteHistory)
+    rows = archive.iter_history(start, end, archive.HISTORY_ARCHIVE_DIR, chunk, user=user)
+    while True:
+        batch = list(itertools.islice(rows, chunk))
+        if not batch:
+            return
+        # archived rows carry their place names; live ones only the ids
+        names = Place.names(row[f"{p}_place_id"] for row in batch for p in places if p not in row)
+        for row in batch:
+            yield {**{k: row.get(k) for k in plain},
+                   **{p: row[p] if p in row else names.get(row[f"{p}_place_id"]) for p in places}}
+
+
+class _Echo:
+    """csv.writer target that hands each line back instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(queryset, chunk=HISTORY_EXPORT_CHUNK, rows=None):
+    """CSV of `queryset`, or of `rows` (export-shaped dicts, e.g. from iter_with_archive) when given."""
+    names = columns(queryset.model)
+    writer = csv.writer(_Echo())
+    yield writer.writerow(names)
+    for row in iter_rows(queryset, chunk) if rows is None else rows:
+        yield writer.writerow([_value(row[name]) for name in names])
+
+
+def stream_ndjson(queryset, chunk=HISTORY_EXPORT_CHUNK, rows=None):
+    for row in iter_rows(queryset, chunk) if rows is None else rows:
+        yield json.dumps({k: _value(v) for k, v in row.items()}) + "\n"
@@ -0,0 +1,146 @@
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from . import metrics, spatial
+from .models import GeocodeCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+DAY = 24 * 60 * 60
+
+GEOCODE_CACHE_SIZE = getattr(settings, "GEOCODE_CACHE_SIZE", 4096)
+GEOCODE_CACHE_TTL = {
+    "ors": 30 * DAY,
+    "nominatim": 30 * DAY,
+    **getattr(settings, "GEOCODE_CACHE_TTL", {}),
+}
+GEOCODE_NEGATIVE_TTL = getattr(settings, "GEOCODE_NEGATIVE_TTL", DAY)
+
+_lru = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "db_hits": 0, "misses": 0, "negative_hits": 0, "stores": 0}
+
+
+def normalize_place(place):
+    """
+    Cache key for a free-text place name: accents stripped, case folded,
+    whitespace collapsed ("  Tiruchirāppalli ,TN" -> "tiruchirappalli, tn").
+    """
+    text = unicodedata.normalize("NFKD", place or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"\s+", " ", text.casefold()).strip()
+    return re.sub(r"\s*,\s*", ", ", text)
+
+
+def _bump(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def _remember(key, value, expires):
+    with _lock:
+        _lru[key] = (value, expires)
+        _lru.move_to_end(key)
+        while len(_lru) > GEOCODE_CACHE_SIZE:
+            _lru.popitem(last=False)
+
+
+def get(provider, place):
+    """
+    Look up a cached geocode.
+    Returns (hit, coords) where coords is (lat, lon), or None for a cached "not found".
+    """
+    key = (provider, normalize_place(place))
+    now = time.time()
+
+    with _lock:
+        entry = _lru.get(key)
+        if entry and entry[1] > now:
+            _lru.move_to_end(key)
+            _stats["hits"] += 1
+            if entry[0] is None:
+                _stats["negative_hits"] += 1
+            return True, entry[0]
+        if entry:
+            del _lru[key]
+
+    try:
+        row = GeocodeCacheEntry.objects.filter(
+            provider=provider,
+            query=key[1],
+            expires_at__gt=datetime.fromtimestamp(now, dt_timezone.utc),
+        ).first()
+    except DatabaseError as e:
+        logger.error(f"Geocode cache read error: {e}")
+        row = None
+
+    if row is None:
+        _bump("misses")
+        return False, None
+
+    coords = (row.lat, row.lon) if row.found else None
+    _remember(key, coords, row.expires_at.timestamp())
+    _bump("db_hits")
+    if coords is None:
+        _bump("negative_hits")
+    return True, coords
+
+
+def put(provider, place, coords):
+    """Store a geocode result; pass coords=None to cache a "not found"."""
+    key = (provider, normalize_place(place))
+    ttl = GEOCODE_CACHE_TTL.get(provider, 7 * DAY) if coords else GEOCODE_NEGATIVE_TTL
+    expires = time.time() + ttl
+    _remember(key, coords, expires)
+    _bump("stores")
+    spatial.add_place(key[1], coords)
+
+    lat, lon = coords if coords else (None, None)
+    try:
+        GeocodeCacheEntry.objects.update_or_create(
+            provider=provider,
+            query=key[1],
+            defaults={
+                "lat": lat,
+                "lon": lon,
+                "found": coords is not None,
+                "expires_at": datetime.fromtimestamp(expires, dt_timezone.utc),
+            },
+        )
+    except DatabaseError as e:
+        logger.error(f"Geocode cache write error: {e}")
+
+
+def stats():
+    with _lock:
+        return dict(_stats, size=len(_lru))
+
+
+@metrics.register_collector
+def _collect():
+    s = stats()
+    size = s.pop("size")
+    return [
+        ("greenroute_geocode_cache_events_total", "counter", "Geocode cache lookups and stores.",
+         {(("event", k),): v for k, v in s.items()}),
+        ("greenroute_geocode_cache_entries", "gauge", "Entries in the in-process geocode cache.", {(): size}),
+    ]
+
+
+def clear():
+    """Drop the in-process tier (the DB tier expires on its own)."""
+    with _lock:
+        _lru.clear()
+        for name in _stats:
+            _stats[name] = 0
@@ -0,0 +1,114 @@
+import numpy as np
+
+from django.conf import settings
+
+# -------------------------
+# Config
+# -------------------------
+GEOMETRY_DEFAULT_ZOOM = getattr(settings, "GEOMETRY_DEFAULT_ZOOM", None)  # None: fit the route
+GEOMETRY_PIXEL_TOLERANCE = getattr(settings, "GEOMETRY_PIXEL_TOLERANCE", 0.5)  # max deviation, screen pixels
+GEOMETRY_VIEWPORT_PX = getattr(settings, "GEOMETRY_VIEWPORT_PX", 800)
+POLYLINE_PRECISION = getattr(settings, "POLYLINE_PRECISION", 5)
+
+MAX_ZOOM = 19
+METERS_PER_DEGREE = 111320.0
+
+
+def meters_per_pixel(zoom, lat=0.0):
+    """Web-mercator ground resolution of a 256px tile at `zoom`."""
+    return 156543.03392 * np.cos(np.radians(lat)) / 2 ** zoom
+
+
+def fit_zoom(points, viewport_px=GEOMETRY_VIEWPORT_PX):
+    """Largest zoom at which the route's bounding box fits the viewport (what fitBounds picks)."""
+    if len(points) < 2:
+        return MAX_ZOOM
+    lat = float(points[:, 0].mean())
+    span_m = max(np.ptp(points[:, 0]), np.ptp(points[:, 1]) * np.cos(np.radians(lat))) * METERS_PER_DEGREE
+    if span_m <= 0:
+        return MAX_ZOOM
+    return int(np.clip(np.floor(np.log2(156543.03392 * np.cos(np.radians(lat)) * viewport_px / span_m)), 0, MAX_ZOOM))
+
+
+def simplify(points, tolerance_deg, keep=()):
+    """
+    Douglas-Peucker over an (n, 2) [lat, lon] array in a local equirectangular
+    projection. Returns the sorted indices of the vertices to keep; indices in
+    `keep` (e.g. segment boundaries) always survive. Iterative, so long routes
+    can't hit the recursion limit.
+    """
+    n = len(points)
+    if n <= 2 or tolerance_deg <= 0:
+        return np.arange(n)
+    xy = np.column_stack((points[:, 1] * np.cos(np.radians(points[:, 0].mean())), points[:, 0]))
+    kept = np.zeros(n, dtype=bool)
+    kept[[0, n - 1]] = True
+    kept[[i for i in keep if 0 <= i < n]] = True
+
+    anchors = np.flatnonzero(kept)
+    stack = list(zip(anchors[:-1], anchors[1:]))
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        seg = xy[b] - xy[a]
+        rel = xy[a + 1:b] - xy[a]
+        length = np.hypot(seg[0], seg[1])
+        if length == 0:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance_deg:
+            mid = a + 1 + i
+            kept[mid] = True
+            stack.append((a, mid))
+            stack.append((mid, b))
+    return np.flatnonzero(kept)
+
+
+def simplify_for_zoom(coords, zoom=None, keep=(), pixel_tolerance=GEOMETRY_PIXEL_TOLERANCE):
+    """Simplify so the error stays under `pixel_tolerance` pixels at `zoom` (default: the fitted zoom)."""
+    points = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if zoom is None:
+        zoom = GEOMETRY_DEFAULT_ZOOM if GEOMETRY_DEFAULT_ZOOM is not None else fit_zoom(points)
+    if not len(points):
+        return points, np.arange(0)
+    zoom = min(max(int(zoom), 0), MAX_ZOOM)
+    tolerance = pixel_tolerance * meters_per_pixel(zoom, float(points[:, 0].mean())) / METERS_PER_DEGREE
+    index = simplify(points, tolerance, keep)
+    return points[index], index
+
+
+def encode_polyline(coords, precision=POLYLINE_PRECISION):
+    """Google encoded polyline for [[lat, lon], ...]."""
+    factor = 10 ** precision
+    scaled = np.round(np.asarray(coords, dtype=np.float64).reshape(-1, 2) * factor).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel().tolist()
+    out = []
+    for value in deltas:
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            out.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        out.append(chr(value + 63))
+    return "".join(out)
+
+
+def decode_polyline(encoded, precision=POLYLINE_PRECISION):
+    factor = 10 ** precision
+    values, value, shift = [], 0, 0
+    for ch in encoded:
+        b = ord(ch) - 63
+        value |= (b & 0x1f) << shift
+        shift += 5
+        if b < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    lat = lon = 0
+    coords = []
+    for dlat, dlon in zip(values[::2], values[1::2]):
+        lat += dlat
+        lon += dlon
+        coords.append([lat / factor, lon / factor])
+    return coords
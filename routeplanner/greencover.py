@@ -0,0 +1,202 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from . import clients, singleflight
+from .models import GreenCoverCell
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+AGRO_API_KEY = getattr(settings, "AGRO_API_KEY", "")
+AGRO_URL = "http://api.agromonitoring.com/agro/1.0"
+GREEN_COVER_CELL_DEG = getattr(settings, "GREEN_COVER_CELL_DEG", 0.02)  # ~2.2 km
+GREEN_COVER_TTL = getattr(settings, "GREEN_COVER_TTL", 5 * 24 * 60 * 60)  # Sentinel-2 revisit
+GREEN_COVER_CACHE_SIZE = getattr(settings, "GREEN_COVER_CACHE_SIZE", 4096)  # cells kept in memory
+NDVI_LOOKBACK = 30 * 24 * 60 * 60
+
+_cells = OrderedDict()  # cell -> (green_cover, expires), least recently used first
+_lock = threading.Lock()
+
+
+def cell_for(lat, lon):
+    size = GREEN_COVER_CELL_DEG
+    return f"{math.floor(lat / size)}:{math.floor(lon / size)}"
+
+
+def cell_polygon(cell):
+    row, col = (int(v) for v in cell.split(":"))
+    size = GREEN_COVER_CELL_DEG
+    s, w = row * size, col * size
+    n, e = s + size, w + size
+    return [[[w, s], [w, n], [e, n], [e, s], [w, s]]]
+
+
+def ndvi_to_cover(ndvi):
+    return round(max(0, min(100, (ndvi + 1) * 50)), 1)
+
+
+def _cached(cell):
+    with _lock:
+        entry = _cells.get(cell)
+        if entry and entry[1] > time.time():
+            _cells.move_to_end(cell)
+            return entry[0]
+        return None
+
+
+def _remember(cell, value, expires):
+    with _lock:
+        _cells[cell] = (value, expires)
+        _cells.move_to_end(cell)
+        while len(_cells) > GREEN_COVER_CACHE_SIZE:
+            _cells.popitem(last=False)
+
+
+def _register_polygon(cell):
+    resp = clients.get_client("agro").post(
+        f"{AGRO_URL}/polygons",
+        json={
+            "name": f"greenroute-{cell}",
+            "geo_json": {
+                "type": "Feature",
+                "properties": {},
+                "geometry": {"type": "Polygon", "coordinates": cell_polygon(cell)},
+            },
+        },
+        key_param="appid",
+        timeout=12
+    )
+    resp.raise_for_status()
+    return resp.json().get("id")
+
+
+def _delete_polygon(polygon_id):
+    try:
+        clients.get_client("agro").request(
+            "DELETE", f"{AGRO_URL}/polygons/{polygon_id}", key_param="appid", timeout=12
+        )
+    except Exception as e:
+        logger.error(f"Agro polygon {polygon_id} could not be deleted: {e}")
+
+
+def _new_polygon(cell, row):
+    """
+    Register the cell's polygon and record its id on the saved row at once.
+    Without a saved row nothing is registered, and a polygon whose id can't be
+    recorded is deleted again, so failures never leave orphans behind. If
+    another worker recorded one first, ours is deleted and theirs is used.
+    """
+    if not row.pk:
+        return ""
+    polygon_id = _register_polygon(cell)
+    if not polygon_id:
+        return ""
+    try:
+        recorded = GreenCoverCell.objects.filter(pk=row.pk, polygon_id="").update(polygon_id=polygon_id)
+    except DatabaseError as e:
+        logger.error(f"Green cover cell save error: {e}")
+        _delete_polygon(polygon_id)
+        return ""
+    if not recorded:
+        _delete_polygon(polygon_id)
+        return GreenCoverCell.objects.filter(pk=row.pk).values_list("polygon_id", flat=True).first() or ""
+    return polygon_id
+
+
+def _latest_ndvi(polygon_id):
+    now = int(time.time())
+    resp = clients.get_client("agro").get(
+        f"{AGRO_URL}/ndvi/history",
+        params={"polyid": polygon_id, "start": now - NDVI_LOOKBACK, "end": now},
+        key_param="appid",
+        timeout=12
+    )
+    resp.raise_for_status()
+    data = resp.json()
+    if isinstance(data, list) and data:
+        latest = max(data, key=lambda item: item.get("dt", 0))
+        return latest.get("data", {}).get("mean", latest.get("mean"))
+    return None
+
+
+def green_cover(lat, lon):
+    """
+    Green cover (%) for the grid cell containing (lat, lon), or None if unavailable.
+    One Agro polygon is registered per cell and reused; each cell's NDVI mean
+    is cached for GREEN_COVER_TTL so nearby lookups share a single value.
+    No lock is held over the Agro calls: concurrent misses on one cell share
+    a single fetch through singleflight, and other cells are never held up.
+    """
+    cell = cell_for(lat, lon)
+    cached = _cached(cell)
+    if cached is not None:
+        return cached
+    return singleflight.do(("green_cover_cell", cell), _load, cell)
+
+
+def _load(cell):
+    cached = _cached(cell)  # filled while this caller was getting in line
+    if cached is not None:
+        return cached
+    try:
+        row, _ = GreenCoverCell.objects.get_or_create(cell=cell)
+    except DatabaseError as e:
+        logger.error(f"Green cover cell lookup error: {e}")
+        row = GreenCoverCell(cell=cell)
+
+    if _fresh(cell, row):
+        return row.green_cover
+    # another worker process may be fetching this cell already; wait for its row
+    return singleflight.locked_fill(f"greencover:{cell}", lambda: _reread(cell), lambda: _refresh(cell, row))
+
+
+def _fresh(cell, row):
+    if row.green_cover is not None and row.fetched_at:
+        expires = row.fetched_at.timestamp() + GREEN_COVER_TTL
+        if expires > time.time():
+            _remember(cell, row.green_cover, expires)
+            return True
+    return False
+
+
+def _reread(cell):
+    try:
+        row = GreenCoverCell.objects.filter(cell=cell).first()
+    except DatabaseError:
+        return False, None
+    return (True, row.green_cover) if row and _fresh(cell, row) else (False, None)
+
+
+def _refresh(cell, row):
+    try:
+        if not row.polygon_id:
+            row.polygon_id = _new_polygon(cell, row)
+        ndvi = _latest_ndvi(row.polygon_id) if row.polygon_id else None
+    except Exception as e:
+        logger.error(f"Agro API error: {e}")
+        ndvi = None
+
+    if ndvi is not None:
+        row.green_cover = ndvi_to_cover(ndvi)
+        row.fetched_at = datetime.now(dt_timezone.utc)
+        _remember(cell, row.green_cover, time.time() + GREEN_COVER_TTL)
+    try:
+        if row.pk:
+            row.save()
+    except DatabaseError as e:
+        logger.error(f"Green cover cell save error: {e}")
+    return row.green_cover  # possibly stale, still better than the default
+
+
+def clear():
+    with _lock:
+        _cells.clear()
@@ -0,0 +1,151 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import metrics, rollups, tiles
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+HISTORY_WRITE_BEHIND = getattr(settings, "HISTORY_WRITE_BEHIND", True)
+HISTORY_QUEUE_SIZE = getattr(settings, "HISTORY_QUEUE_SIZE", 10000)
+HISTORY_BATCH_SIZE = getattr(settings, "HISTORY_BATCH_SIZE", 200)
+HISTORY_FLUSH_INTERVAL = getattr(settings, "HISTORY_FLUSH_INTERVAL", 2.0)  # seconds
+HISTORY_ENQUEUE_TIMEOUT = getattr(settings, "HISTORY_ENQUEUE_TIMEOUT", 0.05)  # max wait when the queue is full
+
+
+class HistoryRecorder:
+    """
+    Write-behind buffer for history rows (unsaved model instances).
+    Requests only enqueue; a background thread bulk_creates batches once
+    `batch_size` rows are waiting or `flush_interval` has passed. When the
+    queue is full a request waits at most `enqueue_timeout`, then the row is
+    dropped and counted rather than slowing the response down.
+    """
+
+    def __init__(self, queue_size=HISTORY_QUEUE_SIZE, batch_size=HISTORY_BATCH_SIZE,
+                 flush_interval=HISTORY_FLUSH_INTERVAL, enqueue_timeout=HISTORY_ENQUEUE_TIMEOUT):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.stats = {"queued": 0, "flushed": 0, "dropped": 0, "failed": 0, "batches": 0}
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def record(self, row):
+        if not HISTORY_WRITE_BEHIND:
+            self.write([row])
+            return
+        self._ensure_worker()
+        try:
+            self.queue.put(row, timeout=self.enqueue_timeout)
+        except queue.Full:
+            with self._lock:
+                self.stats["dropped"] += 1
+            return
+        with self._lock:
+            self.stats["queued"] += 1
+
+    def write(self, rows):
+        """bulk_create rows grouped by model; never raises."""
+        by_model = defaultdict(list)
+        for row in rows:
+            by_model[type(row)].append(row)
+        for model, batch in by_model.items():
+            try:
+                with metrics.timer("history_write"):
+                    model.objects.bulk_create(batch, batch_size=self.batch_size)
+            except Exception as e:
+                logger.error(f"Failed to save {len(batch)} {model.__name__} rows: {e}")
+                with self._lock:
+                    self.stats["failed"] += len(batch)
+                continue
+            with self._lock:
+                self.stats["flushed"] += len(batch)
+                self.stats["batches"] += 1
+            try:
+                rollups.apply(batch)
+            except Exception as e:
+                logger.error(f"Failed to update rollups: {e}")
+            try:
+                tiles.apply(batch)
+            except Exception as e:
+                logger.error(f"Failed to store route geometry: {e}")
+
+    def _drain(self, limit):
+        rows = []
+        while len(rows) < limit:
+            try:
+                rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and not self._stop.is_set():
+                try:
+                    batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+                batch.extend(self._drain(self.batch_size - len(batch)))
+            if batch:
+                self.write(batch)
+                close_old_connections()
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                    self._thread.start()
+
+    def flush(self):
+        """Write everything queued so far from the calling thread."""
+        while True:
+            rows = self._drain(self.batch_size)
+            if not rows:
+                return
+            self.write(rows)
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, pending=self.queue.qsize())
+
+
+recorder = HistoryRecorder()
+atexit.register(recorder.stop)
+
+
+@metrics.register_collector
+def _collect():
+    snap = recorder.snapshot()
+    pending = snap.pop("pending")
+    return [
+        ("greenroute_history_rows_total", "counter", "History rows by write-behind outcome.",
+         {(("outcome", k),): v for k, v in snap.items()}),
+        ("greenroute_history_queue_depth", "gauge", "History rows waiting to be written.", {(): pending}),
+    ]
+
+
+def record(row):
+    recorder.record(row)
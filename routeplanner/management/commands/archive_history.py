@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from routeplanner import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move route history older than the retention window into monthly gzip NDJSON archives. "
+        "Safe to run from cron, e.g. nightly: `manage.py archive_history --pause 0.05`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=archive.HISTORY_RETENTION_DAYS,
+                            help="Keep this many days of history in the database.")
+        parser.add_argument("--dir", default=archive.HISTORY_ARCHIVE_DIR)
+        parser.add_argument("--chunk", type=int, default=archive.HISTORY_ARCHIVE_CHUNK,
+                            help="Rows per delete transaction.")
+        parser.add_argument("--pause", type=float, default=0.0,
+                            help="Seconds to sleep between chunks so live writers get the lock.")
+
+    def handle(self, *args, **opts):
+        before = timezone.now() - timedelta(days=opts["days"])
+        moved = archive.archive_history(before, opts["dir"], opts["chunk"], opts["pause"])
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} rows older than {before:%Y-%m-%d} to {opts['dir']}"))
@@ -0,0 +1,85 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from routeplanner import raster
+
+# OSM tag -> weight; vertices of matching features are binned into the grid
+GREEN_TAGS = {
+    ("natural", "tree"): 1,
+    ("natural", "wood"): 5,
+    ("landuse", "forest"): 5,
+    ("leisure", "park"): 3,
+    ("landuse", "grass"): 1,
+    ("landuse", "meadow"): 2,
+}
+POLLUTION_TAGS = {
+    ("highway", "motorway"): 5,
+    ("highway", "trunk"): 4,
+    ("highway", "primary"): 3,
+    ("highway", "secondary"): 2,
+    ("landuse", "industrial"): 5,
+    ("power", "plant"): 8,
+}
+
+
+def _vertices(geometry):
+    coords = geometry.get("coordinates", [])
+    kind = geometry.get("type")
+    if kind == "Point":
+        return [coords]
+    if kind in ("LineString", "MultiPoint"):
+        return coords
+    if kind in ("Polygon", "MultiLineString"):
+        return [pt for ring in coords for pt in ring]
+    if kind == "MultiPolygon":
+        return [pt for poly in coords for ring in poly for pt in ring]
+    return []
+
+
+def _weight(properties, tags):
+    return max((w for (k, v), w in tags.items() if properties.get(k) == v), default=0)
+
+
+class Command(BaseCommand):
+    help = "Build the offline green-cover / pollution raster from local NDVI and OSM extracts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bbox", nargs=4, type=float, required=True,
+                            metavar=("SOUTH", "WEST", "NORTH", "EAST"))
+        parser.add_argument("--cell", type=float, default=0.01, help="Cell size in degrees (default 0.01).")
+        parser.add_argument("--ndvi", action="append", default=[], help="CSV with lat,lon,ndvi columns.")
+        parser.add_argument("--osm", action="append", default=[], help="GeoJSON extract with OSM tags as properties.")
+        parser.add_argument("--out", default=raster.ECO_RASTER_PATH, help="Output path without extension.")
+
+    def handle(self, *args, **opts):
+        if not opts["ndvi"] and not opts["osm"]:
+            raise CommandError("Pass at least one --ndvi or --osm input.")
+
+        ndvi, green, pollution = [], [], []
+        for path in opts["ndvi"]:
+            with open(path, newline="") as f:
+                for row in csv.DictReader(f):
+                    ndvi.append((float(row["lat"]), float(row["lon"]), float(row["ndvi"])))
+        for path in opts["osm"]:
+            with open(path) as f:
+                features = json.load(f).get("features", [])
+            for feature in features:
+                props = feature.get("properties") or {}
+                g, p = _weight(props, GREEN_TAGS), _weight(props, POLLUTION_TAGS)
+                if not g and not p:
+                    continue
+                for lon, lat, *_ in _vertices(feature.get("geometry") or {}):
+                    if g:
+                        green.append((lat, lon, g))
+                    if p:
+                        pollution.append((lat, lon, p))
+
+        bbox, cell = opts["bbox"], opts["cell"]
+        data = raster.build(bbox, cell, ndvi=ndvi, green=green, pollution=pollution)
+        raster.save(opts["out"], data, bbox, cell)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {opts['out']}.npy: {data.shape[1]}x{data.shape[2]} cells from "
+            f"{len(ndvi)} NDVI samples, {len(green)} green and {len(pollution)} pollution vertices"
+        ))
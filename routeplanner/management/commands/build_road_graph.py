@@ -0,0 +1,112 @@
+import os
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from django.core.management.base import BaseCommand
+
+from routeplanner import dijkstra, hierarchy, raster, scoring
+
+# highway class -> pollution proxy (0-100) when no raster is available
+HIGHWAY_POLLUTION = {
+    "motorway": 90, "motorway_link": 80,
+    "trunk": 75, "trunk_link": 65,
+    "primary": 60, "primary_link": 50,
+    "secondary": 45, "secondary_link": 40,
+    "tertiary": 30, "tertiary_link": 25,
+    "unclassified": 20, "residential": 15, "living_street": 10, "service": 10,
+}
+DEFAULT_GREEN = 70.0
+
+
+def parse_osm(path):
+    """Stream an .osm XML extract; returns ({node id: (lat, lon)}, [(node ids, highway, oneway)])."""
+    coords, ways = {}, []
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag == "node":
+            coords[int(elem.get("id"))] = (float(elem.get("lat")), float(elem.get("lon")))
+            elem.clear()
+        elif elem.tag == "way":
+            tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+            highway = tags.get("highway")
+            if highway in HIGHWAY_POLLUTION:
+                refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+                oneway = tags.get("oneway") in ("yes", "1", "true") or highway.startswith("motorway")
+                if tags.get("oneway") == "-1":
+                    refs, oneway = refs[::-1], True
+                ways.append((refs, highway, oneway))
+            elem.clear()
+    return coords, ways
+
+
+class Command(BaseCommand):
+    help = "Build the local road graph and its contraction hierarchy from an OSM extract."
+
+    def add_arguments(self, parser):
+        parser.add_argument("osm", help="Path to an .osm XML extract.")
+        parser.add_argument("--out", default=hierarchy.ROAD_GRAPH_PATH, help="Output path without extension.")
+        parser.add_argument("--pollution-weight", type=float, default=dijkstra.DEFAULT_WEIGHTS.pollution)
+        parser.add_argument("--green-weight", type=float, default=dijkstra.DEFAULT_WEIGHTS.green)
+        parser.add_argument("--no-ch", action="store_true", help="Only write the plain graph.")
+        parser.add_argument("--ch-max-nodes", type=int, default=hierarchy.CH_MAX_NODES,
+                            help="Skip the hierarchy for larger graphs; they are routed with A* instead.")
+
+    def handle(self, *args, **opts):
+        started = time.monotonic()
+        coords, ways = parse_osm(opts["osm"])
+
+        used = sorted({ref for refs, _, _ in ways for ref in refs if ref in coords})
+        ids = {ref: i for i, ref in enumerate(used)}
+        lat = np.asarray([coords[ref][0] for ref in used])
+        lon = np.asarray([coords[ref][1] for ref in used])
+
+        src, dst, pollution = [], [], []
+        for refs, highway, oneway in ways:
+            refs = [ids[ref] for ref in refs if ref in ids]
+            for a, b in zip(refs, refs[1:]):
+                src.append(a)
+                dst.append(b)
+                pollution.append(HIGHWAY_POLLUTION[highway])
+                if not oneway:
+                    src.append(b)
+                    dst.append(a)
+                    pollution.append(HIGHWAY_POLLUTION[highway])
+        src, dst = np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64)
+        pollution = np.asarray(pollution, dtype=np.float64)
+        distance = scoring.haversine_km(lat[src], lon[src], lat[dst], lon[dst])
+
+        # prefer the offline raster for edge green cover / pollution where it has data
+        green = np.full(len(src), DEFAULT_GREEN)
+        grid = raster.get_raster()
+        if grid is not None and len(src):
+            mid_lat, mid_lon = (lat[src] + lat[dst]) / 2, (lon[src] + lon[dst]) / 2
+            sampled = grid.sample_many(mid_lat, mid_lon, raster.GREEN)
+            green = np.where(np.isnan(sampled), green, sampled)
+            sampled = grid.sample_many(mid_lat, mid_lon, raster.POLLUTION)
+            pollution = np.where(np.isnan(sampled), pollution, sampled)
+
+        # saved with the graph, so A* / alternatives route on the same costs as the hierarchy
+        eco = dijkstra.EcoWeights(pollution=opts["pollution_weight"], green=opts["green_weight"])
+        graph = dijkstra.Graph.from_edges(len(used), src, dst, distance, pollution, green,
+                                          names=used, lat=lat, lon=lon, eco=eco)
+        dijkstra.save_graph(graph, f"{opts['out']}.graph.npz")
+        self.stdout.write(f"Graph: {graph.n} nodes, {len(graph.indices)} edges")
+
+        too_big = graph.n > opts["ch_max_nodes"]
+        if too_big and not opts["no_ch"]:
+            self.stdout.write(self.style.WARNING(
+                f"Skipping the hierarchy: {graph.n} nodes is over --ch-max-nodes {opts['ch_max_nodes']}"
+            ))
+        if opts["no_ch"] or too_big:
+            # an older hierarchy would no longer match this graph
+            try:
+                os.remove(f"{opts['out']}.ch.npz")
+            except FileNotFoundError:
+                pass
+        else:
+            ch = hierarchy.ContractionHierarchy.build(graph, eco, max_nodes=None)
+            ch.save(f"{opts['out']}.ch.npz")
+            self.stdout.write(f"Hierarchy: {len(ch.up[1]) + len(ch.down[1])} edges incl. shortcuts")
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {opts['out']} in {time.monotonic() - started:.1f}s"))
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDate
+
+from routeplanner import archive, rollups
+from routeplanner.models import DailyRouteStats, Place, RouteHistory, RoutePairStats
+
+
+def _fold(rows):
+    """rollups.apply for archived rows, re-creating places that were never stored or since pruned."""
+    ids = {row.source_place_id for row in rows} | {row.destination_place_id for row in rows}
+    known = set(Place.objects.filter(pk__in=ids - {None}).values_list("pk", flat=True))
+    missing = [row for row in rows if not {row.source_place_id, row.destination_place_id} <= known]
+    places = Place.resolve(dict.fromkeys(n for row in missing for n in (row.source, row.destination)))
+    for row in missing:
+        row.source_place_id = places[row.source].pk
+        row.destination_place_id = places[row.destination].pk
+    rollups.apply(rows)
+
+
+class Command(BaseCommand):
+    help = "Recompute the dashboard rollup tables from the full route history."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--with-archives", action="store_true",
+                            help="Also fold in rows already moved out by archive_history.")
+
+    def handle(self, *args, **opts):
+        daily = (
+            RouteHistory.objects.annotate(day=TruncDate("created_at")).values("day")
+            .annotate(routes=Count("id"), eco_cost_sum=Sum("eco_cost"), eco_cost_count=Count("eco_cost"),
+                      pollution_sum=Sum("pollution_index"))
+            .order_by()
+        )
+        pairs = (
+            RouteHistory.objects.values(source=F("source_place__name"), destination=F("destination_place__name"))
+            .annotate(routes=Count("id"), last_searched=Max("created_at"))
+            .order_by()
+        )
+        with transaction.atomic():
+            DailyRouteStats.objects.all().delete()
+            RoutePairStats.objects.all().delete()
+            DailyRouteStats.objects.bulk_create(
+                (DailyRouteStats(date=d["day"], routes=d["routes"], eco_cost_sum=d["eco_cost_sum"] or 0,
+                                 eco_cost_count=d["eco_cost_count"], pollution_sum=d["pollution_sum"] or 0)
+                 for d in daily.iterator(chunk_size=2000)),
+                batch_size=2000,
+            )
+            RoutePairStats.objects.bulk_create(
+                (RoutePairStats(**p) for p in pairs.iterator(chunk_size=2000)),
+                batch_size=2000,
+            )
+        if opts["with_archives"]:
+            chunk = []
+            for row in archive.iter_archive(directory=archive.HISTORY_ARCHIVE_DIR):
+                chunk.append(SimpleNamespace(**row))
+                if len(chunk) == 2000:
+                    _fold(chunk)
+                    chunk = []
+            if chunk:
+                _fold(chunk)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {DailyRouteStats.objects.count()} daily and {RoutePairStats.objects.count()} pair rollups"
+        ))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from routeplanner import warmup
+
+
+class Command(BaseCommand):
+    help = (
+        "Prefetch geocodes and green cover for the most searched places. "
+        "Run it after each deploy, or from cron: `manage.py warm_caches --budget 300`. "
+        "Routes are NOT pre-warmed by this command: route caches live in each web worker, "
+        "which warms its own every WARMUP_INTERVAL seconds (hourly by default, 0 turns it off)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=warmup.WARMUP_TOP_N,
+                            help="Rank this many pairs; twice as many places are warmed.")
+        parser.add_argument("--budget", type=float, default=warmup.WARMUP_BUDGET,
+                            help="Seconds to spend before giving up on the rest.")
+        parser.add_argument("--half-life", type=float, default=warmup.WARMUP_HALF_LIFE_DAYS,
+                            help="Days after which a search counts half.")
+        parser.add_argument("--days", type=int, default=warmup.WARMUP_WINDOW_DAYS,
+                            help="Only look at this many days of history.")
+        parser.add_argument("--workers", type=int, default=warmup.WARMUP_WORKERS)
+        parser.add_argument("--dry-run", action="store_true", help="List the hot set without fetching anything.")
+
+    def handle(self, *args, **opts):
+        options = {"half_life_days": opts["half_life"], "window_days": opts["days"]}
+        if opts["dry_run"]:
+            pairs, places = warmup.hot_set(opts["top"], **options)
+            for source, destination, score in pairs:
+                self.stdout.write(f"{score:8.2f}  {source} ➝ {destination}")
+            for place, score in places:
+                self.stdout.write(f"{score:8.2f}  {place}")
+            return
+
+        report = warmup.warm(opts["top"], opts["budget"], opts["workers"], routes=False, **options)
+        cov = report["places"]
+        self.stdout.write(
+            f"places (geocode + green cover): warmed {cov['warmed']}/{cov['total']} "
+            f"({cov['demand'] * 100:.1f}% of recent demand)"
+        )
+        style = self.style.WARNING if report["out_of_time"] else self.style.SUCCESS
+        self.stdout.write(style(
+            f"Done in {report['seconds']:.1f}s" + (" (time budget ran out)" if report["out_of_time"] else "")
+        ))
@@ -0,0 +1,188 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+
+# -------------------------
+# Config
+# -------------------------
+METRICS_SERVER_TIMING = getattr(settings, "METRICS_SERVER_TIMING", False)  # add Server-Timing headers
+METRICS_TOKEN = getattr(settings, "METRICS_TOKEN", "")  # bearer token for /metrics/; staff logins only when empty
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def value(self, *values):
+        with self._lock:
+            return self._values.get(values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, count in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, values)} {count}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """Cumulative-bucket histogram in seconds, one series per label combination."""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *values):
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.setdefault(values, [0] * (len(self.buckets) + 2))
+            series[i] += 1
+            series[-1] += seconds
+
+    def count(self, *values):
+        with self._lock:
+            series = self._series.get(values)
+            return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                running = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                    running += count
+                    le = bound if bound == "+Inf" else repr(float(bound))
+                    lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), values + (le,))} {running}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, values)} {series[-1]:.6f}")
+                lines.append(f"{self.name}_count{_labels(self.labels, values)} {running}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+# -------------------------
+# Metrics
+# -------------------------
+stage_seconds = Histogram("greenroute_stage_seconds", "Time spent in each route pipeline stage.", ("stage",))
+provider_seconds = Histogram("greenroute_provider_request_seconds",
+                             "Outbound provider HTTP latency, retries included.", ("provider", "status"))
+provider_errors = Counter("greenroute_provider_errors_total",
+                          "Provider calls that failed, by reason.", ("provider", "reason"))
+backend_calls = Counter("greenroute_backend_calls_total",
+                        "Provider backend lookups by outcome (answer, empty, error).", ("kind", "backend", "outcome"))
+fallbacks = Counter("greenroute_fallbacks_total",
+                    "Lookups answered by a lower-priority backend after a higher one had no answer.",
+                    ("kind", "skipped", "used"))
+requests_total = Counter("greenroute_requests_total", "Route requests by endpoint and outcome.", ("endpoint", "outcome"))
+singleflight_calls = Counter("greenroute_singleflight_total",
+                             "Coalesced lookups by role (leader ran it, follower shared it).", ("group", "role"))
+scheduler_wait = Histogram("greenroute_scheduler_wait_seconds",
+                           "Time outbound calls queued for a rate-limit token.", ("provider", "endpoint", "priority"))
+scheduler_rejected = Counter("greenroute_scheduler_rejected_total",
+                             "Outbound calls dropped because no token came in time.", ("provider", "endpoint", "priority"))
+spatial_snaps = Counter("greenroute_spatial_snaps_total",
+                        "Coordinate queries answered from the spatial index, by what they snapped to.", ("target",))
+tile_requests = Counter("greenroute_tile_requests_total", "Route heat tiles served, by disk cache result.", ("result",))
+graph_searches = Counter("greenroute_graph_searches_total",
+                         "Local road-graph routes by search (ch, or astar when no hierarchy was built).", ("search",))
+
+METRICS = [stage_seconds, provider_seconds, provider_errors, backend_calls, fallbacks, requests_total,
+           singleflight_calls, scheduler_wait, scheduler_rejected, spatial_snaps,
+           tile_requests, graph_searches]
+_collectors = []
+
+
+def register_collector(fn):
+    """fn() -> [(name, type, help, {labels tuple: value})], read at scrape time (cache sizes, queue depth)."""
+    _collectors.append(fn)
+    return fn
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        for name, kind, help, samples in collect():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(samples.items()):
+                lines.append(f"{name}{_labels(*zip(*labels)) if labels else ''} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    for metric in METRICS:
+        metric.reset()
+
+
+# -------------------------
+# Stage timing
+# -------------------------
+_local = threading.local()
+
+
+@contextmanager
+def timer(stage):
+    """Time a block into greenroute_stage_seconds and the current request's Server-Timing."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage)
+        timings = getattr(_local, "timings", None)
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def server_timing(view):
+    """Collect the stages timed while `view` runs and, if enabled, send them as a Server-Timing header."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        _local.timings = []
+        started = time.perf_counter()
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            timings, _local.timings = _local.timings, None
+        stage_seconds.observe(time.perf_counter() - started, view.__name__)
+        if METRICS_SERVER_TIMING:
+            timings.append(("total", time.perf_counter() - started))
+            response["Server-Timing"] = ", ".join(f"{name};dur={s * 1000:.1f}" for name, s in timings)
+        return response
+    return wrapper
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routeplanner', '0002_routehistory_delete_route'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='routehistory',
+            old_name='eco_score',
+            new_name='eco_cost',
+        ),
+        migrations.CreateModel(
+            name='GeocodeCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=20)),
+                ('query', models.CharField(max_length=255)),
+                ('lat', models.FloatField(blank=True, null=True)),
+                ('lon', models.FloatField(blank=True, null=True)),
+                ('found', models.BooleanField(default=True)),
+                ('expires_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('provider', 'query'), name='unique_geocode_query')],
+            },
+        ),
+    ]
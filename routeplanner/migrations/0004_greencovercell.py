@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routeplanner', '0003_geocodecacheentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GreenCoverCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell', models.CharField(max_length=32, unique=True)),
+                ('polygon_id', models.CharField(blank=True, max_length=64)),
+                ('green_cover', models.FloatField(blank=True, null=True)),
+                ('fetched_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routeplanner', '0004_greencovercell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRouteStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('routes', models.PositiveIntegerField(default=0)),
+                ('eco_cost_sum', models.FloatField(default=0)),
+                ('eco_cost_count', models.PositiveIntegerField(default=0)),
+                ('pollution_sum', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RoutePairStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=100)),
+                ('destination', models.CharField(max_length=100)),
+                ('routes', models.PositiveIntegerField(default=0)),
+                ('last_searched', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-routes'], name='route_pair_popularity')],
+                'constraints': [models.UniqueConstraint(fields=('source', 'destination'), name='unique_route_pair')],
+            },
+        ),
+    ]
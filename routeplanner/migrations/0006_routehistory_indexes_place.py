@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:36
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def _normalize(place):
+    # frozen copy of geocache.normalize_place
+    text = unicodedata.normalize("NFKD", place or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"\s+", " ", text.casefold()).strip()
+    return re.sub(r"\s*,\s*", ", ", text)
+
+
+def backfill_places(apps, schema_editor):
+    Place = apps.get_model("routeplanner", "Place")
+    RouteHistory = apps.get_model("routeplanner", "RouteHistory")
+    sources = set(RouteHistory.objects.values_list("source", flat=True).distinct())
+    destinations = set(RouteHistory.objects.values_list("destination", flat=True).distinct())
+    places = {}
+    for name in sources | destinations:
+        key = _normalize(name)
+        if key not in places:
+            places[key], _ = Place.objects.get_or_create(key=key, defaults={"name": name[:100]})
+    # one UPDATE per distinct string rather than per row
+    for name in sources:
+        RouteHistory.objects.filter(source=name).update(source_place=places[_normalize(name)])
+    for name in destinations:
+        RouteHistory.objects.filter(destination=name).update(destination_place=places[_normalize(name)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routeplanner', '0005_route_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Place',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('name', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='routehistory',
+            name='destination_place',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='routeplanner.place'),
+        ),
+        migrations.AddField(
+            model_name='routehistory',
+            name='source_place',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='routeplanner.place'),
+        ),
+        migrations.AddIndex(
+            model_name='routehistory',
+            index=models.Index(fields=['created_at'], name='history_created'),
+        ),
+        migrations.AddIndex(
+            model_name='routehistory',
+            index=models.Index(fields=['user', 'created_at'], name='history_user_created'),
+        ),
+        migrations.AddIndex(
+            model_name='routehistory',
+            index=models.Index(fields=['source', 'destination'], name='history_pair'),
+        ),
+        migrations.AddIndex(
+            model_name='routehistory',
+            index=models.Index(fields=['source_place', 'destination_place'], name='history_place_pair'),
+        ),
+        migrations.RunPython(backfill_places, migrations.RunPython.noop),
+    ]
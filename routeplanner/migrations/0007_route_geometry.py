@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routeplanner', '0006_routehistory_indexes_place'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteGeometry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('polyline', models.TextField()),
+                ('distance_km', models.FloatField(blank=True, null=True)),
+                ('eco_cost', models.FloatField(blank=True, null=True)),
+                ('routes', models.PositiveIntegerField(default=0)),
+                ('min_lat', models.FloatField()),
+                ('min_lon', models.FloatField()),
+                ('max_lat', models.FloatField()),
+                ('max_lon', models.FloatField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('destination_place', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='routeplanner.place')),
+                ('source_place', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='routeplanner.place')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['min_lat', 'max_lat'], name='route_geometry_bbox')],
+                'constraints': [models.UniqueConstraint(fields=('source_place', 'destination_place'), name='unique_route_geometry')],
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+
+def _normalize(place):
+    # frozen copy of geocache.normalize_place
+    text = unicodedata.normalize("NFKD", place or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"\s+", " ", text.casefold()).strip()
+    return re.sub(r"\s*,\s*", ", ", text)
+
+
+def _places(Place, names):
+    """{name: Place}, creating missing ones keyed by the normalized name."""
+    keys = {name: _normalize(name) for name in names}
+    existing = {p.key: p for p in Place.objects.filter(key__in=set(keys.values()))}
+    for name, key in keys.items():
+        if key not in existing:
+            existing[key] = Place.objects.create(key=key, name=name[:100])
+    return {name: existing[key] for name, key in keys.items()}
+
+
+def backfill_places(apps, schema_editor):
+    """Fill the place ids on rows that still lack them, before 0009 drops the name columns."""
+    Place = apps.get_model("routeplanner", "Place")
+    RouteHistory = apps.get_model("routeplanner", "RouteHistory")
+    missing = RouteHistory.objects.filter(source_place__isnull=True) | RouteHistory.objects.filter(destination_place__isnull=True)
+    sources = set(missing.values_list("source", flat=True).distinct())
+    destinations = set(missing.values_list("destination", flat=True).distinct())
+    places = _places(Place, sources | destinations)
+    # one UPDATE per distinct string rather than per row
+    for name in sources:
+        RouteHistory.objects.filter(source=name, source_place__isnull=True).update(source_place=places[name])
+    for name in destinations:
+        RouteHistory.objects.filter(destination=name, destination_place__isnull=True).update(destination_place=places[name])
+
+
+def merge_pair_stats(apps, schema_editor):
+    """
+    Re-key the pair rollup by place name: pairs that only differed in spelling
+    ("Madurai" / " MADURAI") become one row, as rollups.apply now counts them.
+    """
+    Place = apps.get_model("routeplanner", "Place")
+    RoutePairStats = apps.get_model("routeplanner", "RoutePairStats")
+    stats = list(RoutePairStats.objects.all())
+    places = _places(Place, {n for s in stats for n in (s.source, s.destination)})
+    merged = {}
+    for s in stats:
+        key = (places[s.source].name, places[s.destination].name)
+        routes, last = merged.get(key, (0, None))
+        merged[key] = (routes + s.routes, max(filter(None, (last, s.last_searched)), default=None))
+    RoutePairStats.objects.all().delete()
+    RoutePairStats.objects.bulk_create(
+        [RoutePairStats(source=s, destination=d, routes=routes, last_searched=last)
+         for (s, d), (routes, last) in merged.items()],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routeplanner', '0007_route_geometry'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_places, migrations.RunPython.noop),
+        migrations.RunPython(merge_pair_stats, migrations.RunPython.noop),
+    ]
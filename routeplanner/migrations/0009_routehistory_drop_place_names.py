@@ -0,0 +1,34 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routeplanner', '0008_backfill_history_places'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='routehistory',
+            name='history_pair',
+        ),
+        migrations.RemoveField(
+            model_name='routehistory',
+            name='destination',
+        ),
+        migrations.RemoveField(
+            model_name='routehistory',
+            name='source',
+        ),
+        migrations.AlterField(
+            model_name='routehistory',
+            name='destination_place',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='routeplanner.place'),
+        ),
+        migrations.AlterField(
+            model_name='routehistory',
+            name='source_place',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='routeplanner.place'),
+        ),
+    ]
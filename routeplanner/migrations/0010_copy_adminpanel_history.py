@@ -0,0 +1,74 @@
+import re
+import unicodedata
+
+from django.apps import apps as global_apps
+from django.db import migrations
+
+CHUNK = 2000
+
+
+def _normalize(place):
+    # frozen copy of geocache.normalize_place
+    text = unicodedata.normalize("NFKD", place or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"\s+", " ", text.casefold()).strip()
+    return re.sub(r"\s*,\s*", ", ", text)
+
+
+def copy_adminpanel_history(apps, schema_editor):
+    """
+    History used to be written to adminpanel.RouteHistory. Copy those rows,
+    timestamps included, so dashboards, exports, warm-up and archiving see
+    them in routeplanner.RouteHistory. The rollups already counted them and
+    are left alone; the adminpanel rows stay where they are.
+    """
+    try:
+        Old = apps.get_model("adminpanel", "RouteHistory")
+    except LookupError:
+        return
+    Place = apps.get_model("routeplanner", "Place")
+    RouteHistory = apps.get_model("routeplanner", "RouteHistory")
+    # keep the original timestamps; this historical model is private to the migration
+    created_at = RouteHistory._meta.get_field("created_at")
+    created_at.auto_now = created_at.auto_now_add = False
+
+    places = {p.key: p.pk for p in Place.objects.all()}
+
+    def place_id(name):
+        key = _normalize(name)
+        if key not in places:
+            places[key] = Place.objects.get_or_create(key=key, defaults={"name": (name or "")[:100]})[0].pk
+        return places[key]
+
+    last = 0
+    while True:
+        rows = list(Old.objects.filter(pk__gt=last).order_by("pk")[:CHUNK])
+        if not rows:
+            return
+        last = rows[-1].pk
+        RouteHistory.objects.bulk_create([
+            RouteHistory(
+                user_id=row.user_id,
+                source_place_id=place_id(row.source),
+                destination_place_id=place_id(row.destination),
+                green_cover=row.green_cover or 0,
+                pollution_index=row.pollution_index or 0,
+                distance=row.distance_km,
+                eco_cost=row.eco_cost,
+                created_at=row.searched_at,
+            )
+            for row in rows
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routeplanner', '0009_routehistory_drop_place_names'),
+    ]
+    if global_apps.is_installed("adminpanel"):
+        dependencies.append(('adminpanel', '__latest__'))
+
+    operations = [
+        migrations.RunPython(copy_adminpanel_history, migrations.RunPython.noop),
+    ]
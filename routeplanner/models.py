@@ -1,7 +1,69 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+
+class Place(models.Model):
+    """One row per distinct place name, so history rows store an id instead of the string."""
+    key = models.CharField(max_length=255, unique=True)  # geocache.normalize_place(name)
+    name = models.CharField(max_length=100)  # as first entered
+
+    @classmethod
+    def find(cls, names):
+        """{name: Place} for the given names that already have one; nothing is created."""
+        from .geocache import normalize_place
+
+        keys = {name: normalize_place(name) for name in names}
+        existing = {p.key: p for p in cls.objects.filter(key__in=set(keys.values()))}
+        return {name: existing[key] for name, key in keys.items() if key in existing}
+
+    @classmethod
+    def resolve(cls, names):
+        """{name: Place} for the given names, creating any that are missing."""
+        from .geocache import normalize_place
+
+        keys = {name: normalize_place(name) for name in names}
+        existing = {p.key: p for p in cls.objects.filter(key__in=set(keys.values()))}
+        missing = {}
+        for name, key in keys.items():
+            if key not in existing:
+                missing.setdefault(key, name)
+        if missing:
+            cls.objects.bulk_create([cls(key=k, name=n[:100]) for k, n in missing.items()], ignore_conflicts=True)
+            existing.update((p.key, p) for p in cls.objects.filter(key__in=missing))
+        return {name: existing[key] for name, key in keys.items()}
+
+    @classmethod
+    def attach(cls, rows):
+        """Fill source_place / destination_place on unsaved history rows from the names they carry."""
+        rows = [row for row in rows if row.source_place_id is None or row.destination_place_id is None]
+        if not rows:
+            return
+        places = cls.resolve(dict.fromkeys(n for row in rows for n in (row.source, row.destination)))
+        for row in rows:
+            row.source_place = places[row.source]
+            row.destination_place = places[row.destination]
+
+    @classmethod
+    def names(cls, ids):
+        """{id: name} for the given place ids."""
+        return dict(cls.objects.filter(pk__in=set(ids)).values_list("pk", "name"))
+
+    def __str__(self):
+        return self.name
+
+
+class RouteHistoryManager(models.Manager):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        Place.attach(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class RouteHistory(models.Model):
+    """
+    One planned route. Places are stored as ids; an unsaved row is built with
+    source= / destination= names and gets its Place ids when it is saved.
+    """
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -9,13 +71,135 @@ class RouteHistory(models.Model):
         blank=True,
         related_name="routeplanner_routes"  # prevents reverse accessor clashes
     )
-    source = models.CharField(max_length=100)
-    destination = models.CharField(max_length=100)
+    source_place = models.ForeignKey(Place, on_delete=models.PROTECT, related_name="+")
+    destination_place = models.ForeignKey(Place, on_delete=models.PROTECT, related_name="+")
     green_cover = models.FloatField()  # %
     pollution_index = models.FloatField()  # pollution API
     distance = models.FloatField(null=True, blank=True)  # km
     eco_cost = models.FloatField(null=True, blank=True)  # eco metric
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = RouteHistoryManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"], name="history_created"),
+            models.Index(fields=["user", "created_at"], name="history_user_created"),
+            models.Index(fields=["source_place", "destination_place"], name="history_place_pair"),
+        ]
+
+    def _place_name(self, name, place):
+        # the name the row was built with, else its place's
+        if self.__dict__.get(name) is None and getattr(self, f"{place}_id") is not None:
+            return getattr(self, place).name
+        return self.__dict__.get(name)
+
+    @property
+    def source(self):
+        return self._place_name("_source", "source_place")
+
+    @source.setter
+    def source(self, name):
+        self._source = name
+
+    @property
+    def destination(self):
+        return self._place_name("_destination", "destination_place")
+
+    @destination.setter
+    def destination(self, name):
+        self._destination = name
+
+    def save(self, *args, **kwargs):
+        Place.attach([self])
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.source} ➝ {self.destination}"
+
+
+class GeocodeCacheEntry(models.Model):
+    provider = models.CharField(max_length=20)
+    query = models.CharField(max_length=255)  # normalized place name
+    lat = models.FloatField(null=True, blank=True)
+    lon = models.FloatField(null=True, blank=True)
+    found = models.BooleanField(default=True)  # False = cached "not found"
+    expires_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["provider", "query"], name="unique_geocode_query"),
+        ]
+
+    def __str__(self):
+        return f"{self.provider}: {self.query}"
+
+
+class GreenCoverCell(models.Model):
+    cell = models.CharField(max_length=32, unique=True)  # "row:col" on the green-cover grid
+    polygon_id = models.CharField(max_length=64, blank=True)  # registered Agro polygon
+    green_cover = models.FloatField(null=True, blank=True)  # % from latest NDVI mean
+    fetched_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.cell
+
+
+class DailyRouteStats(models.Model):
+    date = models.DateField(unique=True)
+    routes = models.PositiveIntegerField(default=0)
+    eco_cost_sum = models.FloatField(default=0)
+    eco_cost_count = models.PositiveIntegerField(default=0)  # rows that had an eco_cost
+    pollution_sum = models.FloatField(default=0)
+
+    @property
+    def avg_eco_cost(self):
+        return self.eco_cost_sum / self.eco_cost_count if self.eco_cost_count else 0
+
+    @property
+    def avg_pollution(self):
+        return self.pollution_sum / self.routes if self.routes else 0
+
+    def __str__(self):
+        return f"{self.date}: {self.routes} routes"
+
+
+class RoutePairStats(models.Model):
+    source = models.CharField(max_length=100)
+    destination = models.CharField(max_length=100)
+    routes = models.PositiveIntegerField(default=0)
+    last_searched = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["source", "destination"], name="unique_route_pair"),
+        ]
+        indexes = [models.Index(fields=["-routes"], name="route_pair_popularity")]
+
+    def __str__(self):
+        return f"{self.source} ➝ {self.destination} ({self.routes})"
+
+
+class RouteGeometry(models.Model):
+    """The latest route line for a place pair, stored once however often the pair is searched."""
+    source_place = models.ForeignKey(Place, on_delete=models.PROTECT, related_name="+")
+    destination_place = models.ForeignKey(Place, on_delete=models.PROTECT, related_name="+")
+    polyline = models.TextField()  # geometry.encode_polyline, simplified for the deepest tile zoom
+    distance_km = models.FloatField(null=True, blank=True)
+    eco_cost = models.FloatField(null=True, blank=True)
+    routes = models.PositiveIntegerField(default=0)  # searches that produced this pair
+    min_lat = models.FloatField()
+    min_lon = models.FloatField()
+    max_lat = models.FloatField()
+    max_lon = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["source_place", "destination_place"], name="unique_route_geometry"),
+        ]
+        indexes = [models.Index(fields=["min_lat", "max_lat"], name="route_geometry_bbox")]
+
+    def __str__(self):
+        return f"{self.source_place_id} ➝ {self.destination_place_id} ({self.routes})"
@@ -0,0 +1,269 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+from django.conf import settings
+
+from . import clients, dijkstra, geocache, metrics, scoring, spatial
+from .hierarchy import get_graph, get_hierarchy
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+# kind -> {backend name: priority}; lower runs first. A kind listed here only uses
+# the backends named for it, e.g. {"router": {"replay": 0}} for offline load tests.
+PROVIDER_BACKENDS = getattr(settings, "PROVIDER_BACKENDS", {})
+PROVIDER_REPLAY_DIR = getattr(settings, "PROVIDER_REPLAY_DIR", os.path.join(getattr(settings, "BASE_DIR", ""), "recordings"))
+PROVIDER_RECORD = getattr(settings, "PROVIDER_RECORD", False)  # save live answers for the replay backend
+# backend name -> (mean, jitter) seconds added to every call, drawn from a seeded RNG
+PROVIDER_LATENCY = getattr(settings, "PROVIDER_LATENCY", {})
+PROVIDER_LATENCY_SEED = getattr(settings, "PROVIDER_LATENCY_SEED", 0)
+
+KINDS = ("geocoder", "router", "alternatives", "matrix", "green_cover")
+
+
+class Backend:
+    """
+    One way of answering a `kind` of lookup. `call` returns None when it has
+    no answer so the next backend is tried. `enabled` is checked per call
+    (API keys, data files); `circuit` names the clients breaker to respect.
+    Backends registered with priority=None are opt-in via PROVIDER_BACKENDS.
+    """
+
+    def __init__(self, kind, name, call, priority=None, enabled=None, circuit=None):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown provider kind: {kind}")
+        self.kind = kind
+        self.name = name
+        self.call = call
+        self.priority = priority
+        self.enabled = enabled or (lambda: True)
+        self.circuit = circuit
+
+    def available(self):
+        return self.enabled() and (self.circuit is None or clients.available(self.circuit))
+
+
+_registry = {kind: {} for kind in KINDS}
+_rng = random.Random(PROVIDER_LATENCY_SEED)
+_rng_lock = threading.Lock()
+
+
+def register(kind, name, call, priority=None, enabled=None, circuit=None):
+    backend = Backend(kind, name, call, priority, enabled, circuit)
+    _registry[kind][name] = backend
+    return backend
+
+
+def backends(kind):
+    """Available backends for `kind`, in priority order."""
+    configured = PROVIDER_BACKENDS.get(kind)
+    if configured is not None:
+        chosen = [(p, _registry[kind][n]) for n, p in configured.items() if n in _registry[kind]]
+    else:
+        chosen = [(b.priority, b) for b in _registry[kind].values() if b.priority is not None]
+    return [b for _, b in sorted(chosen, key=lambda pb: pb[0]) if b.available()]
+
+
+def _inject_latency(name):
+    mean, jitter = PROVIDER_LATENCY.get(name, (0.0, 0.0))
+    if mean or jitter:
+        with _rng_lock:
+            delay = max(0.0, mean + _rng.uniform(-jitter, jitter))
+        time.sleep(delay)
+
+
+def first(kind, *args):
+    """Ask each available backend in turn; the first non-None answer wins."""
+    skipped = None
+    for backend in backends(kind):
+        _inject_latency(backend.name)
+        try:
+            answer = backend.call(*args)
+        except Exception as e:
+            logger.error(f"{kind} backend '{backend.name}' failed: {e}")
+            metrics.backend_calls.inc(kind, backend.name, "error")
+            skipped = skipped or backend.name
+            continue
+        if answer is None:
+            metrics.backend_calls.inc(kind, backend.name, "empty")
+            skipped = skipped or backend.name
+            continue
+        metrics.backend_calls.inc(kind, backend.name, "answer")
+        if skipped:
+            metrics.fallbacks.inc(kind, skipped, backend.name)
+        if PROVIDER_RECORD and backend.name != "replay":
+            replay_store().save(kind, args, answer)
+        return answer
+    return None
+
+
+# -------------------------
+# Local stand-ins
+# -------------------------
+def _replay_key(kind, args):
+    # round coordinates so replays survive float noise in geocoder output
+    norm = [round(a, 5) if isinstance(a, float) else a for a in args]
+    norm = [geocache.normalize_place(a) if isinstance(a, str) else a for a in norm]
+    norm = [[[round(x, 5) for x in p] for p in a] if isinstance(a, list) else a for a in norm]
+    return hashlib.sha1(json.dumps([kind, norm]).encode()).hexdigest()
+
+
+class ReplayStore:
+    """
+    Recorded provider answers on disk, one JSON file per lookup under
+    <directory>/<kind>/<sha1>.json, loaded into memory on first use.
+    """
+
+    def __init__(self, directory=PROVIDER_REPLAY_DIR):
+        self.directory = directory
+        self._answers = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        answers = {}
+        for kind in KINDS:
+            folder = os.path.join(self.directory, kind)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                if name.endswith(".json"):
+                    with open(os.path.join(folder, name), encoding="utf-8") as f:
+                        answers[(kind, name[:-5])] = json.load(f)["answer"]
+        return answers
+
+    def get(self, kind, args):
+        if self._answers is None:
+            with self._lock:
+                if self._answers is None:
+                    self._answers = self._load()
+        return self._answers.get((kind, _replay_key(kind, args)))
+
+    def save(self, kind, args, answer):
+        key = _replay_key(kind, args)
+        folder = os.path.join(self.directory, kind)
+        try:
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, f"{key}.json"), "w", encoding="utf-8") as f:
+                json.dump({"args": list(args), "answer": answer}, f)
+        except (OSError, TypeError) as e:
+            logger.error(f"Could not record {kind} answer: {e}")
+            return
+        with self._lock:
+            if self._answers is not None:
+                self._answers[(kind, key)] = answer
+
+
+_store = None
+
+
+def replay_store():
+    global _store
+    if _store is None:
+        _store = ReplayStore()
+    return _store
+
+
+def _replay(kind):
+    def call(*args):
+        answer = replay_store().get(kind, args)
+        # JSON turns (lat, lon) tuples into lists
+        return tuple(answer) if kind == "geocoder" and answer is not None else answer
+    return call
+
+
+def synthetic_geocode(place):
+    """A stable point inside India derived from the place name."""
+    digest = hashlib.sha1(geocache.normalize_place(place).encode()).digest()
+    return (round(8.0 + digest[0] / 255 * 20, 5), round(70.0 + digest[1] / 255 * 20, 5))
+
+
+def synthetic_route(slat, slon, dlat, dlon, points=200):
+    """Straight line with road-like detour factor; good enough to load the scoring code."""
+    distance = float(scoring.haversine_km(slat, slon, dlat, dlon)) * 1.3
+    coords = np.column_stack([np.linspace(slat, dlat, points), np.linspace(slon, dlon, points)])
+    return {"distance_km": round(distance, 3), "coords": coords.round(6).tolist()}
+
+
+def synthetic_alternatives(slat, slon, dlat, dlon, k):
+    """The straight synthetic route plus k - 1 detours bowing out to alternating sides."""
+    routes = [synthetic_route(slat, slon, dlat, dlon)]
+    t = np.linspace(0.0, 1.0, 200)
+    for i in range(1, k):
+        bow = 0.08 * ((i + 1) // 2) * (1 if i % 2 else -1) * np.sin(np.pi * t)
+        lats = slat + (dlat - slat) * t - (dlon - slon) * bow
+        lons = slon + (dlon - slon) * t + (dlat - slat) * bow
+        coords = np.column_stack([lats, lons])
+        routes.append({"distance_km": round(float(scoring.cumulative_km(coords)[-1]) * 1.3, 3),
+                       "coords": coords.round(6).tolist()})
+    return routes
+
+
+def synthetic_matrix(points):
+    lat, lon = np.asarray(points, dtype=np.float64).T
+    km = scoring.haversine_km(lat[:, None], lon[:, None], lat[None, :], lon[None, :]) * 1.3
+    return km.round(3).tolist()
+
+
+def synthetic_green_cover(lat, lon):
+    return round(30.0 + 60.0 * abs(np.sin(lat * 7.0) * np.cos(lon * 5.0)), 1)
+
+
+def _snap(lat, lon, lats, lons):
+    return spatial.nodes_for(lats, lons).nearest(lat, lon)[0]
+
+
+def _graph_leg(lats, lons, path):
+    coords = np.column_stack([lats[path], lons[path]])
+    return {"distance_km": round(float(scoring.cumulative_km(coords)[-1]), 3), "coords": coords.round(6).tolist()}
+
+
+def graph_route(slat, slon, dlat, dlon):
+    """
+    Route on the local road graph (manage.py build_road_graph), snapping to the
+    nearest nodes: through its contraction hierarchy, or with A* on graphs
+    built without one. Both use the eco weights the graph was built with.
+    """
+    ch = get_hierarchy()
+    if ch is not None and ch.lat is not None:
+        metrics.graph_searches.inc("ch")
+        cost, path = ch.query(_snap(slat, slon, ch.lat, ch.lon), _snap(dlat, dlon, ch.lat, ch.lon))
+        return _graph_leg(ch.lat, ch.lon, path) if path else None
+    graph = get_graph()
+    if graph is None or graph.lat is None:
+        return None
+    metrics.graph_searches.inc("astar")
+    cost, path = dijkstra.astar_path(
+        graph, _snap(slat, slon, graph.lat, graph.lon), _snap(dlat, dlon, graph.lat, graph.lon), graph.eco
+    )
+    return _graph_leg(graph.lat, graph.lon, path) if path else None
+
+
+def graph_alternatives(slat, slon, dlat, dlon, k):
+    """k eco-cheapest loopless paths on the local road graph (Yen's algorithm), with its build-time weights."""
+    graph = get_graph()
+    if graph is None or graph.lat is None:
+        return None
+    paths = dijkstra.k_shortest_paths(
+        graph, _snap(slat, slon, graph.lat, graph.lon), _snap(dlat, dlon, graph.lat, graph.lon), k, graph.eco
+    )
+    return [_graph_leg(graph.lat, graph.lon, path) for _, path in paths] or None
+
+
+for _kind in KINDS:
+    register(_kind, "replay", _replay(_kind))
+register("geocoder", "synthetic", synthetic_geocode)
+register("router", "synthetic", synthetic_route)
+register("alternatives", "synthetic", synthetic_alternatives)
+register("matrix", "synthetic", synthetic_matrix)
+register("green_cover", "synthetic", synthetic_green_cover)
+register("router", "graph", graph_route)
+register("alternatives", "graph", graph_alternatives)
@@ -0,0 +1,154 @@
+import json
+import logging
+import math
+import os
+import threading
+import warnings
+
+import numpy as np
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+ECO_DATA_MODE = getattr(settings, "ECO_DATA_MODE", "remote")  # "remote" or "local"
+ECO_RASTER_PATH = getattr(settings, "ECO_RASTER_PATH", os.path.join(getattr(settings, "BASE_DIR", ""), "eco_raster"))
+
+GREEN, POLLUTION = 0, 1  # band order in the .npy array
+
+
+class EcoRaster:
+    """
+    Gridded green cover / pollution proxy, as written by `manage.py build_eco_raster`.
+    `<path>.npy` holds a float32 array shaped (2, rows, cols) with row 0 at the
+    southern edge; `<path>.json` holds the bbox and cell size. NaN means no data.
+    """
+
+    def __init__(self, path):
+        with open(f"{path}.json") as f:
+            header = json.load(f)
+        self.south, self.west, self.north, self.east = header["bbox"]
+        self.cell = header["cell_deg"]
+        self.data = np.load(f"{path}.npy", mmap_mode="r")
+        self.rows, self.cols = self.data.shape[1:]
+
+    def _index(self, lats, lons):
+        rows = np.floor((np.asarray(lats, dtype=np.float64) - self.south) / self.cell).astype(np.int64)
+        cols = np.floor((np.asarray(lons, dtype=np.float64) - self.west) / self.cell).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.rows) & (cols >= 0) & (cols < self.cols)
+        return np.clip(rows, 0, self.rows - 1), np.clip(cols, 0, self.cols - 1), inside
+
+    def sample_many(self, lats, lons, band):
+        """Vectorized lookup; points outside the grid come back as NaN."""
+        rows, cols, inside = self._index(lats, lons)
+        values = np.asarray(self.data[band, rows, cols], dtype=np.float64)
+        values[~inside] = np.nan
+        return values
+
+    def sample(self, lat, lon, band):
+        value = float(self.sample_many([lat], [lon], band)[0])
+        return None if np.isnan(value) else value
+
+
+_raster = None
+_loaded = False
+_raster_lock = threading.Lock()
+
+
+def get_raster():
+    """The configured raster, memory-mapped on first use; None if it hasn't been built."""
+    global _raster, _loaded
+    if not _loaded:
+        with _raster_lock:
+            if not _loaded:
+                try:
+                    _raster = EcoRaster(ECO_RASTER_PATH)
+                except (OSError, ValueError, KeyError) as e:
+                    logger.error(f"Eco raster unavailable at {ECO_RASTER_PATH}: {e}")
+                _loaded = True
+    return _raster
+
+
+def green_cover(lat, lon):
+    raster = get_raster()
+    return raster.sample(lat, lon, GREEN) if raster else None
+
+
+def pollution(lat, lon):
+    raster = get_raster()
+    return raster.sample(lat, lon, POLLUTION) if raster else None
+
+
+# -------------------------
+# Building
+# -------------------------
+def _bin(points, bbox, cell, shape):
+    """Sum weights and counts of (lat, lon, weight) points per grid cell."""
+    south, west = bbox[0], bbox[1]
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    rows = np.floor((pts[:, 0] - south) / cell).astype(np.int64)
+    cols = np.floor((pts[:, 1] - west) / cell).astype(np.int64)
+    inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+    totals = np.zeros(shape)
+    counts = np.zeros(shape)
+    np.add.at(totals, (rows[inside], cols[inside]), pts[inside, 2])
+    np.add.at(counts, (rows[inside], cols[inside]), 1)
+    return totals, counts
+
+
+def _smooth(grid):
+    """3x3 box sum, so a motorway also weighs on the cells next to it."""
+    padded = np.pad(grid, 1)
+    rows, cols = grid.shape
+    return sum(padded[r:r + rows, c:c + cols] for r in range(3) for c in range(3))
+
+
+def build(bbox, cell, ndvi=(), green=(), pollution=(), green_saturation=50):
+    """
+    Grid point samples into a (2, rows, cols) float32 array.
+    ndvi:      (lat, lon, ndvi) samples, averaged per cell and mapped to 0-100 %
+    green:     (lat, lon, weight) OSM vegetation; `green_saturation` weight in a cell = 100 %
+    pollution: (lat, lon, weight) OSM roads/industry, smoothed and scaled so the
+               99th percentile of non-empty cells = 100
+    Cells with no sample of a band (for pollution, none within one cell) are NaN
+    in that band, so readers fall back to their defaults rather than taking 0.
+    """
+    south, west, north, east = bbox
+    shape = (max(1, math.ceil(round((north - south) / cell, 6))), max(1, math.ceil(round((east - west) / cell, 6))))
+    data = np.full((2,) + shape, np.nan)
+
+    layers = []
+    if len(ndvi):
+        totals, counts = _bin(ndvi, bbox, cell, shape)
+        with np.errstate(invalid="ignore"):
+            layers.append(np.clip((totals / counts + 1) * 50, 0, 100))
+    if len(green):
+        totals, counts = _bin(green, bbox, cell, shape)
+        layers.append(np.where(counts > 0, np.clip(totals * 100 / green_saturation, 0, 100), np.nan))
+    if layers:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # nanmean of cells empty in every layer
+            data[GREEN] = np.nanmean(np.stack(layers), axis=0) if len(layers) > 1 else layers[0]
+
+    if len(pollution):
+        totals, counts = _bin(pollution, bbox, cell, shape)
+        load, covered = _smooth(totals), _smooth(counts) > 0
+        scale = np.percentile(load[load > 0], 99) if (load > 0).any() else 1.0
+        data[POLLUTION] = np.where(covered, np.clip(load * 100 / scale, 0, 100), np.nan)
+
+    return data.astype(np.float32)
+
+
+def save(path, data, bbox, cell):
+    np.save(f"{path}.npy", data)
+    with open(f"{path}.json", "w") as f:
+        json.dump({"bbox": list(bbox), "cell_deg": cell, "bands": ["green_cover", "pollution"]}, f)
+
+
+def reset():
+    global _raster, _loaded
+    with _raster_lock:
+        _raster, _loaded = None, False
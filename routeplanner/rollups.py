@@ -0,0 +1,78 @@
+import logging
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import DailyRouteStats, Place, RoutePairStats
+
+logger = logging.getLogger(__name__)
+
+
+def _timestamp(row):
+    return getattr(row, "searched_at", None) or getattr(row, "created_at", None) or timezone.now()
+
+
+def _bump(model, lookup, latest, increments):
+    """
+    Add `increments` to the row matching `lookup`, creating it if needed.
+    Fields in `latest` only ever move forward, so folding in older rows
+    (archives, late batches) never replaces a newer value.
+    """
+    updates = {name: F(name) + value for name, value in increments.items()}
+    updates.update(
+        (name, Greatest(Coalesce(name, Value(value)), Value(value))) for name, value in latest.items()
+    )
+    if model.objects.filter(**lookup).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **latest, **increments)
+    except IntegrityError:
+        # another writer created it first
+        model.objects.filter(**lookup).update(**updates)
+
+
+def apply(rows):
+    """Fold newly written history rows into the daily and per-pair counters (pairs keyed by place name)."""
+    days = defaultdict(lambda: {"routes": 0, "eco_cost_sum": 0.0, "eco_cost_count": 0, "pollution_sum": 0.0})
+    pairs = defaultdict(lambda: {"routes": 0, "last": None})
+    for row in rows:
+        when = _timestamp(row)
+        day = days[timezone.localdate(when) if timezone.is_aware(when) else when.date()]
+        day["routes"] += 1
+        day["pollution_sum"] += row.pollution_index or 0
+        if row.eco_cost is not None:
+            day["eco_cost_sum"] += row.eco_cost
+            day["eco_cost_count"] += 1
+        pair = pairs[(row.source_place_id, row.destination_place_id)]
+        pair["routes"] += 1
+        pair["last"] = max(pair["last"] or when, when)
+
+    names = Place.names(p for pair in pairs for p in pair)
+    with transaction.atomic():
+        for date, counts in days.items():
+            _bump(DailyRouteStats, {"date": date}, {}, counts)
+        for (source, destination), counts in pairs.items():
+            _bump(RoutePairStats, {"source": names[source], "destination": names[destination]},
+                  {"last_searched": counts["last"]}, {"routes": counts["routes"]})
+
+
+def dashboard_stats(days=10, top=5):
+    """
+    What the dashboards show, read from the rollups: one aggregate plus
+    days + top rows. The totals cover every route ever planned, archived
+    history included, since archive_history leaves the rollups alone.
+    """
+    totals = DailyRouteStats.objects.aggregate(
+        routes=Sum("routes"), eco_cost_sum=Sum("eco_cost_sum"), eco_cost_count=Sum("eco_cost_count"),
+    )
+    eco_count = totals["eco_cost_count"] or 0
+    return {
+        "total_routes": totals["routes"] or 0,
+        "avg_eco_cost": totals["eco_cost_sum"] / eco_count if eco_count else 0,
+        "recent_days": list(DailyRouteStats.objects.order_by("-date")[:days])[::-1],  # oldest first
+        "popular": list(RoutePairStats.objects.order_by("-routes")[:top]),
+    }
@@ -0,0 +1,159 @@
+import json
+import logging
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import metrics, scheduler
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+ROUTE_CACHE_PRECISION = getattr(settings, "ROUTE_CACHE_PRECISION", 3)  # decimals, ~110 m
+ROUTE_CACHE_MAX_BYTES = getattr(settings, "ROUTE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+ROUTE_CACHE_TTL = getattr(settings, "ROUTE_CACHE_TTL", 6 * 60 * 60)
+ROUTE_CACHE_STALE_TTL = getattr(settings, "ROUTE_CACHE_STALE_TTL", 7 * 24 * 60 * 60)
+
+# key -> (compressed route, fresh_until, stale_until)
+_entries = OrderedDict()
+_size = 0
+_refreshing = set()
+_refresh_executor = None  # set_executor(); the views' bulk pool
+_lock = threading.Lock()
+_stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "evictions": 0}
+
+
+def make_key(provider, profile, slat, slon, dlat, dlon):
+    p = ROUTE_CACHE_PRECISION
+    return (round(slat, p), round(slon, p), round(dlat, p), round(dlon, p), provider, profile)
+
+
+def _pack(route):
+    return zlib.compress(json.dumps(route, separators=(",", ":")).encode(), 6)
+
+
+def _unpack(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+def _store(key, route):
+    global _size
+    blob = _pack(route)
+    now = time.time()
+    with _lock:
+        old = _entries.pop(key, None)
+        if old:
+            _size -= len(old[0])
+        _entries[key] = (blob, now + ROUTE_CACHE_TTL, now + ROUTE_CACHE_STALE_TTL)
+        _size += len(blob)
+        while _size > ROUTE_CACHE_MAX_BYTES and len(_entries) > 1:
+            _, (evicted, _, _) = _entries.popitem(last=False)
+            _size -= len(evicted)
+            _stats["evictions"] += 1
+
+
+def _cacheable(route):
+    if isinstance(route, list):  # alternatives
+        return bool(route) and all(_cacheable(r) for r in route)
+    return isinstance(route, dict) and "coords" in route
+
+
+def set_executor(executor):
+    """Pool that runs stale-entry refreshes; without one they run in the caller."""
+    global _refresh_executor
+    _refresh_executor = executor
+
+
+def _start_refresh(key, fetch, args):
+    if _refresh_executor is None:
+        _refresh(key, fetch, args)
+        return
+    try:
+        _refresh_executor.submit(_refresh, key, fetch, args)
+    except RuntimeError:  # pool shut down
+        with _lock:
+            _refreshing.discard(key)
+
+
+def _refresh(key, fetch, args):
+    try:
+        with scheduler.priority("background"):
+            route = fetch(*args)
+        if _cacheable(route):
+            _store(key, route)
+    except Exception as e:
+        logger.error(f"Route cache refresh error: {e}")
+    finally:
+        with _lock:
+            _refreshing.discard(key)
+
+
+def cached_route(provider, profile, fetch, slat, slon, dlat, dlon):
+    """
+    Return fetch(slat, slon, dlat, dlon) through the cache.
+    Expired-but-not-stale entries are served immediately while the refresh
+    executor fetches them again at background priority, once per key; only
+    successful routes are stored.
+    """
+    key = make_key(provider, profile, slat, slon, dlat, dlon)
+    now = time.time()
+    refresh = False
+
+    with _lock:
+        entry = _entries.get(key)
+        if entry and entry[2] > now:
+            _entries.move_to_end(key)
+            if entry[1] > now:
+                _stats["hits"] += 1
+            else:
+                _stats["stale_hits"] += 1
+                if key not in _refreshing:
+                    _refreshing.add(key)
+                    _stats["refreshes"] += 1
+                    refresh = True
+            blob = entry[0]
+        else:
+            _stats["misses"] += 1
+            blob = None
+
+    if blob is not None:
+        if refresh:
+            _start_refresh(key, fetch, (slat, slon, dlat, dlon))
+        return _unpack(blob)
+
+    route = fetch(slat, slon, dlat, dlon)
+    if _cacheable(route):
+        _store(key, route)
+    return route
+
+
+def stats():
+    with _lock:
+        return dict(_stats, entries=len(_entries), bytes=_size)
+
+
+@metrics.register_collector
+def _collect():
+    s = stats()
+    entries, size = s.pop("entries"), s.pop("bytes")
+    return [
+        ("greenroute_route_cache_events_total", "counter", "Route cache lookups, refreshes and evictions.",
+         {(("event", k),): v for k, v in s.items()}),
+        ("greenroute_route_cache_entries", "gauge", "Routes held in the in-process cache.", {(): entries}),
+        ("greenroute_route_cache_bytes", "gauge", "Compressed bytes held in the route cache.", {(): size}),
+    ]
+
+
+def clear():
+    global _size
+    with _lock:
+        _entries.clear()
+        _refreshing.clear()
+        _size = 0
+        for name in _stats:
+            _stats[name] = 0
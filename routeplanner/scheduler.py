@@ -0,0 +1,272 @@
+import contextvars
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+# provider or (provider, endpoint) -> {"rate": requests/s, "burst": bucket size, "daily": per-key requests per UTC day}
+# An endpoint without its own entry gets its own bucket sized by the provider entry.
+PROVIDER_RATE_LIMITS = {
+    "nominatim": {"rate": 1.0, "burst": 1},  # usage policy: at most 1 request per second
+    # ORS free plan quotas are per key and per endpoint
+    ("ors", "directions"): {"rate": 40 / 60, "burst": 40, "daily": 2000},
+    ("ors", "geocode"): {"rate": 100 / 60, "burst": 100, "daily": 1000},
+    ("ors", "matrix"): {"rate": 40 / 60, "burst": 40, "daily": 500},
+    "ors": {"rate": 20 / 60, "burst": 20, "daily": 500},  # isochrones and anything else
+    "osrm": {"rate": 5.0, "burst": 10},
+    "agro": {"rate": 1.0, "burst": 5},
+    "overpass": {"rate": 0.5, "burst": 2},
+    **getattr(settings, "PROVIDER_RATE_LIMITS", {}),
+}
+# how long each class of traffic may queue for a token before giving up (seconds)
+SCHEDULER_MAX_WAIT = {
+    "interactive": 2.0,
+    "batch": 30.0,
+    "background": 60.0,
+    **getattr(settings, "SCHEDULER_MAX_WAIT", {}),
+}
+SCHEDULER_429_BACKOFF = getattr(settings, "SCHEDULER_429_BACKOFF", 10)  # seconds when no Retry-After is sent
+
+PRIORITIES = {"interactive": 0, "batch": 1, "background": 2}
+
+_priority = contextvars.ContextVar("greenroute_priority", default="interactive")
+_deadline = contextvars.ContextVar("greenroute_deadline", default=None)
+
+
+class RateLimitedError(Exception):
+    """No token became available for a provider within the caller's wait budget."""
+
+
+@contextmanager
+def priority(name):
+    """Run the block's outbound calls at `name` priority (interactive, batch or background)."""
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def with_priority(name, fn, *args):
+    """fn(*args) at `name` priority; handy as an executor target."""
+    with priority(name):
+        return fn(*args)
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextmanager
+def deadline(when):
+    """No token wait in the block runs past `when` (a time.monotonic() value), whatever its priority allows."""
+    token = _deadline.set(when)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def _seconds_to_utc_midnight():
+    now = datetime.now(dt_timezone.utc)
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (tomorrow - now).total_seconds()
+
+
+class Slot:
+    """Token bucket plus daily quota for one API key of a provider (key None for keyless providers)."""
+
+    def __init__(self, index, key, rate, burst, daily=None):
+        self.index = index
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.daily = daily
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.used_today = 0
+        self.day = datetime.now(dt_timezone.utc).date()
+        self.remaining = None  # last quota-remaining the provider reported
+        self.blocked_until = 0.0
+
+    def ready_in(self, now):
+        """Seconds until this slot can send a request."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        today = datetime.now(dt_timezone.utc).date()
+        if today != self.day:
+            self.day, self.used_today = today, 0
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        if self.daily and self.used_today >= self.daily:
+            return _seconds_to_utc_midnight()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+        self.used_today += 1
+        if self.remaining is not None:
+            self.remaining = max(0, self.remaining - 1)
+
+    def quota_left(self):
+        if self.remaining is not None:
+            return self.remaining
+        return self.daily - self.used_today if self.daily else None
+
+
+class ProviderScheduler:
+    """
+    Hands out request slots for one provider endpoint. Waiters queue in priority order
+    (interactive before batch before background, FIFO within a class); the
+    head of the queue takes a token from whichever key is ready soonest,
+    preferring the fullest bucket, so traffic spreads across keys.
+    """
+
+    def __init__(self, name, rate, burst, daily=None, keys=(), endpoint=None):
+        self.name = name
+        self.endpoint = endpoint
+        self.slots = [Slot(i, k, rate, burst, daily) for i, k in enumerate(keys or [None])]
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+
+    def acquire(self, prio=None, timeout=None):
+        prio = prio or current_priority()
+        timeout = SCHEDULER_MAX_WAIT.get(prio, 2.0) if timeout is None else timeout
+        started = time.monotonic()
+        if _deadline.get() is not None:
+            timeout = min(timeout, max(0.0, _deadline.get() - started))
+        deadline = started + timeout
+        entry = (PRIORITIES.get(prio, 0), next(self._seq))
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = deadline - now
+                    if self._queue[0] == entry:
+                        slot = min(self.slots, key=lambda s: (s.ready_in(now), -s.tokens))
+                        ready = slot.ready_in(now)
+                        if ready == 0:
+                            slot.take()
+                            metrics.scheduler_wait.observe(now - started, self.name, self.endpoint or "", prio)
+                            return slot
+                        wait = min(wait, ready)
+                    if deadline - now <= 0:
+                        metrics.scheduler_rejected.inc(self.name, self.endpoint or "", prio)
+                        raise RateLimitedError(f"{self}: no request slot within {timeout:.1f}s ({prio})")
+                    self._cond.wait(wait)
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+    def observe(self, slot, resp):
+        """Learn from quota headers and 429s so the bucket matches the provider's view."""
+        now = time.monotonic()
+        headers = getattr(resp, "headers", None) or {}
+        with self._cond:
+            try:
+                remaining = headers.get("x-ratelimit-remaining")
+                if remaining is not None:
+                    slot.remaining = int(remaining)
+                    reset = headers.get("x-ratelimit-reset")
+                    if slot.remaining <= 0 and reset is not None:
+                        slot.blocked_until = now + max(0.0, float(reset) - time.time())
+                if resp.status_code == 429:
+                    retry_after = headers.get("Retry-After")
+                    backoff = float(retry_after) if retry_after is not None else SCHEDULER_429_BACKOFF
+                    slot.blocked_until = max(slot.blocked_until, now + backoff)
+                    slot.tokens = 0.0
+                    logger.warning(f"{self} key #{slot.index} throttled for {backoff:.0f}s")
+            except (AttributeError, TypeError, ValueError):
+                pass
+            self._cond.notify_all()
+
+    def block(self, slot, seconds):
+        """Bench one key (e.g. after a 401/403); True if another key can still carry traffic."""
+        now = time.monotonic()
+        with self._cond:
+            slot.blocked_until = now + seconds
+            self._cond.notify_all()
+            return any(s.blocked_until <= now for s in self.slots if s is not slot)
+
+    def __str__(self):
+        return f"{self.name}/{self.endpoint}" if self.endpoint else self.name
+
+    def snapshot(self):
+        with self._cond:
+            now = time.monotonic()
+            return [{
+                "key": slot.index,
+                "tokens": round(min(slot.burst, slot.tokens + (now - slot.updated) * slot.rate), 2),
+                "used_today": slot.used_today,
+                "quota_left": slot.quota_left(),
+                "blocked_for": round(max(0.0, slot.blocked_until - now), 1),
+            } for slot in self.slots]
+
+
+_schedulers = {}
+_keys = {}
+_lock = threading.Lock()
+
+
+def set_keys(provider, keys):
+    """API keys to rotate through for `provider`; rebuilds its endpoints' schedulers."""
+    with _lock:
+        _keys[provider] = [k for k in keys if k]
+        for name in [name for name in _schedulers if name[0] == provider]:
+            del _schedulers[name]
+
+
+def get_scheduler(provider, endpoint=None):
+    """
+    The scheduler for `endpoint` of `provider`, or None when no rate limit is
+    configured. Each endpoint has its own buckets and daily quota, from its
+    (provider, endpoint) entry or else the provider's.
+    """
+    limits = PROVIDER_RATE_LIMITS.get((provider, endpoint)) or PROVIDER_RATE_LIMITS.get(provider)
+    if not limits:
+        return None
+    with _lock:
+        if (provider, endpoint) not in _schedulers:
+            _schedulers[(provider, endpoint)] = ProviderScheduler(
+                provider, limits["rate"], limits.get("burst", 1), limits.get("daily"), _keys.get(provider, ()),
+                endpoint=endpoint,
+            )
+        return _schedulers[(provider, endpoint)]
+
+
+def reset():
+    with _lock:
+        _schedulers.clear()
+
+
+@metrics.register_collector
+def _collect():
+    with _lock:
+        schedulers = list(_schedulers.values())
+    tokens, quota = {}, {}
+    for scheduler in schedulers:
+        for slot in scheduler.snapshot():
+            labels = (("provider", scheduler.name), ("endpoint", scheduler.endpoint or ""), ("key", str(slot["key"])))
+            tokens[labels] = slot["tokens"]
+            if slot["quota_left"] is not None:
+                quota[labels] = slot["quota_left"]
+    return [
+        ("greenroute_scheduler_tokens", "gauge", "Request tokens currently available per provider key.", tokens),
+        ("greenroute_provider_quota_remaining", "gauge",
+         "Requests left in the current quota window per provider key.", quota),
+    ]
@@ -0,0 +1,104 @@
+import numpy as np
+
+from django.conf import settings
+
+# -------------------------
+# Config
+# -------------------------
+ROUTE_SAMPLE_KM = getattr(settings, "ROUTE_SAMPLE_KM", 0.5)
+ROUTE_MAX_SAMPLES = getattr(settings, "ROUTE_MAX_SAMPLES", 4000)
+ROUTE_SEGMENT_KM = getattr(settings, "ROUTE_SEGMENT_KM", 2.0)
+ROUTE_MAX_SEGMENTS = getattr(settings, "ROUTE_MAX_SEGMENTS", 150)
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km; works elementwise on arrays."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def cumulative_km(points):
+    """Distance along an (n, 2) [lat, lon] polyline at each vertex."""
+    if len(points) < 2:
+        return np.zeros(len(points))
+    steps = haversine_km(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])
+    return np.concatenate(([0.0], np.cumsum(steps)))
+
+
+def resample(points, cum, step_km=ROUTE_SAMPLE_KM):
+    """
+    Evenly spaced samples along the polyline, at least `step_km` apart and at
+    most ROUTE_MAX_SAMPLES of them. Returns (lats, lons, positions_km, weights_km)
+    where each weight is the stretch of road a sample stands for.
+    """
+    total = cum[-1]
+    step = max(step_km, total / (ROUTE_MAX_SAMPLES - 1))
+    count = max(2, int(np.ceil(total / step)) + 1) if total > 0 else 1
+    positions = np.linspace(0.0, total, count)
+    lats = np.interp(positions, cum, points[:, 0])
+    lons = np.interp(positions, cum, points[:, 1])
+    if count == 1:
+        return lats, lons, positions, np.ones(1)
+    weights = np.full(count, total / (count - 1))
+    weights[[0, -1]] /= 2
+    return lats, lons, positions, weights
+
+
+def route_profile(coords, green_fn, pollution_fn=None, default_green=70.0,
+                  step_km=ROUTE_SAMPLE_KM, segment_km=ROUTE_SEGMENT_KM):
+    """
+    Score a [[lat, lon], ...] route along its whole length.
+    green_fn / pollution_fn take (lats, lons) arrays and return arrays (NaN = unknown).
+    Returns the distance-weighted green cover / pollution plus per-segment values,
+    each segment naming the slice of `coords` it covers.
+    """
+    points = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if not len(points):
+        return {"green_cover": default_green, "pollution": None, "segments": []}
+    cum = cumulative_km(points)
+    lats, lons, positions, weights = resample(points, cum, step_km)
+
+    green = np.asarray(green_fn(lats, lons), dtype=np.float64)
+    green = np.where(np.isnan(green), default_green, green)
+    pollution = None
+    if pollution_fn is not None:
+        pollution = np.asarray(pollution_fn(lats, lons), dtype=np.float64)
+        if np.isnan(pollution).all():
+            pollution = None
+        else:
+            pollution = np.where(np.isnan(pollution), np.nanmean(pollution), pollution)
+
+    total = cum[-1]
+    seg_km = max(segment_km, total / ROUTE_MAX_SEGMENTS) if total > 0 else 1.0
+    seg_ids = np.minimum((positions // seg_km).astype(np.int64), max(0, int(np.ceil(total / seg_km)) - 1))
+    seg_weight = np.bincount(seg_ids, weights=weights)
+    seg_green = np.bincount(seg_ids, weights=weights * green) / np.maximum(seg_weight, 1e-12)
+    seg_pollution = (np.bincount(seg_ids, weights=weights * pollution) / np.maximum(seg_weight, 1e-12)
+                     if pollution is not None else None)
+
+    bounds = np.arange(len(seg_weight) + 1) * seg_km
+    starts = np.clip(np.searchsorted(cum, bounds[:-1], side="right") - 1, 0, len(points) - 1)
+    ends = np.clip(np.searchsorted(cum, bounds[1:], side="left"), 0, len(points) - 1)
+    ends[-1] = len(points) - 1
+
+    segments = []
+    for i in np.flatnonzero(seg_weight):
+        segment = {
+            "start": int(starts[i]),
+            "end": int(ends[i]),
+            "from_km": round(float(bounds[i]), 3),
+            "to_km": round(float(min(bounds[i + 1], total)), 3),
+            "green_cover": round(float(seg_green[i]), 1),
+        }
+        if seg_pollution is not None:
+            segment["pollution"] = round(float(seg_pollution[i]), 1)
+        segments.append(segment)
+
+    return {
+        "green_cover": round(float(np.average(green, weights=weights)), 1),
+        "pollution": round(float(np.average(pollution, weights=weights)), 1) if pollution is not None else None,
+        "segments": segments,
+    }
@@ -0,0 +1,126 @@
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics, scheduler
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+SINGLEFLIGHT_ENABLED = getattr(settings, "SINGLEFLIGHT_ENABLED", True)
+# Django cache alias used for cross-process fill locks; only useful when it is
+# shared between workers (Redis / Memcached). The default LocMemCache is per process.
+SINGLEFLIGHT_CACHE = getattr(settings, "SINGLEFLIGHT_CACHE", "default")
+SINGLEFLIGHT_LOCK_TTL = getattr(settings, "SINGLEFLIGHT_LOCK_TTL", 30)  # seconds; a crashed holder's lock expires
+SINGLEFLIGHT_LOCK_WAIT = getattr(settings, "SINGLEFLIGHT_LOCK_WAIT", 10)  # seconds a follower polls before filling itself
+SINGLEFLIGHT_POLL = getattr(settings, "SINGLEFLIGHT_POLL", 0.05)
+
+
+class _Call:
+    def __init__(self, priority):
+        self.priority = priority  # scheduler.PRIORITIES rank of the leader; lower runs sooner
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_inflight = {}
+_lock = threading.Lock()
+
+
+def do(key, fn, *args, timeout=None):
+    """
+    Run fn(*args) once for every group of concurrent callers with the same
+    `key` (a tuple whose first item names the group, e.g. ("geocode", place)).
+    Followers block until the leader finishes and get its result or exception.
+    Nothing is kept afterwards; caching stays the caller's business.
+    A follower that waits longer than `timeout` runs fn itself.
+    Callers only follow a leader of at least their scheduler priority: an
+    interactive request never waits behind a batch or background run's
+    provider queue, it leads its own call (and later callers follow that).
+    """
+    if not SINGLEFLIGHT_ENABLED:
+        return fn(*args)
+    priority = scheduler.PRIORITIES.get(scheduler.current_priority(), 0)
+    with _lock:
+        call = _inflight.get(key)
+        leader = call is None or call.priority > priority
+        if leader:
+            call = _inflight[key] = _Call(priority)
+
+    if not leader:
+        if call.done.wait(timeout):
+            metrics.singleflight_calls.inc(key[0], "follower")
+            if call.error is not None:
+                raise call.error
+            return call.result
+        metrics.singleflight_calls.inc(key[0], "timeout")
+        return fn(*args)
+
+    metrics.singleflight_calls.inc(key[0], "leader")
+    try:
+        call.result = fn(*args)
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            if _inflight.get(key) is call:
+                del _inflight[key]
+        call.done.set()
+
+
+def inflight():
+    with _lock:
+        return len(_inflight)
+
+
+def _lock_key(name):
+    return "sf:" + hashlib.sha1(name.encode()).hexdigest()
+
+
+def locked_fill(name, lookup, compute, wait=SINGLEFLIGHT_LOCK_WAIT):
+    """
+    Fill a cache shared between processes without a thundering herd: only the
+    process that wins the lock runs compute() (which must store its result
+    where lookup() finds it); the others poll lookup() -> (hit, value) until
+    the value appears, the lock is released, or `wait` runs out, and only then
+    compute it themselves.
+    """
+    if not SINGLEFLIGHT_ENABLED:
+        return compute()
+    cache = caches[SINGLEFLIGHT_CACHE]
+    key = _lock_key(name)
+    try:
+        acquired = cache.add(key, 1, SINGLEFLIGHT_LOCK_TTL)
+    except Exception as e:
+        logger.error(f"Fill lock unavailable for {name}: {e}")
+        return compute()
+
+    if acquired:
+        try:
+            return compute()
+        finally:
+            try:
+                cache.delete(key)
+            except Exception as e:
+                logger.error(f"Could not release fill lock for {name}: {e}")
+
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(SINGLEFLIGHT_POLL)
+        hit, value = lookup()
+        if hit:
+            metrics.singleflight_calls.inc("fill", "follower")
+            return value
+        if cache.get(key) is None:
+            break  # holder gave up without storing anything
+    metrics.singleflight_calls.inc("fill", "timeout")
+    return compute()
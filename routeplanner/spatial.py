@@ -0,0 +1,216 @@
+import logging
+import math
+import re
+import threading
+
+import numpy as np
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from . import metrics, scoring
+from .hierarchy import get_graph, get_hierarchy
+from .models import GeocodeCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+# a "lat,lon" query this close to a known place or road graph node is answered locally
+SPATIAL_SNAP_RADIUS_KM = getattr(settings, "SPATIAL_SNAP_RADIUS_KM", 0.25)
+SPATIAL_CELL_DEG = getattr(settings, "SPATIAL_CELL_DEG", 0.01)  # place grid, ~1.1 km
+
+KM_PER_DEG = math.pi / 180 * scoring.EARTH_RADIUS_KM
+
+_LATLON = re.compile(r"^\s*([-+]?\d{1,2}(?:\.\d+)?)\s*,\s*([-+]?\d{1,3}(?:\.\d+)?)\s*$")
+
+
+def parse_latlon(text):
+    """(lat, lon) for a "lat,lon" query such as a map click, else None."""
+    match = _LATLON.match(text or "")
+    if not match:
+        return None
+    lat, lon = float(match.group(1)), float(match.group(2))
+    if abs(lat) > 90 or abs(lon) > 180:
+        return None
+    return lat, lon
+
+
+def _km(lat1, lon1, lat2, lon2):
+    # scalar haversine; cheaper than the numpy one for the handful of points in a cell
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * scoring.EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+class GridIndex:
+    """
+    Points bucketed into a fixed lat/lon grid. nearest() searches rings of
+    cells outwards from the query's cell and stops once no unvisited cell can
+    hold anything closer, so a lookup touches a few cells instead of every
+    point. Points can be added at any time.
+    """
+
+    def __init__(self, lats=(), lons=(), labels=None, cell_deg=None):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        if cell_deg is None:
+            # aim for a couple of points per occupied cell
+            span = max(np.ptp(lats), np.ptp(lons), SPATIAL_CELL_DEG) if len(lats) else SPATIAL_CELL_DEG
+            cell_deg = max(span / max(1.0, math.sqrt(len(lats) / 2)), 1e-4)
+        self.cell_deg = cell_deg
+        self.lats, self.lons, self.labels = [], [], []
+        self.cells = {}
+        self.bounds = None  # (min row, max row, min col, max col)
+        self._arrays = None
+        self._lock = threading.Lock()
+        for i, (lat, lon) in enumerate(zip(lats.tolist(), lons.tolist())):
+            self.add(lat, lon, labels[i] if labels is not None else None)
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def add(self, lat, lon, label=None):
+        row, col = self._cell(lat, lon)
+        with self._lock:
+            self.lats.append(lat)
+            self.lons.append(lon)
+            self.labels.append(label)
+            self.cells.setdefault((row, col), []).append(len(self.lats) - 1)
+            b = self.bounds or (row, row, col, col)
+            self.bounds = (min(b[0], row), max(b[1], row), min(b[2], col), max(b[3], col))
+            self._arrays = None
+
+    def _ring(self, row, col, r):
+        if r == 0:
+            yield row, col
+            return
+        for c in range(col - r, col + r + 1):
+            yield row - r, c
+            yield row + r, c
+        for rr in range(row - r + 1, row + r):
+            yield rr, col - r
+            yield rr, col + r
+
+    def _brute(self, lat, lon):
+        with self._lock:
+            if self._arrays is None:
+                self._arrays = (np.asarray(self.lats), np.asarray(self.lons))
+            lats, lons = self._arrays
+        km = scoring.haversine_km(lat, lon, lats, lons)
+        i = int(np.argmin(km))
+        return float(km[i]), i
+
+    def nearest(self, lat, lon, max_km=None):
+        """(point index, km) of the closest point, or None if there is none within max_km."""
+        if not self.lats:
+            return None
+        row, col = self._cell(lat, lon)
+        b = self.bounds
+        last_ring = max(abs(row - b[0]), abs(row - b[1]), abs(col - b[2]), abs(col - b[3]))
+        size = self.cell_deg
+        best = (math.inf, -1)
+        r = 0
+        while True:
+            if (2 * r + 1) ** 2 > 4 * len(self.cells):
+                best = self._brute(lat, lon)  # sparse grid; cheaper to check every point
+                break
+            for cell in self._ring(row, col, r):
+                for i in self.cells.get(cell, ()):
+                    km = _km(lat, lon, self.lats[i], self.lons[i])
+                    if km < best[0]:
+                        best = (km, i)
+            # anything not yet visited lies outside the searched block of cells;
+            # east-west degrees are measured at the block's poleward edge
+            dy = min(lat - (row - r) * size, (row + r + 1) * size - lat)
+            dx = min(lon - (col - r) * size, (col + r + 1) * size - lon)
+            coslat = math.cos(math.radians(min(89.9, abs(lat) + (r + 1) * size)))
+            bound = min(dy, dx * coslat) * KM_PER_DEG * 0.999
+            if best[0] <= bound or r >= last_ring or (max_km is not None and bound > max_km):
+                break
+            r += 1
+        if best[1] < 0 or (max_km is not None and best[0] > max_km):
+            return None
+        return best[1], best[0]
+
+
+# -------------------------
+# Shared indexes
+# -------------------------
+_places = None
+_nodes = {}  # id(lats) -> (lats, GridIndex)
+_lock = threading.Lock()
+
+
+def places():
+    """Index over every place the geocode cache has coordinates for, labelled by query text."""
+    global _places
+    if _places is None:
+        with _lock:
+            if _places is None:
+                try:
+                    rows = list(GeocodeCacheEntry.objects.filter(found=True).values_list("query", "lat", "lon"))
+                except DatabaseError as e:
+                    logger.error(f"Place index load error: {e}")
+                    rows = []
+                index = GridIndex(cell_deg=SPATIAL_CELL_DEG)
+                for query, lat, lon in rows:
+                    index.add(lat, lon, query)
+                _places = index
+    return _places
+
+
+def add_place(query, coords):
+    """Index a freshly geocoded place (no-op until the index has been loaded)."""
+    if _places is not None and coords:
+        _places.add(coords[0], coords[1], query)
+
+
+def nodes_for(lats, lons):
+    """Index over a graph's node coordinates, built once per coordinate array."""
+    with _lock:
+        entry = _nodes.get(id(lats))
+        if entry is None or entry[0] is not lats:
+            entry = _nodes[id(lats)] = (lats, GridIndex(lats, lons))
+        return entry[1]
+
+
+def _road_nodes():
+    graph = get_graph()
+    if graph is not None and graph.lat is not None:
+        return graph.lat, graph.lon
+    ch = get_hierarchy()
+    if ch is not None and ch.lat is not None:
+        return ch.lat, ch.lon
+    return None
+
+
+def snap(lat, lon, radius_km=None):
+    """
+    (lat, lon) of the closest known place or road graph node within
+    radius_km (SPATIAL_SNAP_RADIUS_KM by default), or None.
+    """
+    radius_km = SPATIAL_SNAP_RADIUS_KM if radius_km is None else radius_km
+    best = None
+    hit = places().nearest(lat, lon, radius_km)
+    if hit:
+        index = places()
+        best = ((index.lats[hit[0]], index.lons[hit[0]]), hit[1], "place")
+    nodes = _road_nodes()
+    if nodes is not None:
+        hit = nodes_for(*nodes).nearest(lat, lon, radius_km)
+        if hit and (best is None or hit[1] < best[1]):
+            best = ((float(nodes[0][hit[0]]), float(nodes[1][hit[0]])), hit[1], "node")
+    metrics.spatial_snaps.inc(best[2] if best else "miss")
+    return best[0] if best else None
+
+
+def clear():
+    global _places
+    with _lock:
+        _places = None
+        _nodes.clear()
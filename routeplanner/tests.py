@@ -1,15 +1,1298 @@
-from django.test import TestCase
-from .models import Route
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import addModuleCleanup
+from unittest.mock import Mock, patch
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.signals import request_started
+from django.db import DatabaseError
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+from django.utils import timezone
+from .models import DailyRouteStats, GreenCoverCell, Place, RouteGeometry, RouteHistory, RoutePairStats
+from . import archive, clients, dijkstra, exports, geocache, geometry, greencover, hierarchy, history, metrics, providers, raster, rollups, routecache, scheduler, scoring, singleflight, spatial, tiles, views, warmup
+
+def setUpModule():
+    # write history on the request thread: the write-behind thread runs outside each
+    # test's transaction, so its inserts would fail ("table is locked") or leak rows
+    patcher = patch.object(history, 'HISTORY_WRITE_BEHIND', False)
+    patcher.start()
+    addModuleCleanup(patcher.stop)
+    # nor is the periodic cache warmer started by the first test request
+    patcher = patch.object(warmup.warmer, 'interval', 0)
+    patcher.start()
+    addModuleCleanup(patcher.stop)
 
 class RouteModelTest(TestCase):
     def test_route_creation(self):
-        route = Route.objects.create(
+        route = RouteHistory.objects.create(
             source='Madurai',
             destination='Tenkasi',
             green_cover=60.0,
             pollution_index=40.0,
-            distance_km=160.0,
+            distance=160.0,
             eco_cost=260.0
         )
         self.assertEqual(route.source, 'Madurai')
         self.assertEqual(route.destination, 'Tenkasi')
+
+class GeocodeCacheTest(TestCase):
+    def setUp(self):
+        geocache.clear()
+
+    def test_normalize_place(self):
+        self.assertEqual(geocache.normalize_place('  Tiruchirāppalli ,TN '), 'tiruchirappalli, tn')
+        self.assertEqual(geocache.normalize_place('MADURAI'), geocache.normalize_place('madurai'))
+
+    def test_lru_and_db_tiers(self):
+        self.assertEqual(geocache.get('ors', 'Madurai'), (False, None))
+        geocache.put('ors', 'Madurai', (9.925, 78.119))
+        self.assertEqual(geocache.get('ors', ' madurai '), (True, (9.925, 78.119)))
+        self.assertEqual(geocache.stats()['hits'], 1)
+
+        geocache.clear()
+        self.assertEqual(geocache.get('ors', 'Madurai'), (True, (9.925, 78.119)))
+        self.assertEqual(geocache.stats()['db_hits'], 1)
+
+    def test_negative_caching(self):
+        geocache.put('nominatim', 'Nowhereville', None)
+        self.assertEqual(geocache.get('nominatim', 'nowhereville'), (True, None))
+        self.assertEqual(geocache.get('ors', 'nowhereville'), (False, None))
+
+class RouteCacheTest(TestCase):
+    def setUp(self):
+        routecache.clear()
+        self.calls = 0
+
+    def fetch(self, slat, slon, dlat, dlon):
+        self.calls += 1
+        return {"distance_km": 160.0, "coords": [[slat, slon], [dlat, dlon]]}
+
+    def test_quantized_hit(self):
+        routecache.cached_route('osrm', 'driving', self.fetch, 9.92501, 78.11901, 8.96, 77.31)
+        route = routecache.cached_route('osrm', 'driving', self.fetch, 9.92504, 78.11899, 8.96, 77.31)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(route["coords"][0], [9.92501, 78.11901])
+        self.assertEqual(routecache.stats()['hits'], 1)
+
+    def test_failures_not_cached(self):
+        routecache.cached_route('ors', 'driving-car', lambda *a: None, 1, 2, 3, 4)
+        self.assertEqual(routecache.stats()['entries'], 0)
+
+    def test_stale_while_revalidate(self):
+        with patch.object(routecache, 'ROUTE_CACHE_TTL', -1):
+            routecache.cached_route('osrm', 'driving', self.fetch, 1, 2, 3, 4)
+        route = routecache.cached_route('osrm', 'driving', self.fetch, 1, 2, 3, 4)
+        self.assertEqual(route["distance_km"], 160.0)
+        self.assertEqual(routecache.stats()['stale_hits'], 1)
+        self.assertEqual(routecache.stats()['refreshes'], 1)
+
+    def test_stale_refresh_runs_once_on_the_executor(self):
+        executor = Mock()
+        with patch.object(routecache, '_refresh_executor', executor):
+            with patch.object(routecache, 'ROUTE_CACHE_TTL', -1):
+                routecache.cached_route('osrm', 'driving', self.fetch, 1, 2, 3, 4)
+            for _ in range(3):
+                routecache.cached_route('osrm', 'driving', self.fetch, 1, 2, 3, 4)
+        executor.submit.assert_called_once()
+        self.assertIs(executor.submit.call_args.args[0], routecache._refresh)
+        self.assertEqual(routecache.stats()['refreshes'], 1)
+        self.assertIs(routecache._refresh_executor, views._bulk_executor)
+
+class PlanRouteTest(TestCase):
+    def setUp(self):
+        geocache.clear()
+        routecache.clear()
+
+    def test_stages_run_concurrently(self):
+        def slow_cover(lat, lon):
+            time.sleep(0.2)
+            return 50.0
+
+        with patch.object(views, 'ORS_API_KEY', ''), \
+             patch.object(views, 'nominatim_geocode', side_effect=[(9.9, 78.1), (8.9, 77.3)]), \
+             patch.object(views, 'osrm_route', return_value={"distance_km": 160.0, "coords": []}), \
+             patch.object(views, 'get_green_cover', side_effect=slow_cover):
+            started = time.monotonic()
+            result, error = views.plan_route('Madurai', 'Tenkasi')
+
+        self.assertIsNone(error)
+        self.assertLess(time.monotonic() - started, 0.35)
+        self.assertEqual(result["green_cover"], 50.0)
+        self.assertEqual(result["pollution_index"], 32.0)
+
+    def test_green_cover_timeout_uses_default(self):
+        def stuck_cover(lat, lon):
+            time.sleep(0.3)
+            return 10.0
+
+        with patch.object(views, 'ORS_API_KEY', ''), \
+             patch.dict(views.PIPELINE_STAGE_TIMEOUTS, {'green_cover': 0.05}), \
+             patch.object(views, 'nominatim_geocode', return_value=(9.9, 78.1)), \
+             patch.object(views, 'osrm_route', return_value={"distance_km": 10.0, "coords": []}), \
+             patch.object(views, 'get_green_cover', side_effect=stuck_cover):
+            result, error = views.plan_route('Madurai', 'Madurai')
+
+        self.assertEqual(result["green_cover"], views.DEFAULT_GREEN_COVER)
+
+    def test_unknown_place(self):
+        with patch.object(views, 'ORS_API_KEY', ''), \
+             patch.object(views, 'nominatim_geocode', return_value=None):
+            self.assertEqual(views.plan_route('Nowhere', 'Madurai'), (None, "location"))
+
+class ProviderClientTest(TestCase):
+    def test_breaker_opens_after_failures_and_half_opens(self):
+        breaker = clients.CircuitBreaker('osrm', threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())   # single half-open trial
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_forbidden_opens_circuit_immediately(self):
+        client = clients.ProviderClient('ors')
+        with patch.object(client.session, 'request', return_value=Mock(status_code=403)) as request:
+            client.get('https://api.openrouteservice.org/geocode/search')
+            self.assertFalse(client.available())
+            with self.assertRaises(clients.CircuitOpenError):
+                client.get('https://api.openrouteservice.org/geocode/search')
+        self.assertEqual(request.call_count, 1)
+
+class GreenCoverServiceTest(TestCase):
+    def setUp(self):
+        greencover.clear()
+
+    def test_nearby_points_share_cell(self):
+        self.assertEqual(greencover.cell_for(9.9251, 78.1050), greencover.cell_for(9.9301, 78.1100))
+        self.assertNotEqual(greencover.cell_for(9.9251, 78.1050), greencover.cell_for(9.9251, 78.1250))
+
+    def test_polygon_registered_once_per_cell(self):
+        with patch.object(greencover, '_register_polygon', return_value='poly-1') as register, \
+             patch.object(greencover, '_latest_ndvi', return_value=0.4) as ndvi:
+            self.assertEqual(greencover.green_cover(9.9251, 78.1050), 70.0)
+            greencover.clear()
+            self.assertEqual(greencover.green_cover(9.9301, 78.1100), 70.0)
+        self.assertEqual(register.call_count, 1)
+        self.assertEqual(ndvi.call_count, 1)
+        self.assertEqual(GreenCoverCell.objects.get().polygon_id, 'poly-1')
+
+    def test_no_orphan_polygons_when_the_row_cannot_be_saved(self):
+        with patch.object(greencover, '_register_polygon', return_value='poly-2') as register, \
+             patch.object(greencover, '_latest_ndvi', return_value=0.4), \
+             patch.object(greencover, '_delete_polygon') as delete, \
+             self.assertLogs('routeplanner.greencover', 'ERROR'):
+            with patch.object(GreenCoverCell.objects, 'get_or_create', side_effect=DatabaseError('locked')):
+                self.assertIsNone(greencover.green_cover(9.9251, 78.1050))
+            register.assert_not_called()  # no saved row to keep the id in
+
+            with patch.object(GreenCoverCell.objects, 'filter', side_effect=DatabaseError('locked')):
+                self.assertIsNone(greencover.green_cover(9.9251, 78.1050))
+            register.assert_called_once()
+            delete.assert_called_once_with('poly-2')
+        self.assertEqual(GreenCoverCell.objects.get().polygon_id, '')
+
+    def test_polygon_registered_elsewhere_first_is_reused(self):
+        row = GreenCoverCell.objects.create(cell='1:2')
+        GreenCoverCell.objects.filter(pk=row.pk).update(polygon_id='theirs')  # another worker won the race
+        with patch.object(greencover, '_register_polygon', return_value='ours'), \
+             patch.object(greencover, '_delete_polygon') as delete:
+            self.assertEqual(greencover._new_polygon('1:2', row), 'theirs')
+        delete.assert_called_once_with('ours')
+
+    def test_memory_cache_is_bounded(self):
+        with patch.object(greencover, 'GREEN_COVER_CACHE_SIZE', 2):
+            for cell in ('1:1', '1:2', '1:3'):
+                greencover._remember(cell, 50.0, time.time() + 60)
+            self.assertEqual(list(greencover._cells), ['1:2', '1:3'])
+
+class EcoRasterTest(TestCase):
+    def test_build_and_sample(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            osm = os.path.join(tmp, 'extract.geojson')
+            with open(osm, 'w') as f:
+                json.dump({"features": [
+                    {"properties": {"landuse": "forest"},
+                     "geometry": {"type": "Point", "coordinates": [78.015, 9.015]}},
+                    {"properties": {"highway": "motorway"},
+                     "geometry": {"type": "LineString", "coordinates": [[78.035, 9.035], [78.036, 9.036]]}},
+                ]}, f)
+            out = os.path.join(tmp, 'eco')
+            call_command('build_eco_raster', '--bbox', '9', '78', '9.05', '78.05', '--cell', '0.01',
+                         '--osm', osm, '--out', out, stdout=io.StringIO())
+
+            grid = raster.EcoRaster(out)
+            self.assertEqual((grid.rows, grid.cols), (5, 5))
+            self.assertEqual(grid.sample(9.015, 78.015, raster.GREEN), 10.0)
+            # cells with no source are no data, not a reading of 0
+            self.assertIsNone(grid.sample(9.045, 78.005, raster.GREEN))
+            self.assertIsNone(grid.sample(9.005, 78.005, raster.POLLUTION))
+            self.assertEqual(grid.sample(9.035, 78.035, raster.POLLUTION), 100.0)
+            self.assertIsNone(grid.sample(10.0, 78.0, raster.GREEN))
+            del grid
+
+class RouteScoringTest(TestCase):
+    def test_haversine(self):
+        self.assertAlmostEqual(float(scoring.haversine_km(0, 0, 0, 1)), 111.195, places=2)
+
+    def test_profile_is_distance_weighted(self):
+        # 20 km due east; the first quarter is forest, the rest is bare
+        coords = [[0.0, lon] for lon in np.linspace(0, 0.178, 10)]
+        green_fn = lambda lats, lons: np.where(lons < 0.045, 100.0, 0.0)
+        profile = scoring.route_profile(coords, green_fn, segment_km=5.0)
+
+        self.assertAlmostEqual(profile["green_cover"], 25.0, delta=2)
+        self.assertEqual(len(profile["segments"]), 4)
+        self.assertEqual(profile["segments"][0]["start"], 0)
+        self.assertEqual(profile["segments"][-1]["end"], len(coords) - 1)
+        self.assertGreater(profile["segments"][0]["green_cover"], 90)
+        self.assertEqual(profile["segments"][-1]["green_cover"], 0.0)
+
+    def test_long_geometry_is_capped(self):
+        coords = np.column_stack([np.linspace(8, 13, 50000), np.linspace(77, 80, 50000)]).tolist()
+        started = time.monotonic()
+        profile = scoring.route_profile(coords, lambda lats, lons: np.full(len(lats), 60.0))
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(profile["green_cover"], 60.0)
+        self.assertLessEqual(len(profile["segments"]), scoring.ROUTE_MAX_SEGMENTS)
+
+def random_graph(n, m, seed):
+    rng = np.random.default_rng(seed)
+    src, dst = rng.integers(0, n, m), rng.integers(0, n, m)
+    return dijkstra.Graph.from_edges(n, src, dst, rng.uniform(0.1, 5, m),
+                                     rng.uniform(0, 100, m), rng.uniform(0, 100, m),
+                                     lat=rng.uniform(9, 10, n), lon=rng.uniform(77, 78, n))
+
+class GraphEngineTest(TestCase):
+    def test_legacy_wrapper(self):
+        graph = {'A': {'B': 4, 'C': 1}, 'C': {'B': 1}, 'B': {'D': 1}}
+        pollution = {'B': 0, 'C': 0, 'D': 0}
+        green = {'B': 100, 'C': 100, 'D': 100}
+        result = dijkstra.dijkstra(graph, 'A', 'D', pollution, green)
+        self.assertEqual(result, {"path": ['A', 'C', 'B', 'D'], "eco_cost": 3.0})
+        self.assertEqual(dijkstra.dijkstra(graph, 'D', 'A', pollution, green), {"path": [], "eco_cost": float("-inf")})
+        self.assertEqual(dijkstra.dijkstra(graph, 'A', 'Z', pollution, green), {"path": [], "eco_cost": float("-inf")})
+        # a trip to itself is a one-node path, even for a node the graph does not know
+        self.assertEqual(dijkstra.dijkstra(graph, 'Z', 'Z', pollution, green), {"path": ['Z'], "eco_cost": 0})
+
+    def test_pollution_makes_detour_worthwhile(self):
+        graph = {'A': {'B': 1, 'C': 1.2}, 'B': {'D': 1}, 'C': {'D': 1}}
+        result = dijkstra.dijkstra(graph, 'A', 'D', {'B': 100}, {'B': 0, 'C': 100, 'D': 100})
+        self.assertEqual(result["path"], ['A', 'C', 'D'])
+
+    def test_rejects_negative_coefficients(self):
+        with self.assertRaises(ValueError):
+            dijkstra.EcoWeights(green=-1)
+
+    def test_bidirectional_matches_dijkstra(self):
+        for seed in range(20):
+            g = random_graph(60, 240, seed)
+            for s, t in np.random.default_rng(seed).integers(0, 60, (10, 2)):
+                cost, path = dijkstra.shortest_path(g, int(s), int(t))
+                bi_cost, bi_path = dijkstra.bidirectional_path(g, int(s), int(t))
+                self.assertAlmostEqual(cost, bi_cost)
+                if path:
+                    self.assertEqual((bi_path[0], bi_path[-1]), (s, t))
+
+def geometric_graph(n, m, seed):
+    """Random graph whose edge lengths are at least the straight-line distance."""
+    rng = np.random.default_rng(seed)
+    lat, lon = rng.uniform(9, 9.5, n), rng.uniform(77, 77.5, n)
+    src, dst = rng.integers(0, n, m), rng.integers(0, n, m)
+    dist = scoring.haversine_km(lat[src], lon[src], lat[dst], lon[dst]) * rng.uniform(1, 1.5, m)
+    return dijkstra.Graph.from_edges(n, src, dst, dist, rng.uniform(0, 100, m), rng.uniform(0, 100, m),
+                                     lat=lat, lon=lon)
+
+class EcoRoutingEngineTest(TestCase):
+    def test_astar_matches_dijkstra(self):
+        for seed in range(10):
+            g = geometric_graph(80, 320, seed)
+            for s, t in np.random.default_rng(seed).integers(0, 80, (10, 2)):
+                self.assertAlmostEqual(dijkstra.astar_path(g, int(s), int(t))[0],
+                                       dijkstra.shortest_path(g, int(s), int(t))[0])
+
+    def test_hierarchy_matches_dijkstra(self):
+        for seed in range(10):
+            g = random_graph(70, 260, seed)
+            eco = dijkstra.EcoWeights(pollution=0.5, green=0.2)
+            ch = hierarchy.ContractionHierarchy.build(g, eco)
+            weights = g.weights(eco)
+            for s, t in np.random.default_rng(seed).integers(0, 70, (15, 2)):
+                cost, path = dijkstra.shortest_path(g, int(s), int(t), eco)
+                ch_cost, ch_path = ch.query(int(s), int(t))
+                self.assertAlmostEqual(cost, ch_cost)
+                # the unpacked path is a real path with the reported cost
+                walked = sum(min(weights[e] for e in range(g.indptr[a], g.indptr[a + 1]) if g.indices[e] == b)
+                             for a, b in zip(ch_path, ch_path[1:]))
+                self.assertAlmostEqual(walked, ch_cost if ch_path else 0.0)
+
+    def test_build_road_graph_command(self):
+        osm = """<osm>
+          <node id="1" lat="9.900" lon="78.100"/><node id="2" lat="9.910" lon="78.100"/>
+          <node id="3" lat="9.920" lon="78.100"/><node id="4" lat="9.910" lon="78.110"/>
+          <way id="10"><nd ref="1"/><nd ref="2"/><nd ref="3"/><tag k="highway" v="motorway"/></way>
+          <way id="11"><nd ref="1"/><nd ref="4"/><nd ref="3"/><tag k="highway" v="residential"/></way>
+        </osm>"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'extract.osm')
+            with open(path, 'w') as f:
+                f.write(osm)
+            out = os.path.join(tmp, 'roads')
+            with patch.object(raster, 'get_raster', return_value=None):
+                call_command('build_road_graph', path, '--out', out, stdout=io.StringIO())
+            graph = dijkstra.load_graph(f'{out}.graph.npz')
+            ch = hierarchy.ContractionHierarchy.load(f'{out}.ch.npz')
+
+        self.assertEqual(graph.n, 4)
+        self.assertEqual(ch.route(3, 1)["path"], [3, 4, 1])  # motorway is one-way
+        cost, path = dijkstra.shortest_path(graph, graph.ids[1], graph.ids[3])
+        self.assertEqual(ch.route(1, 3), {"path": [graph.names[i] for i in path], "eco_cost": round(cost, 2)})
+        self.assertEqual(ch.route(1, 99), {"path": [], "eco_cost": float("-inf")})
+
+        # over the node limit only the plain graph is written, and routing falls back to A*
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'extract.osm')
+            with open(path, 'w') as f:
+                f.write(osm)
+            out = os.path.join(tmp, 'roads')
+            with patch.object(raster, 'get_raster', return_value=None):
+                call_command('build_road_graph', path, '--out', out, '--ch-max-nodes', '3',
+                             '--pollution-weight', '2', stdout=io.StringIO())
+            self.assertFalse(os.path.exists(f'{out}.ch.npz'))
+            graph = dijkstra.load_graph(f'{out}.graph.npz')
+        self.assertEqual(graph.eco.key(), (1.0, 2.0, dijkstra.DEFAULT_WEIGHTS.green))
+        with self.assertRaises(ValueError):
+            hierarchy.ContractionHierarchy.build(graph, max_nodes=3)
+        searches = metrics.graph_searches.value('astar')
+        with patch.object(providers, 'get_hierarchy', return_value=None), \
+             patch.object(providers, 'get_graph', return_value=graph):
+            leg = providers.graph_route(9.92, 78.10, 9.90, 78.10)
+            # the stored pollution weight makes the quiet road beat the shorter motorway
+            quiet = providers.graph_route(9.90, 78.10, 9.92, 78.10)
+        self.assertEqual(leg["coords"], [[9.92, 78.1], [9.91, 78.11], [9.9, 78.1]])
+        self.assertEqual(quiet["coords"], [[9.9, 78.1], [9.91, 78.11], [9.92, 78.1]])
+        self.assertEqual(metrics.graph_searches.value('astar'), searches + 2)  # the fallback is counted
+
+class BatchRouteApiTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('fleet', password='x')
+        self.client.force_login(self.user)
+
+    def post(self, body, **extra):
+        return self.client.post(reverse('route_batch_api'), json.dumps(body), content_type='application/json', **extra)
+
+    def test_matrix_batch_streams_ndjson(self):
+        places = {'Madurai': (9.9, 78.1), 'Tenkasi': (8.9, 77.3), 'Chennai': (13.1, 80.3)}
+        with patch.object(views, 'geocode_place', side_effect=places.get) as geocode, \
+             patch.object(views, 'fetch_matrix', return_value=[[0, 160, 460], [160, 0, 620], [460, 620, 0]]) as matrix, \
+             patch.object(views, 'fetch_route') as fetch_route, \
+             patch.object(views, 'get_green_cover', return_value=60.0), \
+             patch.object(history, 'record') as record:
+            resp = self.post({"origins": ["Madurai", "MADURAI "], "destinations": ["Tenkasi", "Chennai"]})
+            lines = [json.loads(line) for line in b''.join(resp.streaming_content).splitlines()]
+
+        self.assertEqual(resp['Content-Type'], 'application/x-ndjson')
+        # deduplicated on the normalised name, geocoded as first typed
+        self.assertEqual(sorted(c.args[0] for c in geocode.call_args_list), ['Chennai', 'Madurai', 'Tenkasi'])
+        self.assertEqual(matrix.call_count, 1)
+        fetch_route.assert_not_called()
+        self.assertEqual(sorted(line["index"] for line in lines), [0, 1, 2, 3])
+        self.assertEqual(lines[1]["distance"], 460)
+        self.assertEqual(record.call_count, 4)
+
+    def test_unknown_place_and_bad_body(self):
+        with patch.object(views, 'geocode_place', return_value=None), \
+             patch.object(history, 'record'):
+            resp = self.post({"pairs": [{"source": "Nowhere", "destination": "Madurai"}]}, HTTP_ACCEPT_ENCODING='gzip')
+            lines = [json.loads(line) for line in b''.join(resp.streaming_content).splitlines()]
+        self.assertEqual(lines, [{"index": 0, "source": "Nowhere", "destination": "Madurai", "error": "Invalid location"}])
+        self.assertFalse(resp.has_header('Content-Encoding'))  # streamed lines are not held back by gzip
+        self.assertEqual(self.post({"pairs": [{"source": "Madurai"}]}).status_code, 400)
+
+    def test_bare_list_of_pairs(self):
+        with patch.object(views, 'geocode_place', return_value=(9.9, 78.1)), \
+             patch.object(views, 'fetch_matrix', return_value=[[0, 12], [12, 0]]), \
+             patch.object(views, 'get_green_cover', return_value=60.0), \
+             patch.object(history, 'record'):
+            resp = self.post([{"source": "Madurai", "destination": "Melur"}, ["Melur", "Madurai"]])
+            lines = [json.loads(line) for line in b''.join(resp.streaming_content).splitlines()]
+        self.assertEqual(sorted((line["source"], line["destination"]) for line in lines),
+                         [("Madurai", "Melur"), ("Melur", "Madurai")])
+        self.assertEqual(self.post([["Madurai"]]).status_code, 400)
+
+class HistoryRecorderTest(TestCase):
+    def row(self, i):
+        return RouteHistory(source=f'S{i}', destination='D', green_cover=50, pollution_index=10, eco_cost=60)
+
+    def test_batches_rows_and_counts(self):
+        recorder = history.HistoryRecorder(queue_size=10, batch_size=4)
+        with patch.object(RouteHistory.objects, 'bulk_create') as bulk_create:
+            for i in range(6):
+                recorder.queue.put(self.row(i))
+            recorder.flush()
+        self.assertEqual([len(c[0][0]) for c in bulk_create.call_args_list], [4, 2])
+        self.assertEqual(recorder.snapshot()["flushed"], 6)
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        recorder = history.HistoryRecorder(queue_size=2, enqueue_timeout=0.01)
+        with patch.object(history, 'HISTORY_WRITE_BEHIND', True), patch.object(recorder, '_ensure_worker'):
+            for i in range(3):
+                recorder.record(self.row(i))
+        self.assertEqual(recorder.snapshot(), {"queued": 2, "flushed": 0, "dropped": 1, "failed": 0,
+                                               "batches": 0, "pending": 2})
+
+    def test_synchronous_mode_writes_immediately(self):
+        with patch.object(history, 'HISTORY_WRITE_BEHIND', False):
+            history.HistoryRecorder().record(self.row(0))
+        self.assertEqual(RouteHistory.objects.count(), 1)
+
+    def test_request_history_is_written_in_tests(self):
+        self.client.force_login(User.objects.create_user(username='recorded', password='pw'))
+        before = history.recorder.snapshot()
+        offline = {kind: {'synthetic': 0} for kind in providers.KINDS}
+        with patch.object(providers, 'PROVIDER_BACKENDS', offline), \
+             patch.object(raster, 'get_raster', return_value=None):
+            resp = self.client.get(reverse('route_api'), {'source': 'Erode', 'destination': 'Salem'})
+        self.assertEqual(resp.status_code, 200)
+        after = history.recorder.snapshot()
+        self.assertEqual(after["failed"], before["failed"])
+        self.assertEqual(after["flushed"], before["flushed"] + 1)
+        self.assertEqual(RouteHistory.objects.filter(source_place__name='Erode', destination_place__name='Salem').count(), 1)
+        self.assertIsNone(history.recorder._thread)  # no writer thread outliving the test
+
+class RollupTest(TestCase):
+    def row(self, source, eco_cost, when):
+        row = views.RouteHistory(source=source, destination='Tenkasi', distance=10, green_cover=50,
+                                 pollution_index=20, eco_cost=eco_cost, created_at=when)
+        Place.attach([row])
+        return row
+
+    def test_apply_increments_counters(self):
+        now = timezone.now()
+        rollups.apply([self.row('Madurai', 40, now), self.row('Madurai', 60, now)])
+        rollups.apply([self.row('Chennai', None, now)])
+
+        day = DailyRouteStats.objects.get()
+        self.assertEqual((day.routes, day.eco_cost_count, day.avg_eco_cost), (3, 2, 50))
+        rollups.apply([self.row('Madurai', 80, now - timedelta(days=3))])
+        stats = rollups.dashboard_stats(days=1)
+        self.assertEqual(stats["total_routes"], 4)
+        self.assertEqual(stats["avg_eco_cost"], 60)
+        self.assertEqual([d.date for d in stats["recent_days"]], [day.date])
+        self.assertEqual([(p.source, p.routes) for p in stats["popular"]], [('Madurai', 3), ('Chennai', 1)])
+
+    def test_older_rows_keep_newest_last_searched(self):
+        now = timezone.now()
+        rollups.apply([self.row('Madurai', 40, now)])
+        rollups.apply([self.row('Madurai', 40, now - timedelta(days=400))])  # e.g. folded in from an archive
+        pair = RoutePairStats.objects.get()
+        self.assertEqual((pair.routes, pair.last_searched), (2, now))
+
+    def test_rebuild_matches_incremental(self):
+        rows = [self.row('Madurai', 40, None), self.row('Madurai', 60, None), self.row('Chennai', 30, None)]
+        views.RouteHistory.objects.bulk_create(rows)
+        rollups.apply(rows)
+        incremental = list(RoutePairStats.objects.order_by('source').values_list('source', 'routes'))
+
+        RoutePairStats.objects.update(routes=0)
+        call_command('rebuild_rollups', stdout=io.StringIO())
+        self.assertEqual(list(RoutePairStats.objects.order_by('source').values_list('source', 'routes')), incremental)
+        self.assertEqual(DailyRouteStats.objects.get().routes, 3)
+
+    def test_rebuild_folds_in_archives_with_pruned_places(self):
+        views.RouteHistory.objects.bulk_create([self.row('Melur', 40, None), self.row('Madurai', 60, None)])
+        views.RouteHistory.objects.filter(source_place__name='Melur').update(created_at=timezone.now() - timedelta(days=400))
+        with tempfile.TemporaryDirectory() as tmp, patch.object(archive, 'HISTORY_ARCHIVE_DIR', tmp):
+            self.assertEqual(archive.archive_history(directory=tmp), 1)
+            Place.objects.filter(name='Melur').delete()
+            call_command('rebuild_rollups', '--with-archives', stdout=io.StringIO())
+        self.assertEqual(sorted(RoutePairStats.objects.values_list('source', 'routes')), [('Madurai', 1), ('Melur', 1)])
+
+    def test_admin_dashboard_renders(self):
+        views.RouteHistory.objects.bulk_create([
+            views.RouteHistory(source='Madurai', destination='Tenkasi', green_cover=50, pollution_index=p, eco_cost=40)
+            for p in range(12)
+        ])
+        rollups.apply(list(views.RouteHistory.objects.all()))
+        request = RequestFactory().get('/dashboard/')
+        request.user = User.objects.create_user(username='admin', password='pw', is_staff=True)
+        with patch.object(views, 'render', wraps=views.render) as render:
+            resp = views.admin_dashboard(request)
+        self.assertEqual(resp.status_code, 200)
+        context = render.call_args.args[2]
+        self.assertEqual(context['pollution_trends'], list(range(2, 12)))  # the last 10 searches, oldest first
+        self.assertEqual(context['popular_routes'], [{"source": "Madurai", "destination": "Tenkasi", "count": 12}])
+        self.assertContains(resp, 'id="pollution-trends"')
+
+class PlaceTest(TestCase):
+    def test_resolve_dedupes_normalized_names(self):
+        places = Place.resolve(['Madurai', ' MADURAI', 'Tenkasi'])
+        self.assertEqual(places['Madurai'].pk, places[' MADURAI'].pk)
+        self.assertEqual(Place.objects.filter(key__in=['madurai', 'tenkasi']).count(), 2)
+
+    def test_recorder_attaches_places(self):
+        rows = [RouteHistory(source='Madurai', destination='Tenkasi', green_cover=50, pollution_index=10)
+                for _ in range(3)]
+        history.HistoryRecorder().write(rows)
+        self.assertEqual(RouteHistory.objects.filter(source_place__key='madurai',
+                                                     destination_place__key='tenkasi').count(), 3)
+
+class ArchiveTest(TestCase):
+    def test_archive_and_read_through(self):
+        old = timezone.now() - timedelta(days=400)
+        rows = views.RouteHistory.objects.bulk_create([
+            views.RouteHistory(source=f'S{i}', destination='D', distance=1, green_cover=50,
+                               pollution_index=10, eco_cost=60) for i in range(5)
+        ])
+        views.RouteHistory.objects.filter(pk__in=[r.pk for r in rows[:3]]).update(created_at=old)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            moved = archive.archive_history(directory=tmp, chunk=2)
+            self.assertEqual(moved, 3)
+            self.assertEqual(views.RouteHistory.objects.count(), 2)
+            self.assertEqual(len(archive.archived_months(tmp)), 1)
+
+            # the archive names its places itself
+            archived = list(archive.iter_archive(directory=tmp))
+            self.assertEqual(sorted(r['source'] for r in archived), ['S0', 'S1', 'S2'])
+            names = Place.names(r['source_place_id'] for r in archived)
+            self.assertEqual(sorted(names[r['source_place_id']] for r in archived), ['S0', 'S1', 'S2'])
+            everything = list(archive.iter_history(directory=tmp))
+            self.assertEqual(len(everything), 5)
+            recent = list(archive.iter_history(start=timezone.now() - timedelta(days=1), directory=tmp))
+            self.assertEqual(len(recent), 2)
+
+    def test_user_reads_skip_months_without_their_rows(self):
+        alice, bob = (User.objects.create_user(username=name, password='pw') for name in ('alice', 'bob'))
+        rows = views.RouteHistory.objects.bulk_create([
+            views.RouteHistory(user=user, source='S', destination='D', green_cover=50, pollution_index=10)
+            for user in (alice, bob, bob)
+        ])
+        for row, days in zip(rows, (400, 400, 460)):
+            views.RouteHistory.objects.filter(pk=row.pk).update(created_at=timezone.now() - timedelta(days=days))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertEqual(archive.archive_history(directory=tmp), 3)
+            months = archive.archived_months(tmp)
+            self.assertEqual(len(months), 2)
+            opened = []
+            real_open = archive.gzip.open
+            with patch.object(archive.gzip, 'open', side_effect=lambda path, *a, **k: opened.append(path) or real_open(path, *a, **k)):
+                self.assertEqual([r['id'] for r in archive.iter_history(directory=tmp, user=alice.pk)], [rows[0].pk])
+            self.assertEqual(opened, [archive._month_path(tmp, months[1])])
+            self.assertEqual(len(list(archive.iter_history(directory=tmp, user=bob.pk))), 2)
+
+    def test_interrupted_run_is_read_once(self):
+        old = timezone.now() - timedelta(days=400)
+        views.RouteHistory.objects.bulk_create([
+            views.RouteHistory(source=f'S{i}', destination='D', green_cover=50, pollution_index=10) for i in range(3)
+        ])
+        views.RouteHistory.objects.update(created_at=old)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # the chunk reaches the archive, then the delete never happens
+            with patch.object(archive.transaction, 'atomic', side_effect=RuntimeError('killed')):
+                with self.assertRaises(RuntimeError):
+                    archive.archive_history(directory=tmp, chunk=2)
+            self.assertEqual(views.RouteHistory.objects.count(), 3)
+            everything = list(archive.iter_history(directory=tmp))
+            names = Place.names(r['source_place_id'] for r in everything)
+            self.assertEqual(sorted(names[r['source_place_id']] for r in everything), ['S0', 'S1', 'S2'])
+
+            # a rerun archives the rest; the chunk written twice is still read once
+            self.assertEqual(archive.archive_history(directory=tmp, chunk=2), 3)
+            self.assertEqual(len(list(archive.iter_history(directory=tmp))), 3)
+
+class GeometryTest(TestCase):
+    def test_polyline_round_trip(self):
+        # the example from Google's format documentation
+        coords = [[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]]
+        self.assertEqual(geometry.encode_polyline(coords), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(geometry.decode_polyline('_p~iF~ps|U_ulLnnqC_mqNvxq`@'), coords)
+
+    def test_simplify_keeps_shape_and_boundaries(self):
+        lons = np.linspace(78.0, 78.5, 5001)
+        points = np.column_stack([9.9 + 0.001 * np.sin(lons * 40), lons])
+        coarse = geometry.simplify(points, 0.01)
+        self.assertEqual(coarse.tolist(), [0, 5000])
+        index = geometry.simplify(points, 1e-5, keep=[1234])
+        self.assertIn(1234, index.tolist())
+        self.assertLess(len(index), 500)
+
+        # every dropped vertex stays within tolerance of the simplified line
+        kept = points[index]
+        lats = np.interp(points[:, 1], kept[:, 1], kept[:, 0])
+        self.assertLess(np.abs(lats - points[:, 0]).max(), 2e-5)
+
+    def test_route_line_remaps_segments(self):
+        coords = np.column_stack([np.full(2001, 9.9), np.linspace(78.0, 78.2, 2001)]).tolist()
+        result = {
+            "green_cover": 50.0,
+            "route": {"coords": coords},
+            "profile": {"segments": [
+                {"start": 0, "end": 1000, "green_cover": 80.0},
+                {"start": 1000, "end": 2000, "green_cover": 30.0},
+            ]},
+        }
+        line = views._route_line(result, zoom=12, polyline=True)
+        decoded = geometry.decode_polyline(line["polyline"])
+        self.assertEqual(len(decoded), 3)
+        self.assertEqual([(s["start"], s["end"]) for s in line["segments"]], [(0, 1), (1, 2)])
+        self.assertEqual(decoded[1], [9.9, 78.1])
+        self.assertEqual([s["color"] for s in line["segments"]], ["green", "red"])
+
+class ProviderRegistryTest(TestCase):
+    def test_priority_order_and_fallthrough(self):
+        with patch.object(views, 'ORS_API_KEY', 'key'), \
+             patch.object(views, 'ors_geocode', return_value=None) as ors, \
+             patch.object(views, 'nominatim_geocode', return_value=(9.9, 78.1)) as nominatim:
+            self.assertEqual([b.name for b in providers.backends('geocoder')], ['ors', 'nominatim'])
+            self.assertEqual(views.geocode_place('Madurai'), (9.9, 78.1))
+        ors.assert_called_once_with('Madurai')
+        nominatim.assert_called_once_with('Madurai')
+
+        with patch.object(providers, 'PROVIDER_BACKENDS', {'geocoder': {'synthetic': 5, 'nominatim': 1}}):
+            self.assertEqual([b.name for b in providers.backends('geocoder')], ['nominatim', 'synthetic'])
+
+    def test_record_then_replay(self):
+        live = {"distance_km": 12.5, "coords": [[9.9, 78.1], [9.95, 78.15]]}
+        with tempfile.TemporaryDirectory() as tmp:
+            with patch.object(providers, '_store', providers.ReplayStore(tmp)), \
+                 patch.object(providers, 'PROVIDER_RECORD', True), \
+                 patch.object(views, 'ORS_API_KEY', ''), \
+                 patch.object(views, 'osrm_route', return_value=live):
+                self.assertEqual(views.fetch_route((9.9, 78.1), (9.95, 78.15)), live)
+
+            # a fresh store reads the recording back from disk, with no network backend configured
+            with patch.object(providers, '_store', providers.ReplayStore(tmp)), \
+                 patch.object(providers, 'PROVIDER_BACKENDS', {'router': {'replay': 0}}):
+                self.assertEqual(views.fetch_route((9.9000001, 78.1), (9.95, 78.15)), live)
+                self.assertIsNone(views.fetch_route((9.9, 78.1), (10.0, 78.0)))
+
+    def test_offline_pipeline_with_injected_latency(self):
+        offline = {kind: {'synthetic': 0} for kind in providers.KINDS}
+        with patch.object(providers, 'PROVIDER_BACKENDS', offline), \
+             patch.object(providers, 'PROVIDER_LATENCY', {'synthetic': (0.01, 0.0)}), \
+             patch.object(raster, 'get_raster', return_value=None):
+            started = time.monotonic()
+            result, error = views.plan_route('Chennai', 'Madurai')
+            elapsed = time.monotonic() - started
+        self.assertIsNone(error)
+        self.assertEqual(result['source'], providers.synthetic_geocode('chennai'))
+        self.assertGreater(result['route']['distance_km'], 0)
+        self.assertTrue(result['profile']['segments'])
+        self.assertGreaterEqual(elapsed, 0.02)
+
+class AlternativeRoutesTest(TestCase):
+    def test_k_shortest_paths_match_brute_force(self):
+        edges = [(0, 1, 1), (0, 2, 2), (1, 2, 1), (1, 3, 3), (2, 3, 1), (2, 4, 4), (3, 4, 1), (1, 4, 6)]
+        src, dst, dist = zip(*edges)
+        g = dijkstra.Graph.from_edges(5, src, dst, dist)
+        weights = {(u, v): w for u, v, w in edges}  # green cover defaults to 100, so weight == distance
+
+        def walk(path):
+            if path[-1] == 4:
+                yield path
+            for (u, v) in weights:
+                if u == path[-1] and v not in path:
+                    yield from walk(path + [v])
+        expected = sorted(sum(weights[e] for e in zip(p, p[1:])) for p in walk([0]))
+
+        paths = dijkstra.k_shortest_paths(g, 0, 4, 4)
+        self.assertTrue(all(p[0] == 0 and p[-1] == 4 for _, p in paths))
+        self.assertEqual(len({tuple(p) for _, p in paths}), 4)
+        np.testing.assert_allclose([c for c, _ in paths], expected[:4])
+        self.assertEqual(dijkstra.k_shortest_paths(g, 4, 0, 3), [])
+
+    def test_pareto_front(self):
+        distances = np.array([10.0, 12.0, 11.0, 15.0, 10.0])
+        costs = np.array([60.0, 40.0, 55.0, 45.0, 70.0])
+        self.assertEqual(views.pareto_front(distances, costs), [0, 2, 1])
+
+    def test_eco_metrics_many_matches_scalar(self):
+        distances, greens, pollutions = [5.0, 120.0, 900.0], [80.0, 35.5, 10.0], [None, 42.0, None]
+        many = views.eco_metrics_many(distances, greens, pollutions)
+        for i, (d, g, p) in enumerate(zip(distances, greens, pollutions)):
+            self.assertEqual(tuple(float(col[i]) for col in many), views.eco_metrics(d, g, p))
+        # a measured reading replaces the distance proxy
+        self.assertEqual(views.eco_metrics(120.0, 35.5, 42.0)[0], 42.0)
+        self.assertEqual(views.eco_metrics(120.0, 35.5)[0], 24.0)
+
+    def test_offline_plan_with_alternatives(self):
+        offline = {kind: {'synthetic': 0} for kind in providers.KINDS}
+        with patch.object(providers, 'PROVIDER_BACKENDS', offline), \
+             patch.object(raster, 'get_raster', return_value=None):
+            result, error = views.plan_route('Chennai', 'Madurai', alternatives=3)
+            self.client.force_login(User.objects.create_user(username='alt', password='pw'))
+            resp = self.client.get(reverse('route_api'), {'source': 'Chennai', 'destination': 'Madurai',
+                                                          'alternatives': 3})
+        self.assertIsNone(error)
+        front = result['alternatives']
+        self.assertTrue(front)
+        self.assertEqual(result['eco_cost'], min(alt['eco_cost'] for alt in front))
+        distances = [alt['route']['distance_km'] for alt in front]
+        self.assertEqual(distances, sorted(distances))
+        self.assertTrue(all(a['eco_cost'] > b['eco_cost'] for a, b in zip(front, front[1:])))
+
+        data = resp.json()
+        self.assertEqual(len(data['alternatives']), len(front))
+        self.assertEqual(sum(alt['selected'] for alt in data['alternatives']), 1)
+
+class SpatialIndexTest(TestCase):
+    def setUp(self):
+        spatial.clear()
+        geocache.clear()
+
+    def tearDown(self):
+        spatial.clear()
+
+    def test_nearest_matches_brute_force(self):
+        rng = np.random.default_rng(3)
+        lats, lons = rng.uniform(9.0, 10.0, 2000), rng.uniform(78.0, 79.0, 2000)
+        index = spatial.GridIndex(lats, lons)
+        for lat, lon in rng.uniform([8.5, 77.5], [10.5, 79.5], (200, 2)):
+            km = scoring.haversine_km(lat, lon, lats, lons)
+            i, d = index.nearest(lat, lon)
+            self.assertAlmostEqual(d, km.min(), places=9)
+            hit = index.nearest(lat, lon, max_km=0.5)
+            self.assertEqual(hit is None, km.min() > 0.5)
+        self.assertIsNone(spatial.GridIndex().nearest(9.5, 78.5))
+
+    def test_parse_latlon(self):
+        self.assertEqual(spatial.parse_latlon(" 9.92520, 78.11980 "), (9.9252, 78.1198))
+        self.assertEqual(spatial.parse_latlon("-33.9,-70.6"), (-33.9, -70.6))
+        self.assertIsNone(spatial.parse_latlon("Madurai"))
+        self.assertIsNone(spatial.parse_latlon("95.0,78.0"))
+
+    def test_map_click_snaps_to_known_place(self):
+        geocache.put('nominatim', 'Madurai', (9.9252, 78.1198))
+        with patch.object(providers, 'first') as first:
+            self.assertEqual(views.geocode_place('9.9260,78.1190'), (9.9252, 78.1198))
+        first.assert_not_called()
+
+        # places geocoded after the index loaded are found too; far clicks are used as given
+        geocache.put('nominatim', 'Tenkasi', (8.9594, 77.3152))
+        self.assertEqual(spatial.snap(8.9590, 77.3150), (8.9594, 77.3152))
+        with patch.object(providers, 'first') as first:
+            self.assertEqual(views.geocode_place('11.0,77.0'), (11.0, 77.0))
+        first.assert_not_called()
+
+    def test_rows_archived_with_names_are_read_without_creating_places(self):
+        madurai, = Place.resolve(['Madurai']).values()
+        with tempfile.TemporaryDirectory() as tmp:
+            month = timezone.now().replace(day=1).date()
+            with gzip.open(archive._month_path(tmp, month), "wt", encoding="utf-8") as f:
+                f.write(json.dumps({"id": 1, "source": "madurai ", "destination": "Tenkasi",
+                                    "created_at": timezone.now().isoformat()}) + "\n")
+            row, = archive.iter_archive(directory=tmp)
+        self.assertEqual((row['source_place_id'], row['source']), (madurai.pk, 'Madurai'))
+        self.assertEqual((row['destination_place_id'], row['destination']), (None, 'Tenkasi'))
+        self.assertEqual(Place.objects.count(), 1)
+
+class CacheWarmupTest(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        rows = views.RouteHistory.objects.bulk_create(
+            [views.RouteHistory(source='Chennai', destination='Madurai', green_cover=50, pollution_index=10) for _ in range(3)]
+            + [views.RouteHistory(source='chennai ', destination='Salem', green_cover=50, pollution_index=10) for _ in range(2)]
+            + [views.RouteHistory(source='Erode', destination='Salem', green_cover=50, pollution_index=10) for _ in range(6)]
+        )
+        # the Erode trips are a month old, so two fresh Salem trips beat six stale ones
+        views.RouteHistory.objects.filter(pk__in=[r.pk for r in rows[5:]]).update(created_at=now - timedelta(days=28))
+
+    def test_hot_set_is_recency_weighted(self):
+        pairs, places = warmup.hot_set(top_n=2, half_life_days=7)
+        self.assertEqual([(s, d) for s, d, _ in pairs], [('Chennai', 'Madurai'), ('Chennai', 'Salem')])
+        self.assertAlmostEqual(pairs[0][2], 3.0, places=3)
+        self.assertEqual([p for p, _ in places][:2], ['Chennai', 'Madurai'])
+        self.assertEqual(warmup.hot_set(top_n=5, window_days=7)[0][-1][:2], ('Chennai', 'Salem'))
+
+    def test_warm_reports_coverage(self):
+        offline = {kind: {'synthetic': 0} for kind in providers.KINDS}
+        with patch.object(providers, 'PROVIDER_BACKENDS', offline), \
+             patch.object(raster, 'get_raster', return_value=None), \
+             patch.object(views, 'plan_route', wraps=views.plan_route) as plan:
+            report = warmup.warm(top_n=2, budget=30, workers=2)
+            self.assertEqual(plan.call_count, 2)
+            self.assertEqual(report['pairs'], {'total': 2, 'warmed': 2, 'demand': 1.0})
+            self.assertEqual(report['places']['warmed'], 4)
+            self.assertFalse(report['out_of_time'])
+
+            # the command warms only the shared tiers, never the per-process route pipeline
+            plan.reset_mock()
+            with patch.object(views, 'get_green_cover', wraps=views.get_green_cover) as green:
+                out = io.StringIO()
+                call_command('warm_caches', '--top', '1', '--budget', '30', stdout=out)
+            plan.assert_not_called()
+            self.assertEqual(green.call_count, 2)
+            self.assertIn('places (geocode + green cover): warmed 2/2 (100.0% of recent demand)', out.getvalue())
+            self.assertNotIn('pairs', out.getvalue())
+
+            out = io.StringIO()
+            call_command('warm_caches', '--top', '1', '--budget', '0', stdout=out)
+        self.assertIn('warmed 0/2 (0.0% of recent demand)', out.getvalue())
+        self.assertIn('time budget ran out', out.getvalue())
+
+    def test_run_waits_for_started_jobs(self):
+        finished = []
+
+        def slow(i):
+            time.sleep(0.2)
+            finished.append(i)
+            return True
+
+        warmed = warmup._run([(slow, (i,)) for i in range(4)], time.monotonic() + 0.05, workers=2)
+        # the two started jobs ran to the end and are counted; the other two never started
+        self.assertEqual(sorted(finished), [0, 1])
+        self.assertEqual(warmed, [True, True, False, False])
+
+    def test_warmer_starts_only_on_a_request(self):
+        # earlier tests' requests have already used up the one-shot receiver
+        request_started.connect(warmup.start_on_first_request, dispatch_uid='greenroute-warmup')
+        with patch.object(warmup.warmer, 'start') as start:
+            call_command('warm_caches', '--dry-run', stdout=io.StringIO())
+            start.assert_not_called()
+            self.client.get(reverse('login'))
+            self.client.get(reverse('login'))
+        start.assert_called_once()
+
+class RouteTileTest(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = patch.object(tiles, 'TILE_CACHE_DIR', tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _record(self, src, dst, coords, eco_cost):
+        result = {"route": {"distance_km": 10.0, "coords": coords}, "pollution_index": 2.0,
+                  "green_cover": 60.0, "eco_cost": eco_cost}
+        history.recorder.write([views._history_row(None, src, dst, result)])
+
+    def _alpha(self, png):
+        # IDAT payload of the writer's single-chunk PNG: one filter byte + RGBA per row
+        length = int.from_bytes(png[33:37], 'big')
+        raw = np.frombuffer(zlib.decompress(png[41:41 + length]), dtype=np.uint8).reshape(256, 1 + 256 * 4)
+        return raw[:, 1:].reshape(256, 256, 4)[..., 3]
+
+    def test_tile_math(self):
+        south, west, north, east = tiles.tile_bounds(10, 733, 479)
+        self.assertEqual(tiles.tile_range(10, south + 1e-6, west + 1e-6, north - 1e-6, east - 1e-6), (733, 733, 479, 479))
+        x, y = tiles.project([north], [west], 10)
+        self.assertAlmostEqual(x[0], 733 * 256, places=6)
+        self.assertAlmostEqual(y[0], 479 * 256, places=6)
+
+    def test_geometry_stored_once_per_pair_and_rendered(self):
+        line = [[9.90 + i * 0.002, 78.10 + i * 0.002] for i in range(50)]
+        self._record('Madurai', 'Melur', line, 30.0)
+        self._record('madurai', 'Melur ', line, 30.0)
+        geometry_row = RouteGeometry.objects.get()
+        self.assertEqual(geometry_row.routes, 2)
+        self.assertEqual(geometry_row.distance_km, 10.0)
+        self.assertLess(len(geometry.decode_polyline(geometry_row.polyline)), len(line))
+
+        x0, x1, y0, y1 = tiles.tile_range(12, 9.95, 78.15, 9.95, 78.15)
+        png = tiles.get_tile(12, x0, y0)
+        self.assertTrue(png.startswith(b"\x89PNG"))
+        self.assertTrue(self._alpha(png).any())
+        self.assertTrue(os.path.exists(tiles._path(12, x0, y0)))
+        self.assertFalse(self._alpha(tiles.get_tile(12, 0, 0)).any())
+
+        # a new search through the tile leaves the cached copy in place but marks it stale,
+        # once the refresh interval has passed; the far-away tile stays clean
+        self._record('Melur', 'Madurai', line[::-1], 80.0)
+        self.assertTrue(os.path.exists(tiles._path(12, x0, y0)))
+        self.assertFalse(tiles.is_stale(12, x0, y0))
+        with patch.object(tiles, 'TILE_REFRESH_INTERVAL', 0), patch.object(tiles, 'refresh') as refresh:
+            self.assertEqual(tiles.get_tile(12, x0, y0), png)  # served stale while it is redrawn
+            refresh.assert_called_once_with(12, x0, y0)
+            self.assertFalse(tiles.is_stale(12, 0, 0))
+
+    def test_queued_rows_carry_the_encoded_line(self):
+        line = [[9.90 + i * 0.002, 78.10 + i * 0.002] for i in range(50)]
+        result = {"route": {"distance_km": 10.0, "coords": line}, "pollution_index": 2.0,
+                  "green_cover": 60.0, "eco_cost": 30.0}
+        row = views._history_row(None, 'Madurai', 'Melur', result)
+        self.assertFalse(hasattr(row, 'route_geometry'))
+        self.assertIsInstance(row.route_line['polyline'], str)
+        self.assertEqual(row.route_line['min_lat'], 9.90)
+        self.assertIsNone(tiles.route_line([[9.9, 78.1]]))
+
+    def test_concurrent_misses_render_once(self):
+        gate = threading.Event()
+        real_save = tiles._save
+
+        def slow_save(z, x, y):
+            gate.wait(5)
+            return real_save(z, x, y)
+
+        leaders = metrics.singleflight_calls.value('tile', 'leader')
+        with patch.object(tiles, '_save', side_effect=slow_save) as save, \
+                ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(tiles.get_tile, 12, 0, 0) for _ in range(4)]
+            while metrics.singleflight_calls.value('tile', 'leader') == leaders:
+                time.sleep(0.01)
+            time.sleep(0.1)  # let the other misses join the render
+            gate.set()
+            pngs = {f.result() for f in futures}
+        self.assertEqual(save.call_count, 1)
+        self.assertEqual(len(pngs), 1)
+
+    def test_tile_view_is_staff_only(self):
+        user = User.objects.create_user(username='viewer', password='pw')
+        self.client.force_login(user)
+        url = reverse('route_tiles', args=[5, 22, 14])
+        self.assertEqual(self.client.get(url).status_code, 403)
+        user.is_staff = True
+        user.save()
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'image/png')
+        self.assertEqual(self.client.get(reverse('route_tiles', args=[5, 40, 14])).status_code, 404)
+
+class HistoryExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='walker', password='pw')
+        other = User.objects.create_user(username='other', password='pw')
+        rows = views.RouteHistory.objects.bulk_create(
+            [views.RouteHistory(user=self.user, source=f'S{i}', destination='Madurai', green_cover=50,
+                                pollution_index=10, eco_cost=i) for i in range(7)]
+            + [views.RouteHistory(user=other, source='Elsewhere', destination='Madurai', green_cover=50, pollution_index=10)]
+        )
+        # two rows share a timestamp so the pk tie-break matters
+        base = timezone.now() - timedelta(days=10)
+        for i, row in enumerate(rows[:7]):
+            views.RouteHistory.objects.filter(pk=row.pk).update(created_at=base + timedelta(days=min(i, 5)))
+        self.client.force_login(self.user)
+
+    def test_keyset_pages_cover_history_once(self):
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 3, **({'cursor': cursor} if cursor else {})}
+            data = self.client.get(reverse('history_api'), params).json()
+            self.assertLessEqual(len(data['results']), 3)
+            seen.extend(row['source'] for row in data['results'])
+            cursor = data['next']
+            if not cursor:
+                break
+        self.assertEqual(seen, ['S6', 'S5', 'S4', 'S3', 'S2', 'S1', 'S0'])
+        self.assertNotIn('user_id', data['results'][0])
+
+        self.assertEqual(self.client.get(reverse('history_api'), {'cursor': 'nonsense'}).status_code, 400)
+        since = timezone.localdate(timezone.now() - timedelta(days=5)).isoformat()
+        data = self.client.get(reverse('history_api'), {'since': since}).json()
+        self.assertEqual([row['source'] for row in data['results']], ['S6', 'S5'])
+
+    def test_export_can_include_archived_rows(self):
+        with tempfile.TemporaryDirectory() as tmp, patch.object(archive, 'HISTORY_ARCHIVE_DIR', tmp):
+            cutoff = timezone.now() - timedelta(days=7)
+            self.assertEqual(archive.archive_history(before=cutoff, directory=tmp), 4)
+            Place.objects.filter(name='S0').delete()  # pruned once nothing live points at it
+            resp = self.client.get(reverse('history_export'), {'format': 'ndjson'})
+            self.assertEqual(len(b''.join(resp.streaming_content).splitlines()), 3)
+
+            resp = self.client.get(reverse('history_export'), {'format': 'ndjson', 'include_archived': '1'})
+            rows = [json.loads(line) for line in b''.join(resp.streaming_content).splitlines()]
+            self.assertEqual([r['source'] for r in rows], [f'S{i}' for i in range(7)])  # not 'Elsewhere'
+            self.assertEqual(list(rows[0]), exports.columns(views.RouteHistory))
+
+            resp = self.client.get(reverse('history_export'), {'include_archived': '1', 'until': cutoff.isoformat()})
+            self.assertEqual(len(b''.join(resp.streaming_content).decode().splitlines()), 5)  # header + 4
+
+    def test_streaming_exports(self):
+        resp = self.client.get(reverse('history_export'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(resp.streaming)
+        self.assertFalse(resp.has_header('Content-Encoding'))
+        self.assertIn('attachment', resp['Content-Disposition'])
+        lines = b''.join(resp.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(','), exports.columns(views.RouteHistory))
+        self.assertEqual(len(lines), 8)
+
+        # chunks smaller than the table still yield every row once, oldest first
+        rows = list(exports.iter_rows(views.RouteHistory.objects.filter(user=self.user), chunk=2))
+        self.assertEqual([r['source'] for r in rows], [f'S{i}' for i in range(7)])
+
+        resp = self.client.get(reverse('history_export'), {'format': 'ndjson', 'user': 'all'})
+        rows = [json.loads(line) for line in b''.join(resp.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 7)  # not staff, so still only their own
+        self.assertEqual(self.client.get(reverse('history_export'), {'format': 'xml'}).status_code, 400)
+
+        self.user.is_staff = True
+        self.user.save()
+        resp = self.client.get(reverse('history_export'), {'format': 'ndjson', 'user': 'all'})
+        self.assertEqual(len(b''.join(resp.streaming_content).splitlines()), 8)
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.user = User.objects.create_user('metrics', password='pw', is_staff=True)
+        self.client.force_login(self.user)
+
+    def test_histogram_exposition(self):
+        h = metrics.Histogram('t_seconds', 'Test.', ('stage',), buckets=(0.1, 1.0))
+        h.observe(0.05, 'a')
+        h.observe(0.5, 'a')
+        h.observe(5.0, 'a')
+        text = '\n'.join(h.render())
+        self.assertIn('t_seconds_bucket{stage="a",le="0.1"} 1', text)
+        self.assertIn('t_seconds_bucket{stage="a",le="1.0"} 2', text)
+        self.assertIn('t_seconds_bucket{stage="a",le="+Inf"} 3', text)
+        self.assertIn('t_seconds_count{stage="a"} 3', text)
+
+    def test_fallback_counted_and_exposed(self):
+        with patch.object(views, 'ORS_API_KEY', 'key'), \
+             patch.object(views, 'ors_geocode', return_value=None), \
+             patch.object(views, 'nominatim_geocode', return_value=(9.9, 78.1)):
+            views.geocode_place('Madurai')
+        self.assertEqual(metrics.fallbacks.value('geocoder', 'ors', 'nominatim'), 1)
+        self.assertEqual(metrics.backend_calls.value('geocoder', 'ors', 'empty'), 1)
+
+        resp = self.client.get('/metrics/')
+        self.assertEqual(resp.status_code, 200)
+        body = resp.content.decode()
+        self.assertIn('greenroute_fallbacks_total{kind="geocoder",skipped="ors",used="nominatim"} 1', body)
+        self.assertIn('greenroute_route_cache_entries', body)
+        self.assertIn('greenroute_history_queue_depth', body)
+
+    def test_provider_latency_recorded(self):
+        client = clients.ProviderClient('metrics-test')
+        with patch.object(client.session, 'request', return_value=Mock(status_code=403)):
+            client.get('https://example.invalid/')
+        self.assertEqual(metrics.provider_seconds.count('metrics-test', '403'), 1)
+        self.assertEqual(metrics.provider_errors.value('metrics-test', 'http_403'), 1)
+
+    def test_server_timing_header(self):
+        offline = {kind: {'synthetic': 0} for kind in providers.KINDS}
+        with patch.object(providers, 'PROVIDER_BACKENDS', offline), \
+             patch.object(metrics, 'METRICS_SERVER_TIMING', True), \
+             patch.object(raster, 'get_raster', return_value=None), \
+             patch.object(history, 'record'):
+            resp = self.client.get('/api/route/', {'source': 'Chennai', 'destination': 'Madurai'})
+        self.assertEqual(resp.status_code, 200)
+        stages = [part.split(';')[0] for part in resp['Server-Timing'].split(', ')]
+        self.assertEqual(stages, ['geocode', 'route', 'green_cover', 'score', 'history', 'total'])
+        self.assertEqual(metrics.requests_total.value('route', 'ok'), 1)
+
+    def test_metrics_token(self):
+        with patch.object(metrics, 'METRICS_TOKEN', 's3cret'):
+            self.assertEqual(self.client.get('/metrics/').status_code, 401)
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer s3cre').status_code, 401)
+            resp = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer s3cret')
+            self.assertEqual(resp.status_code, 200)
+
+    def test_metrics_without_token_is_staff_only(self):
+        with patch.object(metrics, 'METRICS_TOKEN', ''):
+            self.assertEqual(self.client.get('/metrics/').status_code, 200)
+            self.client.force_login(User.objects.create_user('plain', password='pw'))
+            self.assertEqual(self.client.get('/metrics/').status_code, 403)
+            self.client.logout()
+            self.assertEqual(self.client.get('/metrics/').status_code, 403)
+
+class SingleFlightTest(TestCase):
+    def test_concurrent_identical_calls_share_one_run(self):
+        started = threading.Event()
+        release = threading.Event()
+        runs = []
+
+        def slow(x):
+            runs.append(x)
+            started.set()
+            release.wait(2)
+            return x * 2
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            leader = pool.submit(singleflight.do, ('test', 1), slow, 21)
+            started.wait(2)
+            followers = [pool.submit(singleflight.do, ('test', 1), slow, 21) for _ in range(7)]
+            while metrics.singleflight_calls.value('test', 'leader') < 1:
+                time.sleep(0.01)
+            time.sleep(0.05)
+            release.set()
+            results = [leader.result()] + [f.result() for f in followers]
+        self.assertEqual(results, [42] * 8)
+        self.assertEqual(runs, [21])
+        self.assertEqual(singleflight.inflight(), 0)
+
+    def test_follower_gets_leader_exception(self):
+        release = threading.Event()
+
+        def boom():
+            release.wait(2)
+            raise ValueError('upstream down')
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            first = pool.submit(singleflight.do, ('boom',), boom)
+            while singleflight.inflight() == 0:
+                time.sleep(0.01)
+            second = pool.submit(singleflight.do, ('boom',), boom)
+            time.sleep(0.05)
+            release.set()
+            for future in (first, second):
+                with self.assertRaises(ValueError):
+                    future.result()
+
+    def test_interactive_caller_does_not_follow_background_leader(self):
+        release = threading.Event()
+        runs = []
+
+        def lookup(who):
+            runs.append(who)
+            release.wait(2)
+            return who
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            warm = pool.submit(scheduler.with_priority, 'background', singleflight.do, ('prio',), lookup, 'warm')
+            while singleflight.inflight() == 0:
+                time.sleep(0.01)
+            live = pool.submit(singleflight.do, ('prio',), lookup, 'live')
+            while len(runs) < 2:
+                time.sleep(0.01)
+            # a second background caller follows the interactive leader now holding the key
+            late = pool.submit(scheduler.with_priority, 'background', singleflight.do, ('prio',), lookup, 'late')
+            time.sleep(0.05)
+            release.set()
+            self.assertEqual((warm.result(), live.result(), late.result()), ('warm', 'live', 'live'))
+        self.assertEqual(runs, ['warm', 'live'])
+        self.assertEqual(singleflight.inflight(), 0)
+
+    def test_locked_fill_waits_for_lock_holder(self):
+        store = {}
+        cache = singleflight.caches[singleflight.SINGLEFLIGHT_CACHE]
+        key = singleflight._lock_key('geocode:ors:madurai')
+        self.assertTrue(cache.add(key, 1, 30))  # another process holds the fill lock
+
+        def holder():
+            time.sleep(0.1)
+            store['madurai'] = (9.9, 78.1)
+            cache.delete(key)
+
+        compute = Mock(return_value=(0.0, 0.0))
+        threading.Thread(target=holder).start()
+        value = singleflight.locked_fill('geocode:ors:madurai', lambda: ('madurai' in store, store.get('madurai')), compute)
+        self.assertEqual(value, (9.9, 78.1))
+        compute.assert_not_called()
+
+    def test_plan_route_coalesced(self):
+        metrics.reset()
+        offline = {kind: {'synthetic': 0} for kind in providers.KINDS}
+        with patch.object(providers, 'PROVIDER_BACKENDS', offline), \
+             patch.object(providers, 'PROVIDER_LATENCY', {'synthetic': (0.05, 0.0)}), \
+             patch.object(raster, 'get_raster', return_value=None):
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                results = list(pool.map(lambda _: views.plan_route('Chennai', 'Madurai'), range(4)))
+        self.assertTrue(all(error is None for _, error in results))
+        self.assertEqual(len({id(result) for result, _ in results}), 1)
+        self.assertEqual(metrics.singleflight_calls.value('plan', 'leader'), 1)
+        self.assertEqual(metrics.singleflight_calls.value('plan', 'follower'), 3)
+
+class SchedulerTest(TestCase):
+    def test_bucket_paces_requests(self):
+        limiter = scheduler.ProviderScheduler('t', rate=20.0, burst=2)
+        started = time.monotonic()
+        for _ in range(4):
+            limiter.acquire('interactive', timeout=1)
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+        slow = scheduler.ProviderScheduler('t', rate=0.01, burst=1)
+        slow.acquire('interactive')
+        with self.assertRaises(scheduler.RateLimitedError):
+            slow.acquire('interactive', timeout=0.05)
+
+    def test_deadline_caps_the_wait(self):
+        slow = scheduler.ProviderScheduler('t', rate=0.01, burst=1)
+        slow.acquire('background')
+        started = time.monotonic()
+        with scheduler.deadline(started + 0.05), self.assertRaises(scheduler.RateLimitedError):
+            slow.acquire('background')  # would otherwise queue for SCHEDULER_MAX_WAIT['background']
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_interactive_jumps_the_queue(self):
+        limiter = scheduler.ProviderScheduler('t', rate=10.0, burst=1)
+        limiter.acquire('interactive')
+        order = []
+
+        def take(prio):
+            limiter.acquire(prio, timeout=2)
+            order.append(prio)
+
+        background = threading.Thread(target=take, args=('background',))
+        background.start()
+        time.sleep(0.02)
+        interactive = threading.Thread(target=take, args=('interactive',))
+        interactive.start()
+        background.join()
+        interactive.join()
+        self.assertEqual(order, ['interactive', 'background'])
+
+    def test_keys_rotate_and_forbidden_key_is_benched(self):
+        with patch.dict(scheduler.PROVIDER_RATE_LIMITS, {'keyed': {'rate': 0.01, 'burst': 1}}):
+            scheduler.set_keys('keyed', ['k1', 'k2'])
+            client = clients.ProviderClient('keyed')
+            ok = Mock(status_code=200, headers={'x-ratelimit-remaining': '7'})
+            with patch.object(client.session, 'request', side_effect=[Mock(status_code=403, headers={}), ok]) as request:
+                client.get('https://example.invalid/', key_header='Authorization')
+                client.get('https://example.invalid/', key_header='Authorization')
+            used = [c.kwargs['headers']['Authorization'] for c in request.call_args_list]
+            self.assertEqual(sorted(used), ['k1', 'k2'])
+            self.assertTrue(client.available())  # the other key still works, circuit stays closed
+            quota = [slot['quota_left'] for slot in scheduler.get_scheduler('keyed').snapshot()]
+            self.assertIn(7, quota)
+            scheduler.set_keys('keyed', [])
+
+    def test_endpoints_have_their_own_quota(self):
+        limits = {('metered', 'directions'): {'rate': 0.01, 'burst': 1, 'daily': 1},
+                  'metered': {'rate': 0.01, 'burst': 5}}
+        with patch.dict(scheduler.PROVIDER_RATE_LIMITS, limits), \
+             patch.dict(scheduler.SCHEDULER_MAX_WAIT, {'interactive': 0.05}):
+            scheduler.reset()
+            client = clients.ProviderClient('metered')
+            with patch.object(client.session, 'request', return_value=Mock(status_code=200, headers={})):
+                client.post('https://example.invalid/directions', endpoint='directions')
+                with self.assertRaises(scheduler.RateLimitedError):
+                    client.post('https://example.invalid/directions', endpoint='directions')
+                # a spent directions quota leaves the matrix bucket untouched
+                client.post('https://example.invalid/matrix', endpoint='matrix')
+            self.assertEqual(scheduler.get_scheduler('metered', 'directions').snapshot()[0]['quota_left'], 0)
+            self.assertEqual(scheduler.get_scheduler('metered', 'matrix').snapshot()[0]['used_today'], 1)
+            scheduler.reset()
+
+    def test_batch_pipeline_runs_at_batch_priority(self):
+        seen = []
+        with patch.object(views, 'geocode_place',
+                          side_effect=lambda p: seen.append((scheduler.current_priority(), threading.current_thread().name))), \
+             patch.object(history, 'record'):
+            list(views.plan_batch([('A', 'B')]))
+        self.assertEqual([prio for prio, _ in seen], ['batch', 'batch'])
+        # on the bulk pool, so waiting for tokens never ties up the interactive workers
+        self.assertTrue(all(thread.startswith('greenroute-bulk') for _, thread in seen))
+
+    def test_status_retries_take_a_token_each(self):
+        with patch.dict(scheduler.PROVIDER_RATE_LIMITS, {'retried': {'rate': 0.01, 'burst': 2}}), \
+             patch.dict(scheduler.SCHEDULER_MAX_WAIT, {'interactive': 0.05}), \
+             patch.object(clients, 'HTTP_BACKOFF', 0), patch.object(clients, 'HTTP_BACKOFF_JITTER', 0):
+            scheduler.reset()
+            client = clients.ProviderClient('retried')
+            busy = Mock(status_code=503, headers={})
+            with patch.object(client.session, 'request', return_value=busy) as request:
+                self.assertEqual(client.get('https://example.invalid/').status_code, 503)
+            # two tokens, so the third attempt gives up with the last answer instead of waiting
+            self.assertEqual(request.call_count, 2)
+
+            client.breaker.record_failure(open_for=60)
+            with patch.object(scheduler.get_scheduler('retried'), 'acquire') as acquire:
+                with self.assertRaises(clients.CircuitOpenError):
+                    client.get('https://example.invalid/')
+            acquire.assert_not_called()  # an open circuit spends no token or quota
+            scheduler.reset()
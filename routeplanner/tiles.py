@@ -0,0 +1,297 @@
+import logging
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+
+from . import geometry, metrics, singleflight
+from .models import RouteGeometry
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+TILE_CACHE_DIR = getattr(settings, "TILE_CACHE_DIR", os.path.join(getattr(settings, "BASE_DIR", ""), "tile_cache"))
+TILE_MIN_ZOOM = getattr(settings, "TILE_MIN_ZOOM", 3)
+TILE_MAX_ZOOM = getattr(settings, "TILE_MAX_ZOOM", 15)
+TILE_BIN_PX = getattr(settings, "TILE_BIN_PX", 4)  # heat cell edge in pixels
+TILE_HTTP_MAX_AGE = getattr(settings, "TILE_HTTP_MAX_AGE", 300)  # browsers recheck after this; disk tiles live on
+# A cached tile whose routes changed is redrawn at most this often at zoom 10 and deeper;
+# the interval doubles per zoom level above that (outer tiles cover more routes and cost more to draw).
+TILE_REFRESH_INTERVAL = getattr(settings, "TILE_REFRESH_INTERVAL", 300)
+TILE_REFRESH_MAX = getattr(settings, "TILE_REFRESH_MAX", 86400)
+TILE_RENDER_WORKERS = getattr(settings, "TILE_RENDER_WORKERS", 2)
+
+TILE_SIZE = 256
+MAX_LAT = 85.05112878  # web-mercator limit
+
+
+# -------------------------
+# Tile math
+# -------------------------
+def project(lats, lons, zoom):
+    """Web-mercator world pixel coordinates (x, y) at `zoom`."""
+    scale = TILE_SIZE * 2 ** zoom
+    lat = np.radians(np.clip(np.asarray(lats, dtype=np.float64), -MAX_LAT, MAX_LAT))
+    x = (np.asarray(lons, dtype=np.float64) + 180.0) / 360.0 * scale
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0 * scale
+    return x, y
+
+
+def tile_bounds(z, x, y):
+    """(south, west, north, east) in degrees."""
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return lat(y + 1), x / n * 360.0 - 180.0, lat(y), (x + 1) / n * 360.0 - 180.0
+
+
+def tile_range(z, south, west, north, east):
+    """Inclusive (x0, x1, y0, y1) of the tiles covering a bounding box."""
+    (x0, x1), (y1, y0) = ((v // TILE_SIZE).astype(int) for v in project([south, north], [west, east], z))
+    last = 2 ** z - 1
+    return max(0, x0), min(last, x1), max(0, y0), min(last, y1)
+
+
+# -------------------------
+# Stored geometry
+# -------------------------
+def _bbox(points):
+    return {
+        "min_lat": float(points[:, 0].min()), "min_lon": float(points[:, 1].min()),
+        "max_lat": float(points[:, 0].max()), "max_lon": float(points[:, 1].max()),
+    }
+
+
+def route_line(coords):
+    """
+    What a history row carries to apply(): the route simplified for the
+    deepest tile zoom and polyline-encoded, plus its bounding box. Built
+    before the row is queued, so the write-behind queue holds a short string
+    rather than the full coordinate list. None for lines too short to draw.
+    """
+    if coords is None or len(coords) < 2:
+        return None
+    points, _ = geometry.simplify_for_zoom(coords, TILE_MAX_ZOOM)
+    return dict(_bbox(points), polyline=geometry.encode_polyline(points))
+
+
+def apply(rows):
+    """
+    Store the route line of newly written history rows once per place pair
+    (rows carry it in `route_line`). Cached tiles are left alone: the
+    bumped updated_at marks them stale, and get_tile redraws them later.
+    """
+    latest = {}
+    for row in rows:
+        line = getattr(row, "route_line", None)
+        if line is not None:
+            pair = (row.source_place_id, row.destination_place_id)
+            latest[pair] = (latest.get(pair, (0,))[0] + 1, row, line)
+
+    for (source, destination), (count, row, line) in latest.items():
+        lookup = {"source_place_id": source, "destination_place_id": destination}
+        fields = dict(line, distance_km=row.distance, eco_cost=row.eco_cost)
+        # the box only grows, so tiles the previous line crossed still see the change
+        updates = dict(fields, routes=F("routes") + count, updated_at=timezone.now(),
+                       min_lat=Least("min_lat", Value(fields["min_lat"])),
+                       min_lon=Least("min_lon", Value(fields["min_lon"])),
+                       max_lat=Greatest("max_lat", Value(fields["max_lat"])),
+                       max_lon=Greatest("max_lon", Value(fields["max_lon"])))
+        if not RouteGeometry.objects.filter(**lookup).update(**updates):
+            try:
+                with transaction.atomic():
+                    RouteGeometry.objects.create(routes=count, **lookup, **fields)
+            except IntegrityError:
+                # another writer created it first
+                RouteGeometry.objects.filter(**lookup).update(**updates)
+
+
+# -------------------------
+# Rendering
+# -------------------------
+def _ramp(eco_cost, count):
+    """RGBA for heat cells: green (low eco cost) through yellow to red, more opaque where busier."""
+    c = np.clip(eco_cost, 0, 100)
+    rgba = np.zeros(c.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = np.minimum(255, c * 5.1)
+    rgba[..., 1] = np.minimum(255, (100 - c) * 5.1)
+    rgba[..., 3] = np.where(count > 0, np.clip(110 + 40 * np.log2(np.maximum(count, 1)), 0, 230), 0)
+    return rgba
+
+
+def encode_png(rgba):
+    """Minimal RGBA PNG writer, enough for map tiles."""
+    height, width = rgba.shape[:2]
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)], axis=1)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+            + chunk(b"IEND", b""))
+
+
+def _cells(points, z, x, y, bins):
+    """Heat cells of this tile one route line passes through (flat indices, each once)."""
+    px, py = project(points[:, 0], points[:, 1], z)
+    px, py = px - x * TILE_SIZE, py - y * TILE_SIZE
+    x0, y0, x1, y1 = px[:-1], py[:-1], px[1:], py[1:]
+    # only segments whose extent touches the tile
+    near = ((np.maximum(x0, x1) >= 0) & (np.minimum(x0, x1) < TILE_SIZE)
+            & (np.maximum(y0, y1) >= 0) & (np.minimum(y0, y1) < TILE_SIZE))
+    if not near.any():
+        return np.arange(0)
+    x0, y0, dx, dy = x0[near], y0[near], (x1 - x0)[near], (y1 - y0)[near]
+    # sample every half cell along each segment so no crossed cell is skipped
+    steps = np.maximum(1, np.ceil(np.hypot(dx, dy) / (TILE_BIN_PX / 2))).astype(np.int64)
+    seg = np.repeat(np.arange(len(steps)), steps)
+    t = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(steps, steps)
+    sx = np.append(x0[seg] + t * dx[seg], x0[-1] + dx[-1])
+    sy = np.append(y0[seg] + t * dy[seg], y0[-1] + dy[-1])
+    inside = (sx >= 0) & (sx < TILE_SIZE) & (sy >= 0) & (sy < TILE_SIZE)
+    cx = (sx[inside] // TILE_BIN_PX).astype(np.int64)
+    cy = (sy[inside] // TILE_BIN_PX).astype(np.int64)
+    return np.unique(cy * bins + cx)
+
+
+def render_tile(z, x, y):
+    """
+    Heat grid of every stored route crossing the tile: each cell is colored by
+    the search-weighted mean eco_cost of the routes through it and gets more
+    opaque the more searches pass through. Returns PNG bytes.
+    """
+    bins = TILE_SIZE // TILE_BIN_PX
+    count = np.zeros(bins * bins)
+    cost = np.zeros(bins * bins)
+    south, west, north, east = tile_bounds(z, x, y)
+    rows = RouteGeometry.objects.filter(
+        min_lat__lte=north, max_lat__gte=south, min_lon__lte=east, max_lon__gte=west
+    ).values_list("polyline", "eco_cost", "routes")
+    for polyline, eco_cost, routes in rows.iterator(chunk_size=500):
+        points = np.asarray(geometry.decode_polyline(polyline))
+        if len(points) < 2:
+            continue
+        cells = _cells(points, z, x, y, bins)
+        count[cells] += routes
+        cost[cells] += (eco_cost if eco_cost is not None else 50.0) * routes
+    mean = np.divide(cost, count, out=np.zeros_like(cost), where=count > 0)
+    rgba = _ramp(mean.reshape(bins, bins), count.reshape(bins, bins))
+    return encode_png(np.repeat(np.repeat(rgba, TILE_BIN_PX, axis=0), TILE_BIN_PX, axis=1))
+
+
+# -------------------------
+# Disk cache
+# -------------------------
+_renderer = ThreadPoolExecutor(max_workers=TILE_RENDER_WORKERS, thread_name_prefix="greenroute-tiles")
+_rendering = set()
+_rendering_lock = threading.Lock()
+
+
+def _path(z, x, y):
+    return os.path.join(TILE_CACHE_DIR, str(z), str(x), f"{y}.png")
+
+
+def refresh_interval(z):
+    return min(TILE_REFRESH_MAX, TILE_REFRESH_INTERVAL * 2 ** max(0, 10 - z))
+
+
+def _save(z, x, y):
+    data = render_tile(z, x, y)
+    path = _path(z, x, y)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so readers never see half a file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.error(f"Tile cache write error: {e}")
+    return data
+
+
+def is_stale(z, x, y):
+    """
+    True if the cached tile is older than its refresh interval and a route
+    crossing it changed since it was drawn. A tile found unchanged is not
+    asked again for another interval.
+    """
+    path = _path(z, x, y)
+    try:
+        drawn = os.path.getmtime(path)
+    except OSError:
+        return False
+    if time.time() - drawn < refresh_interval(z):
+        return False
+    south, west, north, east = tile_bounds(z, x, y)
+    changed = RouteGeometry.objects.filter(
+        min_lat__lte=north, max_lat__gte=south, min_lon__lte=east, max_lon__gte=west,
+        updated_at__gt=datetime.fromtimestamp(drawn, tz=dt_timezone.utc),
+    ).exists()
+    if not changed:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+    return changed
+
+
+def _redraw(key):
+    try:
+        _save(*key)
+    except Exception as e:
+        logger.error(f"Tile refresh error for {key}: {e}")
+    finally:
+        with _rendering_lock:
+            _rendering.discard(key)
+        close_old_connections()
+
+
+def refresh(z, x, y):
+    """Redraw a tile in the background, once however many requests ask for it."""
+    key = (z, x, y)
+    with _rendering_lock:
+        if key in _rendering:
+            return False
+        _rendering.add(key)
+    _renderer.submit(_redraw, key)
+    return True
+
+
+def get_tile(z, x, y):
+    """
+    PNG bytes for a tile, rendered once and then served from TILE_CACHE_DIR.
+    A stale tile is still served as is while a fresh copy is drawn behind it.
+    """
+    try:
+        with open(_path(z, x, y), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        metrics.tile_requests.inc("miss")
+        # concurrent misses on one tile share a single render
+        return singleflight.do(("tile", z, x, y), _save, z, x, y)
+    if is_stale(z, x, y):
+        metrics.tile_requests.inc("stale")
+        refresh(z, x, y)
+    else:
+        metrics.tile_requests.inc("hit")
+    return data
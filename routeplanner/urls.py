@@ -12,4 +12,9 @@ urlpatterns = [
     path('logout/', views.custom_logout_view, name='logout'),
 
     path('api/route/', views.route_api_view, name='route_api'),
+    path('api/route/batch/', views.route_batch_api_view, name='route_batch_api'),
+    path('api/history/', views.history_api_view, name='history_api'),
+    path('api/history/export/', views.history_export_view, name='history_export'),
+    path('tiles/routes/<int:z>/<int:x>/<int:y>.png', views.route_tile_view, name='route_tiles'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
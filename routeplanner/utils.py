@@ -1,6 +1,7 @@
-import requests
 import logging
 
+from . import clients, metrics
+
 logger = logging.getLogger(__name__)
 
 OVERPASS_URL = "http://overpass-api.de/api/interpreter"
@@ -21,7 +22,7 @@ def get_green_cover(lat1, lon1, lat2, lon2, user_input=None):
     # 2. NDVI API (Remote sensing)
     try:
         ndvi_url = f"https://api.agromonitoring.com/ndvi?lat1={lat1}&lon1={lon1}&lat2={lat2}&lon2={lon2}"
-        resp = requests.get(ndvi_url, timeout=10)
+        resp = clients.get_client("agro").get(ndvi_url, timeout=10)
         if resp.status_code == 200:
             ndvi_data = resp.json()
             if "green_cover" in ndvi_data:
@@ -43,7 +44,7 @@ def get_green_cover(lat1, lon1, lat2, lon2, user_input=None):
         );
         out count;
         """
-        response = requests.post(OVERPASS_URL, data={'data': query}, timeout=25)
+        response = clients.get_client("overpass").post(OVERPASS_URL, data={'data': query}, timeout=25)
         if response.status_code == 200:
             data = response.json()
             if "elements" in data:
@@ -57,6 +58,7 @@ def get_green_cover(lat1, lon1, lat2, lon2, user_input=None):
 
     # 4. Fallback Default
     if not green_values:
+         metrics.fallbacks.inc("green_cover", "agro+overpass", "default")
          logger.info("Using default green cover: 70%")
          return 70.0
 
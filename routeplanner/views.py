@@ -1,18 +1,31 @@
+import contextvars
+import hmac
 import logging
-import requests
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+from datetime import datetime, time as dt_time, timedelta
+
+import numpy as np
 
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_POST
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import logout
 from django.contrib import messages
-from django.db.models import Avg, Count
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
-from adminpanel.models import RouteHistory
+from . import (
+    clients, exports, geocache, geometry, greencover, history, metrics, providers, raster, rollups, routecache, scoring,
+    scheduler, singleflight, spatial, tiles,
+)
+from .models import RouteHistory
 
 logger = logging.getLogger(__name__)
 
@@ -21,40 +34,94 @@ logger = logging.getLogger(__name__)
 # -------------------------
 ORS_API_KEY = getattr(settings, "ORS_API_KEY", "") or getattr(settings, "OPENROUTESERVICE_API_KEY", "")
 ORS_API_KEY = ORS_API_KEY.strip() if isinstance(ORS_API_KEY, str) else ""
+# several keys spread the per-key quotas; ORS_API_KEY alone still works
+ORS_API_KEYS = [k.strip() for k in getattr(settings, "ORS_API_KEYS", []) if k.strip()] or [ORS_API_KEY]
 AGRO_API_KEY = getattr(settings, "AGRO_API_KEY", "")
+DEFAULT_GREEN_COVER = 70.0
+
+PIPELINE_WORKERS = getattr(settings, "PIPELINE_WORKERS", 32)
+PIPELINE_REQUEST_BUDGET = getattr(settings, "PIPELINE_REQUEST_BUDGET", 20)  # seconds, whole request
+PIPELINE_STAGE_TIMEOUTS = {
+    "geocode": 9,
+    "route": 13,
+    "green_cover": 8,
+    **getattr(settings, "PIPELINE_STAGE_TIMEOUTS", {}),
+}
+BATCH_MAX_PAIRS = getattr(settings, "BATCH_MAX_PAIRS", 1000)
+BATCH_MATRIX_MAX_PLACES = getattr(settings, "BATCH_MATRIX_MAX_PLACES", 100)  # per matrix/table call
+BATCH_REQUEST_BUDGET = getattr(settings, "BATCH_REQUEST_BUDGET", 120)  # seconds
+BATCH_WORKERS = getattr(settings, "BATCH_WORKERS", 8)  # provider calls at batch / background priority
+ROUTE_GREEN_PROBES = getattr(settings, "ROUTE_GREEN_PROBES", 6)  # remote lookups along a route, endpoints included
+ROUTE_MAX_ALTERNATIVES = getattr(settings, "ROUTE_MAX_ALTERNATIVES", 5)
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="greenroute")
+# candidates are scored here; their green-cover probes go to _executor, so neither pool waits on itself
+_scoring_executor = ThreadPoolExecutor(max_workers=max(2, PIPELINE_WORKERS // 4), thread_name_prefix="greenroute-score")
+# batch and background calls can wait up to their SCHEDULER_MAX_WAIT for a provider token;
+# they get their own pool so the waiting never holds the workers interactive requests need
+_bulk_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="greenroute-bulk")
+routecache.set_executor(_bulk_executor)  # stale-route refreshes run at background priority
+scheduler.set_keys("ors", ORS_API_KEYS)
+scheduler.set_keys("agro", [AGRO_API_KEY])
+
+def _submit(fn, *args):
+    # carry the caller's context (scheduler priority) into the worker thread
+    pool = _executor if scheduler.current_priority() == "interactive" else _bulk_executor
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+def _submit_batch(fn, *args):
+    return _bulk_executor.submit(contextvars.copy_context().run, scheduler.with_priority, "batch", fn, *args)
 
 # -------------------------
 # Helper functions
 # -------------------------
+def _shared_geocode(provider, place, fetch):
+    """Cached geocode; on a miss only one worker across processes asks the provider."""
+    hit, cached = geocache.get(provider, place)
+    if hit:
+        return cached
+    return singleflight.locked_fill(
+        f"geocode:{provider}:{geocache.normalize_place(place)}",
+        lambda: geocache.get(provider, place),
+        lambda: fetch(place),
+    )
+
 def ors_geocode(place):
+    return _shared_geocode("ors", place, _ors_geocode)
+
+def _ors_geocode(place):
     try:
-        resp = requests.get(
+        resp = clients.get_client("ors").get(
             "https://api.openrouteservice.org/geocode/search",
-            params={"api_key": ORS_API_KEY, "text": place, "size": 1},
+            params={"text": place, "size": 1},
+            key_param="api_key",
+            endpoint="geocode",
             timeout=8
         )
-        if resp.status_code == 403:
-            return {"forbidden": True}
         resp.raise_for_status()
         features = resp.json().get("features", [])
         if not features:
+            geocache.put("ors", place, None)
             return None
         lon, lat = features[0]["geometry"]["coordinates"]
+        geocache.put("ors", place, (lat, lon))
         return (lat, lon)
     except Exception as e:
         logger.error(f"ORS geocode error: {e}")
         return None
 
 def ors_route(slat, slon, dlat, dlon):
+    return routecache.cached_route("ors", "driving-car", _ors_route, slat, slon, dlat, dlon)
+
+def _ors_route(slat, slon, dlat, dlon):
     try:
-        resp = requests.post(
+        resp = clients.get_client("ors").post(
             "https://api.openrouteservice.org/v2/directions/driving-car",
-            headers={"Authorization": ORS_API_KEY, "Content-Type": "application/json"},
+            headers={"Content-Type": "application/json"},
+            key_header="Authorization",
+            endpoint="directions",
             json={"coordinates": [[slon, slat], [dlon, dlat]]},
             timeout=12
         )
-        if resp.status_code == 403:
-            return {"forbidden": True}
         resp.raise_for_status()
         feat = resp.json()["features"][0]
         coords = [[lat, lon] for lon, lat in feat["geometry"]["coordinates"]]
@@ -65,8 +132,11 @@ def ors_route(slat, slon, dlat, dlon):
         return None
 
 def nominatim_geocode(place):
+    return _shared_geocode("nominatim", place, _nominatim_geocode)
+
+def _nominatim_geocode(place):
     try:
-        resp = requests.get(
+        resp = clients.get_client("nominatim").get(
             "https://nominatim.openstreetmap.org/search",
             params={"q": place, "format": "json", "limit": 1},
             headers={"User-Agent": "GreenRoute/1.0"},
@@ -75,15 +145,21 @@ def nominatim_geocode(place):
         resp.raise_for_status()
         data = resp.json()
         if not data:
+            geocache.put("nominatim", place, None)
             return None
-        return (float(data[0]["lat"]), float(data[0]["lon"]))
+        coords = (float(data[0]["lat"]), float(data[0]["lon"]))
+        geocache.put("nominatim", place, coords)
+        return coords
     except Exception as e:
         logger.error(f"Nominatim geocode error: {e}")
         return None
 
 def osrm_route(slat, slon, dlat, dlon):
+    return routecache.cached_route("osrm", "driving", _osrm_route, slat, slon, dlat, dlon)
+
+def _osrm_route(slat, slon, dlat, dlon):
     try:
-        resp = requests.get(
+        resp = clients.get_client("osrm").get(
             f"https://router.project-osrm.org/route/v1/driving/{slon},{slat};{dlon},{dlat}",
             params={"overview": "full", "geometries": "geojson"},
             timeout=12
@@ -97,59 +173,440 @@ def osrm_route(slat, slon, dlat, dlon):
         logger.error(f"OSRM route error: {e}")
         return None
 
-def get_green_cover(lat, lon):
+def ors_alternatives(slat, slon, dlat, dlon, k):
+    return routecache.cached_route("ors", f"driving-car-alt{k}", lambda *c: _ors_alternatives(*c, k),
+                                   slat, slon, dlat, dlon)
+
+def _ors_alternatives(slat, slon, dlat, dlon, k):
+    """Up to k routes; ORS offers at most 3 and only for trips under 100 km."""
     try:
-        if not AGRO_API_KEY:
-            return 70.0
-        poly_url = "http://api.agromonitoring.com/agro/1.0/polygons"
-        poly_body = {
-            "name": "point_area",
-            "geo_json": {
-                "type": "Feature",
-                "properties": {},
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": [[
-                        [lon - 0.01, lat - 0.01],
-                        [lon - 0.01, lat + 0.01],
-                        [lon + 0.01, lat + 0.01],
-                        [lon + 0.01, lat - 0.01],
-                        [lon - 0.01, lat - 0.01]
-                    ]]
-                }
+        resp = clients.get_client("ors").post(
+            "https://api.openrouteservice.org/v2/directions/driving-car/geojson",
+            headers={"Content-Type": "application/json"},
+            key_header="Authorization",
+            endpoint="directions",
+            json={
+                "coordinates": [[slon, slat], [dlon, dlat]],
+                "alternative_routes": {"target_count": min(k, 3), "share_factor": 0.6, "weight_factor": 1.6},
+            },
+            timeout=12
+        )
+        resp.raise_for_status()
+        return [
+            {
+                "distance_km": round(feat["properties"]["summary"]["distance"] / 1000, 3),
+                "coords": [[lat, lon] for lon, lat in feat["geometry"]["coordinates"]],
             }
-        }
-        poly_resp = requests.post(poly_url, json=poly_body, params={"appid": AGRO_API_KEY}, timeout=12)
-        poly_resp.raise_for_status()
-        poly_id = poly_resp.json().get("id")
-        if not poly_id:
-            return 70.0
-        ndvi_url = "http://api.agromonitoring.com/agro/1.0/ndvi/history"
-        ndvi_resp = requests.get(ndvi_url, params={"polyid": poly_id, "appid": AGRO_API_KEY}, timeout=12)
-        ndvi_resp.raise_for_status()
-        ndvi_data = ndvi_resp.json()
-        if isinstance(ndvi_data, list) and ndvi_data:
-            ndvi = ndvi_data[-1].get("mean", 0)
-            return round(max(0, min(100, (ndvi + 1) * 50)), 1)
+            for feat in resp.json()["features"]
+        ] or None
     except Exception as e:
-        logger.error(f"Agro API error: {e}")
-    return 70.0
+        logger.error(f"ORS alternatives error: {e}")
+        return None
 
-def compute_eco_metrics(distance_km, src_lat, src_lon, dst_lat, dst_lon):
-    pollution_index = min(100.0, round((distance_km / 500) * 100, 2))
-    g_src = get_green_cover(src_lat, src_lon)
-    g_dst = get_green_cover(dst_lat, dst_lon)
-    green_cover = round((g_src + g_dst) / 2, 1)
+def osrm_alternatives(slat, slon, dlat, dlon, k):
+    return routecache.cached_route("osrm", f"driving-alt{k}", lambda *c: _osrm_alternatives(*c, k),
+                                   slat, slon, dlat, dlon)
+
+def _osrm_alternatives(slat, slon, dlat, dlon, k):
+    try:
+        resp = clients.get_client("osrm").get(
+            f"https://router.project-osrm.org/route/v1/driving/{slon},{slat};{dlon},{dlat}",
+            params={"overview": "full", "geometries": "geojson", "alternatives": k},
+            timeout=12
+        )
+        resp.raise_for_status()
+        return [
+            {
+                "distance_km": round(route["distance"] / 1000, 3),
+                "coords": [[lat, lon] for lon, lat in route["geometry"]["coordinates"]],
+            }
+            for route in resp.json()["routes"][:k]
+        ] or None
+    except Exception as e:
+        logger.error(f"OSRM alternatives error: {e}")
+        return None
+
+def ors_matrix(points):
+    """Driving distances (km) between all (lat, lon) points in one ORS call; None on failure."""
+    try:
+        resp = clients.get_client("ors").post(
+            "https://api.openrouteservice.org/v2/matrix/driving-car",
+            headers={"Content-Type": "application/json"},
+            key_header="Authorization",
+            endpoint="matrix",
+            json={"locations": [[lon, lat] for lat, lon in points], "metrics": ["distance"], "units": "km"},
+            timeout=20
+        )
+        resp.raise_for_status()
+        return resp.json()["distances"]
+    except Exception as e:
+        logger.error(f"ORS matrix error: {e}")
+        return None
+
+def osrm_table(points):
+    """Driving distances (km) between all (lat, lon) points in one OSRM table call; None on failure."""
+    try:
+        coords = ";".join(f"{lon},{lat}" for lat, lon in points)
+        resp = clients.get_client("osrm").get(
+            f"https://router.project-osrm.org/table/v1/driving/{coords}",
+            params={"annotations": "distance"},
+            timeout=20
+        )
+        resp.raise_for_status()
+        return [[None if m is None else m / 1000 for m in row] for row in resp.json()["distances"]]
+    except Exception as e:
+        logger.error(f"OSRM table error: {e}")
+        return None
+
+def get_green_cover(lat, lon):
+    key = ("green_cover", round(lat, 4), round(lon, 4))
+    cover = singleflight.do(key, providers.first, "green_cover", lat, lon)
+    return DEFAULT_GREEN_COVER if cover is None else cover
+
+def eco_metrics(distance_km, green_cover, pollution=None):
+    # measured pollution along the route (local raster, 0-100) when there is one, else a distance proxy
+    if pollution is not None:
+        pollution_index = round(min(100.0, max(0.0, float(pollution))), 2)
+    else:
+        pollution_index = min(100.0, round((distance_km / 500) * 100, 2))
     eco_score = round(max(0.0, min(100.0, (green_cover * 0.7) - (pollution_index * 0.3))), 2)
     eco_cost = round(100.0 - eco_score, 2)
     return pollution_index, green_cover, eco_score, eco_cost
 
+def eco_metrics_many(distances_km, green_covers, pollutions=None):
+    """eco_metrics over arrays of candidates at once (None in pollutions = no reading); returns four arrays."""
+    distances_km = np.asarray(distances_km, dtype=np.float64)
+    green_covers = np.asarray(green_covers, dtype=np.float64)
+    pollution_index = np.minimum(100.0, np.round(distances_km / 500 * 100, 2))
+    if pollutions is not None:
+        measured = np.array([np.nan if p is None else p for p in pollutions], dtype=np.float64)
+        pollution_index = np.where(np.isnan(measured), pollution_index, np.round(np.clip(measured, 0.0, 100.0), 2))
+    eco_score = np.round(np.clip(green_covers * 0.7 - pollution_index * 0.3, 0.0, 100.0), 2)
+    return pollution_index, green_covers, eco_score, np.round(100.0 - eco_score, 2)
+
+def pareto_front(distances, costs):
+    """Indices of candidates no other candidate beats on both distance and eco_cost, shortest first."""
+    order = np.lexsort((costs, distances))
+    front, best = [], np.inf
+    for i in order:
+        if costs[i] < best:
+            front.append(int(i))
+            best = costs[i]
+    return front
+
+def compute_eco_metrics(distance_km, src_lat, src_lon, dst_lat, dst_lon):
+    g_src = get_green_cover(src_lat, src_lon)
+    g_dst = get_green_cover(dst_lat, dst_lon)
+    return eco_metrics(distance_km, round((g_src + g_dst) / 2, 1))
+
+# -------------------------
+# Provider backends
+# -------------------------
+# The lambdas look the helpers up at call time so settings and patches apply.
+# PROVIDER_BACKENDS can reorder these or swap in the local stand-ins.
+def _has_ors_key():
+    return bool(ORS_API_KEY or any(ORS_API_KEYS))
+
+providers.register("geocoder", "ors", lambda place: ors_geocode(place), 10, _has_ors_key, circuit="ors")
+providers.register("geocoder", "nominatim", lambda place: nominatim_geocode(place), 20, circuit="nominatim")
+providers.register("router", "ors", lambda *c: ors_route(*c), 10, _has_ors_key, circuit="ors")
+providers.register("router", "osrm", lambda *c: osrm_route(*c), 20, circuit="osrm")
+providers.register("alternatives", "ors", lambda *a: ors_alternatives(*a), 10, _has_ors_key, circuit="ors")
+providers.register("alternatives", "osrm", lambda *a: osrm_alternatives(*a), 20, circuit="osrm")
+providers.register("matrix", "ors", lambda points: ors_matrix(points), 10, _has_ors_key, circuit="ors")
+providers.register("matrix", "osrm", lambda points: osrm_table(points), 20, circuit="osrm")
+providers.register("green_cover", "raster", lambda lat, lon: raster.green_cover(lat, lon), 10,
+                   lambda: raster.ECO_DATA_MODE == "local")
+providers.register("green_cover", "agro", lambda lat, lon: greencover.green_cover(lat, lon), 20,
+                   lambda: raster.ECO_DATA_MODE != "local" and bool(AGRO_API_KEY))
+
+# -------------------------
+# Request pipeline
+# -------------------------
+# Concurrent identical lookups share one in-flight call (see singleflight.do).
+def geocode_place(place):
+    """
+    First answer from the configured geocoders (ORS, then Nominatim by default).
+    A "lat,lon" query never goes to a geocoder: it snaps to a nearby known
+    place or road graph node, or else is used as given.
+    """
+    coords = spatial.parse_latlon(place)
+    if coords:
+        return spatial.snap(*coords) or coords
+    return singleflight.do(("geocode", geocache.normalize_place(place)), providers.first, "geocoder", place)
+
+def fetch_route(s, d):
+    key = ("route",) + routecache.make_key("", "", s[0], s[1], d[0], d[1])[:4]
+    return singleflight.do(key, providers.first, "router", s[0], s[1], d[0], d[1])
+
+def fetch_alternatives(s, d, k):
+    """Up to k candidate routes; falls back to the single best route when no backend offers alternatives."""
+    key = ("alternatives", k) + routecache.make_key("", "", s[0], s[1], d[0], d[1])[:4]
+    routes = singleflight.do(key, providers.first, "alternatives", s[0], s[1], d[0], d[1], k)
+    if not routes:
+        route = fetch_route(s, d)
+        routes = [route] if route else None
+    return routes
+
+def _result(future, deadline, stage, default=None):
+    timeout = max(0.0, min(PIPELINE_STAGE_TIMEOUTS[stage], deadline - time.monotonic()))
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        logger.error(f"Pipeline stage '{stage}' timed out after {timeout:.1f}s")
+    except Exception as e:
+        logger.error(f"Pipeline stage '{stage}' failed: {e}")
+    return default
+
+def green_along(lats, lons, g_src, g_dst, deadline):
+    """
+    Green cover at every route sample. The local raster is sampled directly;
+    remote sources are probed at a few evenly spaced samples in parallel and
+    interpolated in between, reusing the endpoint values already fetched.
+    """
+    grid = raster.get_raster() if raster.ECO_DATA_MODE == "local" else None
+    if grid is not None:
+        return grid.sample_many(lats, lons, raster.GREEN)
+
+    n = len(lats)
+    known = {0: g_src, n - 1: g_dst}
+    if providers.backends("green_cover") and n > 2:
+        probes = np.unique(np.linspace(0, n - 1, ROUTE_GREEN_PROBES).round().astype(int))
+        futures = {
+            i: _submit(get_green_cover, lats[i], lons[i])
+            for i in probes if i not in known
+        }
+        for i, future in futures.items():
+            known[i] = _result(future, deadline, "green_cover", DEFAULT_GREEN_COVER)
+    idx = sorted(known)
+    return np.interp(np.arange(n), idx, [known[i] for i in idx])
+
+def score_route(coords, g_src, g_dst, deadline):
+    """Distance-weighted green cover (and pollution, if the raster has it) along the route."""
+    if len(coords) < 2:
+        return {"green_cover": round((g_src + g_dst) / 2, 1), "pollution": None, "segments": []}
+    grid = raster.get_raster() if raster.ECO_DATA_MODE == "local" else None
+    return scoring.route_profile(
+        coords,
+        lambda lats, lons: green_along(lats, lons, g_src, g_dst, deadline),
+        (lambda lats, lons: grid.sample_many(lats, lons, raster.POLLUTION)) if grid else None,
+        default_green=DEFAULT_GREEN_COVER,
+    )
+
+def plan_route(src, dst, alternatives=0):
+    """
+    Geocode both places in parallel, then fetch the route and both green-cover
+    values in parallel, and score green cover along the whole route geometry.
+    Each stage waits at most its own timeout and never past
+    the overall request budget. Identical concurrent requests share one run.
+    With alternatives > 1, up to that many candidate routes are scored
+    concurrently; the result is the lowest eco_cost one, and
+    result["alternatives"] holds the distance / eco_cost Pareto front.
+    Returns (result, error) where error is "location" or "route" on failure.
+    """
+    alternatives = min(max(int(alternatives or 0), 0), ROUTE_MAX_ALTERNATIVES)
+    key = ("plan", geocache.normalize_place(src), geocache.normalize_place(dst), alternatives)
+    return singleflight.do(key, _plan_route, src, dst, alternatives, timeout=PIPELINE_REQUEST_BUDGET)
+
+def _plan_route(src, dst, alternatives=0):
+    deadline = time.monotonic() + PIPELINE_REQUEST_BUDGET
+
+    with metrics.timer("geocode"):
+        fs = _submit(geocode_place, src)
+        fd = _submit(geocode_place, dst)
+        s = _result(fs, deadline, "geocode")
+        d = _result(fd, deadline, "geocode")
+    if not s or not d:
+        return None, "location"
+
+    if alternatives > 1:
+        fr = _submit(fetch_alternatives, s, d, alternatives)
+    else:
+        fr = _submit(fetch_route, s, d)
+    fg_src = _submit(get_green_cover, s[0], s[1])
+    fg_dst = _submit(get_green_cover, d[0], d[1])
+    with metrics.timer("route"):
+        r = _result(fr, deadline, "route")
+    if not r:
+        return None, "route"
+    # the endpoint lookups ran alongside routing; this is only the extra wait
+    with metrics.timer("green_cover"):
+        g_src = _result(fg_src, deadline, "green_cover", DEFAULT_GREEN_COVER)
+        g_dst = _result(fg_dst, deadline, "green_cover", DEFAULT_GREEN_COVER)
+
+    if alternatives <= 1:
+        with metrics.timer("score"):
+            profile = score_route(r["coords"], g_src, g_dst, deadline)
+        pollution_index, green_cover, eco_score, eco_cost = eco_metrics(r["distance_km"], profile["green_cover"], profile["pollution"])
+        return {
+            "source": s,
+            "destination": d,
+            "route": r,
+            "profile": profile,
+            "pollution_index": pollution_index,
+            "green_cover": green_cover,
+            "eco_score": eco_score,
+            "eco_cost": eco_cost,
+        }, None
+
+    with metrics.timer("score"):
+        futures = [
+            _scoring_executor.submit(contextvars.copy_context().run, score_route, c["coords"], g_src, g_dst, deadline)
+            for c in r
+        ]
+        fallback = {"green_cover": round((g_src + g_dst) / 2, 1), "pollution": None, "segments": []}
+        profiles = [_result(f, deadline, "green_cover", fallback) for f in futures]
+    scored = eco_metrics_many([c["distance_km"] for c in r], [p["green_cover"] for p in profiles],
+                              [p["pollution"] for p in profiles])
+    candidates = [
+        {
+            "source": s,
+            "destination": d,
+            "route": c,
+            "profile": p,
+            "pollution_index": float(pi),
+            "green_cover": float(gc),
+            "eco_score": float(es),
+            "eco_cost": float(ec),
+        }
+        for c, p, pi, gc, es, ec in zip(r, profiles, *scored)
+    ]
+    front = [candidates[i] for i in pareto_front(np.asarray([c["distance_km"] for c in r]), scored[3])]
+    best = min(front, key=lambda c: c["eco_cost"])
+    return dict(best, alternatives=front), None
+
+def fetch_matrix(points):
+    if len(points) > BATCH_MATRIX_MAX_PLACES:
+        return None
+    return providers.first("matrix", points)
+
+def plan_batch(pairs, geometry=False):
+    """
+    Route many (source, destination) pairs at once, yielding (index, result, error)
+    as pairs complete. Places are geocoded and green-cover-looked-up once each.
+    Without geometry, distances come from a single provider matrix call; pairs
+    it can't answer (and all pairs when geometry is wanted) are routed one by one.
+    Provider calls run at batch priority, behind interactive requests.
+    """
+    deadline = time.monotonic() + BATCH_REQUEST_BUDGET
+    # normalised names only dedupe; the geocoder gets the first spelling as typed
+    places = {}
+    for pair in pairs:
+        for place in pair:
+            places.setdefault(geocache.normalize_place(place), place)
+    with metrics.timer("batch_geocode"):
+        geocodes = {p: _submit_batch(geocode_place, text) for p, text in places.items()}
+        located = {p: _result(f, deadline, "geocode") for p, f in geocodes.items()}
+    points = {p: loc for p, loc in located.items() if loc}
+    covers = {p: _submit_batch(get_green_cover, *loc) for p, loc in points.items()}
+
+    order = list(points)
+    with metrics.timer("batch_matrix"):
+        matrix = (scheduler.with_priority("batch", fetch_matrix, [points[p] for p in order])
+                  if not geometry and len(order) > 1 else None)
+    pos = {p: i for i, p in enumerate(order)}
+
+    def finish(src, dst, r):
+        g_src = _result(covers[src], deadline, "green_cover", DEFAULT_GREEN_COVER)
+        g_dst = _result(covers[dst], deadline, "green_cover", DEFAULT_GREEN_COVER)
+        if geometry:
+            profile = scheduler.with_priority("batch", score_route, r["coords"], g_src, g_dst, deadline)
+        else:
+            profile = {"green_cover": round((g_src + g_dst) / 2, 1), "pollution": None, "segments": []}
+        pollution_index, green_cover, eco_score, eco_cost = eco_metrics(r["distance_km"], profile["green_cover"], profile["pollution"])
+        return {
+            "source": points[src],
+            "destination": points[dst],
+            "route": r,
+            "profile": profile,
+            "pollution_index": pollution_index,
+            "green_cover": green_cover,
+            "eco_score": eco_score,
+            "eco_cost": eco_cost,
+        }
+
+    pending = {}
+    for i, (src, dst) in enumerate(pairs):
+        src, dst = geocache.normalize_place(src), geocache.normalize_place(dst)
+        if src not in points or dst not in points:
+            yield i, None, "location"
+            continue
+        km = matrix[pos[src]][pos[dst]] if matrix else None
+        if km is not None:
+            yield i, finish(src, dst, {"distance_km": round(km, 3), "coords": []}), None
+        else:
+            pending[_submit_batch(fetch_route, points[src], points[dst])] = (i, src, dst)
+
+    try:
+        for future in as_completed(pending, timeout=max(0.0, deadline - time.monotonic())):
+            i, src, dst = pending.pop(future)
+            r = _result(future, deadline, "route")
+            yield (i, finish(src, dst, r), None) if r else (i, None, "route")
+    except FutureTimeout:
+        for i, _, _ in pending.values():
+            yield i, None, "route"
+
+def _history_row(user, src, dst, result):
+    row = RouteHistory(
+        user=user,
+        source=src,
+        destination=dst,
+        distance=result["route"]["distance_km"],
+        pollution_index=result["pollution_index"],
+        green_cover=result["green_cover"],
+        eco_cost=result["eco_cost"]
+    )
+    row.route_line = tiles.route_line(result["route"]["coords"])  # not a column; tiles.apply keeps one copy per pair
+    return row
+
+def _save_history(user, src, dst, result):
+    # queued; the write-behind recorder bulk-inserts off the request path
+    with metrics.timer("history"):
+        history.record(_history_row(user, src, dst, result))
+
+def _green_color(green_cover):
+    return "green" if green_cover >= 70 else "yellow" if green_cover >= 40 else "red"
+
+def _geometry_options(params):
+    """(zoom, polyline) from ?zoom=<0-19>&encoding=polyline; zoom None means fit the route."""
+    try:
+        zoom = int(params.get("zoom")) if params.get("zoom") not in (None, "") else None
+    except (TypeError, ValueError):
+        zoom = None
+    return zoom, params.get("encoding") == "polyline"
+
+def _route_line(result, zoom=None, polyline=False):
+    # Leaflet-friendly route data; each segment colors coords[start:end + 1].
+    # The line is simplified for `zoom` with segment boundaries kept as vertices.
+    green_cover = result["green_cover"]
+    segments = result["profile"]["segments"]
+    keep = [i for segment in segments for i in (segment["start"], segment["end"])]
+    points, index = geometry.simplify_for_zoom(result["route"]["coords"], zoom, keep)
+    line = {
+        "color": _green_color(green_cover),
+        "weight": 6 if green_cover >= 70 else 4,
+        "segments": [
+            dict(segment, color=_green_color(segment["green_cover"]),
+                 start=int(np.searchsorted(index, segment["start"])),
+                 end=int(np.searchsorted(index, segment["end"])))
+            for segment in segments
+        ],
+    }
+    if polyline:
+        line["polyline"] = geometry.encode_polyline(points)
+        line["precision"] = geometry.POLYLINE_PRECISION
+    else:
+        line["coords"] = points.round(6).tolist()
+    return line
+
 # -------------------------
 # Views
 # -------------------------
 @login_required
+@gzip_page
+@metrics.server_timing
 def index_view(request):
-    ctx = {}
+    ctx = {"tile_zooms": (tiles.TILE_MIN_ZOOM, tiles.TILE_MAX_ZOOM)}
     if request.method == "POST":
         src = request.POST.get("source", "").strip()
         dst = request.POST.get("destination", "").strip()
@@ -157,108 +614,236 @@ def index_view(request):
             ctx["error"] = "Please enter both source and destination."
             return render(request, "index.html", ctx)
 
-        use_ors = bool(ORS_API_KEY)
-        s = ors_geocode(src) if use_ors else nominatim_geocode(src)
-        d = ors_geocode(dst) if use_ors else nominatim_geocode(dst)
-        if s == {"forbidden": True} or d == {"forbidden": True}:
-            use_ors = False
-            s, d = nominatim_geocode(src), nominatim_geocode(dst)
-        if not s or not d:
+        result, error = plan_route(src, dst)
+        if error == "location":
             ctx["error"] = "Could not find location."
             return render(request, "index.html", ctx)
-
-        r = ors_route(s[0], s[1], d[0], d[1]) if use_ors else osrm_route(s[0], s[1], d[0], d[1])
-        if r == {"forbidden": True} or not r:
-            r = osrm_route(s[0], s[1], d[0], d[1])
-        if not r:
+        if error:
             ctx["error"] = "Could not fetch route."
             return render(request, "index.html", ctx)
 
-        pollution_index, green_cover, eco_score, eco_cost = compute_eco_metrics(r["distance_km"], s[0], s[1], d[0], d[1])
-
-        try:
-            RouteHistory.objects.create(
-                user=request.user,
-                source=src,
-                destination=dst,
-                distance_km=r["distance_km"],
-                pollution_index=pollution_index,
-                green_cover=green_cover,
-                eco_cost=eco_cost
-            )
-        except Exception as e:
-            logger.error(f"Failed to save RouteHistory: {e}")
-
-        # Prepare Leaflet-friendly route data
-        route_line = {
-            "coords": r["coords"],
-            "color": "green" if green_cover >= 70 else "yellow" if green_cover >= 40 else "red",
-            "weight": 6 if green_cover >= 70 else 4
-        }
+        _save_history(request.user, src, dst, result)
 
         ctx.update({
             "source": src,
             "destination": dst,
-            "distance": r["distance_km"],
-            "pollution_index": f"{pollution_index}%",
-            "green_cover": f"{green_cover}%",
-            "eco_score": f"{eco_score}%",
-            "eco_cost": f"{eco_cost}%",
-            "route_data": json.dumps(route_line)
+            "distance": result["route"]["distance_km"],
+            "pollution_index": f"{result['pollution_index']}%",
+            "green_cover": f"{result['green_cover']}%",
+            "eco_score": f"{result['eco_score']}%",
+            "eco_cost": f"{result['eco_cost']}%",
+            "route_data": json.dumps(_route_line(result, polyline=True))
         })
     return render(request, "index.html", ctx)
 
 @login_required
+@gzip_page
+@metrics.server_timing
 def route_api_view(request):
     src = request.GET.get("source", "").strip()
     dst = request.GET.get("destination", "").strip()
     if not src or not dst:
+        metrics.requests_total.inc("route", "bad_request")
         return JsonResponse({"error": "Source and destination required"}, status=400)
 
-    use_ors = bool(ORS_API_KEY)
-    s = ors_geocode(src) if use_ors else nominatim_geocode(src)
-    d = ors_geocode(dst) if use_ors else nominatim_geocode(dst)
-    if s == {"forbidden": True} or d == {"forbidden": True} or not s or not d:
-        use_ors = False
-        s, d = nominatim_geocode(src), nominatim_geocode(dst)
-    if not s or not d:
-        return JsonResponse({"error": "Invalid location"}, status=400)
+    try:
+        alternatives = int(request.GET.get("alternatives") or 0)
+    except ValueError:
+        return JsonResponse({"error": "alternatives must be a number"}, status=400)
 
-    r = ors_route(s[0], s[1], d[0], d[1]) if use_ors else osrm_route(s[0], s[1], d[0], d[1])
-    if r == {"forbidden": True} or not r:
-        r = osrm_route(s[0], s[1], d[0], d[1])
-    if not r:
+    result, error = plan_route(src, dst, alternatives)
+    metrics.requests_total.inc("route", error or "ok")
+    if error == "location":
+        return JsonResponse({"error": "Invalid location"}, status=400)
+    if error:
         return JsonResponse({"error": "Could not fetch route"}, status=500)
 
-    pollution_index, green_cover, eco_score, eco_cost = compute_eco_metrics(r["distance_km"], s[0], s[1], d[0], d[1])
+    _save_history(request.user, src, dst, result)
+    zoom, polyline = _geometry_options(request.GET)
+
+    data = {
+        "distance": result["route"]["distance_km"],
+        "pollution_index": result["pollution_index"],
+        "green_cover": result["green_cover"],
+        "eco_score": result["eco_score"],
+        "eco_cost": result["eco_cost"],
+        "route_data": _route_line(result, zoom, polyline)
+    }
+    if "alternatives" in result:
+        data["alternatives"] = [
+            {
+                "distance": alt["route"]["distance_km"],
+                "pollution_index": alt["pollution_index"],
+                "green_cover": alt["green_cover"],
+                "eco_score": alt["eco_score"],
+                "eco_cost": alt["eco_cost"],
+                "selected": alt["route"] is result["route"],
+                "route_data": _route_line(alt, zoom, polyline),
+            }
+            for alt in result["alternatives"]
+        ]
+    return JsonResponse(data)
+
+def _batch_pair(item):
+    if isinstance(item, dict):
+        return str(item["source"]).strip(), str(item["destination"]).strip()
+    source, destination = item  # a [source, destination] array
+    return str(source).strip(), str(destination).strip()
+
+def _batch_pairs(body):
+    """
+    Pairs from a bare list, {"pairs": [...]} or {"origins": [...], "destinations": [...]};
+    list items are {"source", "destination"} objects or [source, destination] arrays.
+    """
+    if isinstance(body, list):
+        pairs = [_batch_pair(p) for p in body]
+    elif "pairs" in body:
+        pairs = [_batch_pair(p) for p in body["pairs"]]
+    else:
+        pairs = [(str(o).strip(), str(d).strip()) for o in body["origins"] for d in body["destinations"]]
+    if not pairs or not all(s and d for s, d in pairs):
+        raise ValueError("Every pair needs a source and a destination")
+    return pairs
 
+@login_required
+@require_POST
+def route_batch_api_view(request):
+    # no gzip_page: it compresses the stream without flushing, so lines would arrive in bursts
     try:
-        RouteHistory.objects.create(
-            user=request.user,
-            source=src,
-            destination=dst,
-            distance_km=r["distance_km"],
-            pollution_index=pollution_index,
-            green_cover=green_cover,
-            eco_cost=eco_cost
-        )
-    except Exception as e:
-        logger.error(f"Failed to save RouteHistory: {e}")
+        body = json.loads(request.body)
+        pairs = _batch_pairs(body)
+    except (ValueError, KeyError, TypeError) as e:
+        return JsonResponse({"error": f"Invalid batch request: {e}"}, status=400)
+    if len(pairs) > BATCH_MAX_PAIRS:
+        return JsonResponse({"error": f"At most {BATCH_MAX_PAIRS} pairs per batch"}, status=400)
+    options = body if isinstance(body, dict) else {}  # a bare list takes the defaults
+    geometry = bool(options.get("geometry"))
+    zoom, polyline = _geometry_options(options)
+    user = request.user
 
-    route_line = {
-        "coords": r["coords"],
-        "color": "green" if green_cover >= 70 else "yellow" if green_cover >= 40 else "red",
-        "weight": 6 if green_cover >= 70 else 4
-    }
+    def stream():
+        errors = {"location": "Invalid location", "route": "Could not fetch route"}
+        for i, result, error in plan_batch(pairs, geometry):
+            src, dst = pairs[i]
+            metrics.requests_total.inc("batch", error or "ok")
+            if error:
+                line = {"index": i, "source": src, "destination": dst, "error": errors[error]}
+            else:
+                _save_history(user, src, dst, result)
+                line = {
+                    "index": i,
+                    "source": src,
+                    "destination": dst,
+                    "distance": result["route"]["distance_km"],
+                    "pollution_index": result["pollution_index"],
+                    "green_cover": result["green_cover"],
+                    "eco_score": result["eco_score"],
+                    "eco_cost": result["eco_cost"],
+                }
+                if geometry:
+                    line["route_data"] = _route_line(result, zoom, polyline)
+            yield json.dumps(line) + "\n"
+
+    return StreamingHttpResponse(stream(), content_type="application/x-ndjson")
+
+def _parse_when(value, end=False):
+    # ISO datetime, or a date meaning its start (since) / end (until)
+    when = parse_datetime(value)
+    if when is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"not a date: {value}")
+        when = datetime.combine(day, dt_time.max if end else dt_time.min)
+    if settings.USE_TZ and timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    return when
+
+def _history_filters(request):
+    """
+    (user id or None for everyone, since, until) from the query string: the
+    requesting user's history, narrowed by ?since= / ?until=.
+    Staff may pass ?user=<id> for someone else's, or ?user=all.
+    """
+    who = request.GET.get("user")
+    if who and request.user.is_staff:
+        user = None if who == "all" else int(who)
+    else:
+        user = request.user.pk
+    since = _parse_when(request.GET["since"]) if request.GET.get("since") else None
+    until = _parse_when(request.GET["until"], end=True) if request.GET.get("until") else None
+    return user, since, until
+
+def _history_queryset(request):
+    user, since, until = _history_filters(request)
+    queryset = RouteHistory.objects.all()
+    if user is not None:
+        queryset = queryset.filter(user_id=user)
+    if since:
+        queryset = queryset.filter(created_at__gte=since)
+    if until:
+        queryset = queryset.filter(created_at__lte=until)
+    return queryset
+
+@login_required
+@gzip_page
+def history_api_view(request):
+    """Keyset-paginated history, newest first: ?limit=&cursor= (the previous page's "next")."""
+    try:
+        queryset = _history_queryset(request)
+        size = min(max(int(request.GET.get("limit") or exports.HISTORY_PAGE_SIZE), 1), exports.HISTORY_PAGE_MAX)
+        cursor = exports.decode_cursor(request.GET["cursor"]) if request.GET.get("cursor") else None
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    rows, next_cursor = exports.page(queryset, cursor, size)
+    return JsonResponse({"results": rows, "next": next_cursor})
+
+@login_required
+def history_export_view(request):
+    """
+    The whole (filtered) history as a streamed ?format=csv (default) or ndjson
+    download. ?include_archived=1 also reads the rows archive_history moved out.
+    """
+    # not gzip_page, which buffers the stream; the download is chunked as it is read
+    fmt = request.GET.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        return JsonResponse({"error": "format must be csv or ndjson"}, status=400)
+    try:
+        queryset = _history_queryset(request)
+        rows = None
+        if request.GET.get("include_archived") in ("1", "true"):
+            user, since, until = _history_filters(request)
+            # iter_history's end is exclusive; ?until= is inclusive
+            end = until + timedelta(microseconds=1) if until else None
+            rows = exports.iter_with_archive(user, since, end)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    if fmt == "csv":
+        response = StreamingHttpResponse(exports.stream_csv(queryset, rows=rows), content_type="text/csv; charset=utf-8")
+    else:
+        response = StreamingHttpResponse(exports.stream_ndjson(queryset, rows=rows), content_type="application/x-ndjson")
+    response["Content-Disposition"] = f'attachment; filename="route-history.{fmt}"'
+    return response
+
+@login_required
+def route_tile_view(request, z, x, y):
+    """Heat tile of all stored routes, colored by eco_cost (staff only)."""
+    if not request.user.is_staff:
+        return HttpResponse("Forbidden", status=403)
+    if not tiles.TILE_MIN_ZOOM <= z <= tiles.TILE_MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return HttpResponse("No such tile", status=404)
+    response = HttpResponse(tiles.get_tile(z, x, y), content_type="image/png")
+    response["Cache-Control"] = f"private, max-age={tiles.TILE_HTTP_MAX_AGE}"
+    return response
 
-    return JsonResponse({
-        "distance": r["distance_km"],
-        "pollution_index": pollution_index,
-        "green_cover": green_cover,
-        "eco_score": eco_score,
-        "eco_cost": eco_cost,
-        "route_data": route_line
-    })
+def metrics_view(request):
+    """Prometheus scrape endpoint: needs the METRICS_TOKEN bearer token, or a staff login when no token is set."""
+    if metrics.METRICS_TOKEN:
+        given = request.headers.get("Authorization", "").encode()
+        if not hmac.compare_digest(given, f"Bearer {metrics.METRICS_TOKEN}".encode()):
+            return HttpResponse("Unauthorized", status=401)
+    elif not request.user.is_staff:
+        return HttpResponse("Forbidden", status=403)
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 def signup_view(request):
     if request.method == "POST":
@@ -279,16 +864,15 @@ def custom_logout_view(request):
 @login_required
 def admin_dashboard(request):
     total_users = User.objects.count()
-    total_routes = RouteHistory.objects.count()
-    avg_ecocost = RouteHistory.objects.aggregate(avg=Avg('eco_cost'))['avg'] or 0
-    pollution_data = list(RouteHistory.objects.order_by('-searched_at')[:10].values_list('pollution_index', flat=True))[::-1]
-    popular_data = list(RouteHistory.objects.values('source', 'destination')
-                        .annotate(count=Count('id')).order_by('-count')[:5])
+    stats = rollups.dashboard_stats(days=10, top=5)
+    # pollution of the last 10 searches, oldest first (history_created serves the seek)
+    pollution_data = list(RouteHistory.objects.order_by("-created_at", "-pk").values_list("pollution_index", flat=True)[:10])[::-1]
+    popular_data = [{"source": p.source, "destination": p.destination, "count": p.routes} for p in stats["popular"]]
     context = {
         "total_users": total_users,
-        "total_routes": total_routes,
-        "avg_ecocost": round(avg_ecocost, 2),
-        "pollution_trends": json.dumps(pollution_data),
-        "popular_routes": json.dumps(popular_data),
+        "total_routes": stats["total_routes"],
+        "avg_ecocost": round(stats["avg_eco_cost"], 2),
+        "pollution_trends": pollution_data,  # json_script'ed by the template
+        "popular_routes": popular_data,
     }
-    return render(request, "adminpanel/dashboard.html", context)
+    return render(request, "dashboard.html", context)
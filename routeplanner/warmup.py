@@ -0,0 +1,202 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import close_old_connections
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import metrics, scheduler
+from .models import Place, RouteHistory
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+WARMUP_TOP_N = getattr(settings, "WARMUP_TOP_N", 50)  # pairs; twice as many places
+WARMUP_HALF_LIFE_DAYS = getattr(settings, "WARMUP_HALF_LIFE_DAYS", 7)  # a search this old counts half
+WARMUP_WINDOW_DAYS = getattr(settings, "WARMUP_WINDOW_DAYS", 60)
+WARMUP_BUDGET = getattr(settings, "WARMUP_BUDGET", 120)  # seconds per run
+WARMUP_WORKERS = getattr(settings, "WARMUP_WORKERS", 4)
+# In-process warming for the web workers (their route cache is per process): the first run starts
+# WARMUP_START_DELAY seconds after boot and repeats every WARMUP_INTERVAL; 0 turns it off. Hourly
+# stays well inside ROUTE_CACHE_TTL, so repeat runs mostly hit the worker's own cache.
+WARMUP_INTERVAL = getattr(settings, "WARMUP_INTERVAL", 60 * 60)
+WARMUP_START_DELAY = getattr(settings, "WARMUP_START_DELAY", 10)
+
+_last = {}  # kind -> coverage of the last run
+
+
+def hot_set(top_n=WARMUP_TOP_N, half_life_days=WARMUP_HALF_LIFE_DAYS, window_days=WARMUP_WINDOW_DAYS, now=None):
+    """
+    The most wanted pairs and places in recent history, each day's searches
+    weighted by 0.5 ** (age in days / half-life). Returns
+    ([(source, destination, score)], [(place, score)]), best first, with at
+    most top_n pairs and 2 * top_n places, named as their Place first was.
+    The database counts searches per pair and day, so only those counts are read.
+    """
+    now = now or timezone.now()
+    today = timezone.localdate(now) if timezone.is_aware(now) else now.date()
+    counts = (
+        RouteHistory.objects.filter(created_at__gte=now - timedelta(days=window_days))
+        .values_list("source_place", "destination_place", TruncDate("created_at"))
+        .annotate(searches=Count("pk"))
+        .order_by()
+    )
+    pairs, places = {}, {}
+    for source, destination, day, searches in counts.iterator(chunk_size=2000):
+        weight = searches * 0.5 ** ((today - day).days / half_life_days)
+        pairs[(source, destination)] = pairs.get((source, destination), 0.0) + weight
+        for place in (source, destination):
+            places[place] = places.get(place, 0.0) + weight
+    top_pairs = sorted(pairs.items(), key=lambda item: -item[1])[:top_n]
+    top_places = sorted(places.items(), key=lambda item: -item[1])[:2 * top_n]
+    names = Place.names([p for pair, _ in top_pairs for p in pair] + [p for p, _ in top_places])
+    return (
+        [(names[s], names[d], score) for (s, d), score in top_pairs],
+        [(names[p], score) for p, score in top_places],
+    )
+
+
+def _coverage(items, warmed):
+    total = sum(item[-1] for item in items)
+    done = sum(item[-1] for item, ok in zip(items, warmed) if ok)
+    return {
+        "total": len(items),
+        "warmed": sum(warmed),
+        "demand": round(done / total, 4) if total else 1.0,  # share of weighted searches covered
+    }
+
+
+def _warm_place(place, green=False):
+    from . import views
+
+    coords = views.geocode_place(place)
+    if coords is not None and green:
+        views.get_green_cover(*coords)
+    return coords is not None
+
+
+def _warm_pair(source, destination):
+    from . import views
+
+    # the full pipeline: geocodes, the route and green cover along it
+    result, error = views.plan_route(source, destination)
+    return error is None
+
+
+def _job(deadline, fn, *args):
+    if time.monotonic() >= deadline:
+        return False
+    # past the deadline provider calls stop queueing for tokens, so a late job winds down quickly
+    with scheduler.priority("background"), scheduler.deadline(deadline):
+        return fn(*args)
+
+
+def _run(jobs, deadline, workers):
+    """
+    Run jobs [(fn, args)] at background priority until the deadline; one ok
+    flag per job. Jobs not started by then are dropped; ones already running
+    are waited for, so none outlives the run or holds scheduler capacity after it.
+    """
+    warmed = [False] * len(jobs)
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="greenroute-warmup")
+    futures = {pool.submit(_job, deadline, fn, *args): i for i, (fn, args) in enumerate(jobs)}
+    wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+    pool.shutdown(wait=True, cancel_futures=True)
+    for future in futures:
+        if future.cancelled():
+            continue
+        try:
+            warmed[futures[future]] = bool(future.result())
+        except Exception as e:
+            logger.error(f"Cache warm-up error: {e}")
+    return warmed
+
+
+def warm(top_n=WARMUP_TOP_N, budget=WARMUP_BUDGET, workers=WARMUP_WORKERS, routes=True, **hot_set_options):
+    """
+    Prefetch the hot set within `budget` seconds: geocodes for the top places
+    first, then the full route pipeline for the top pairs. With routes=False
+    only the tiers shared through the database are warmed: geocodes and green
+    cover for the top places, no route pipeline (its cache lives in each
+    process). Calls go through the provider scheduler at background priority,
+    so they respect the rate limits and give way to live traffic.
+    Returns a coverage report.
+    """
+    started = time.monotonic()
+    deadline = started + budget
+    pairs, places = hot_set(top_n, **hot_set_options)
+
+    warmed_places = _run([(_warm_place, (p, not routes)) for p, _ in places], deadline, workers)
+    report = {"places": _coverage(places, warmed_places)}
+    if routes:
+        warmed_pairs = _run([(_warm_pair, (s, d)) for s, d, _ in pairs], deadline, workers)
+        report["pairs"] = _coverage(pairs, warmed_pairs)
+    _last.update((kind, report[kind]) for kind in ("places", "pairs") if kind in report)
+    report.update(seconds=round(time.monotonic() - started, 2), out_of_time=time.monotonic() >= deadline)
+    return report
+
+
+class PeriodicWarmer:
+    """Background thread that calls warm() every WARMUP_INTERVAL seconds."""
+
+    def __init__(self, interval=WARMUP_INTERVAL, start_delay=WARMUP_START_DELAY):
+        self.interval = interval
+        self.start_delay = start_delay
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _loop(self):
+        delay = self.start_delay
+        while not self._stop.wait(delay):
+            try:
+                report = warm(budget=min(WARMUP_BUDGET, self.interval))
+                logger.info(f"Cache warm-up: {report['pairs']['warmed']}/{report['pairs']['total']} pairs, "
+                            f"{report['places']['warmed']}/{report['places']['total']} places")
+            except Exception as e:
+                logger.error(f"Periodic cache warm-up failed: {e}")
+            finally:
+                close_old_connections()
+            delay = self.interval
+
+    def start(self):
+        if self.interval <= 0:
+            return False
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._loop, name="cache-warmup", daemon=True)
+                self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+
+warmer = PeriodicWarmer()
+
+
+def start_on_first_request(**kwargs):
+    """
+    request_started receiver: start the warmer in processes that serve requests,
+    so migrate, the test runner and other management commands never run it.
+    """
+    request_started.disconnect(dispatch_uid="greenroute-warmup")
+    warmer.start()
+
+
+@metrics.register_collector
+def _collect():
+    return [
+        ("greenroute_warmup_coverage", "gauge",
+         "Share of recency-weighted demand the last cache warm-up covered.",
+         {(("kind", kind),): cov["demand"] for kind, cov in _last.items()}),
+    ]